@@ -2,6 +2,10 @@
 ASGI config for bot_testing project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Chat routes are served by the async views here, so one process can hold many
+concurrent upstream LLM calls without parking a thread per request:
+
+    gunicorn bot_testing.asgi:application -k uvicorn.workers.UvicornWorker
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -12,5 +16,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bot_testing.settings')
+os.environ.setdefault('CHAT_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -0,0 +1,140 @@
+# bot_testing/middleware.py
+
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from custos.integrations.django import CustosCaptureMiddleware
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from chatbot1 import metrics, telemetry
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that also runs natively under ASGI.
+
+    Stock WhiteNoiseMiddleware is sync-only, which makes Django run the whole
+    middleware chain (and every async view behind it) on one shared thread,
+    so concurrent chats are served one at a time.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
+
+
+class ServerTimingMiddleware:
+    """
+    Per-request stage timings (chatbot1.metrics.stage) as a `Server-Timing`
+    header, plus request/status/in-flight metrics. Goes first in MIDDLEWARE
+    so `total` covers every other middleware. Streamed bodies carry only the
+    stages finished before the headers went out; the stream itself is still
+    counted in flight (and in `total`) until it closes.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        from django.conf import settings
+        self.get_response = get_response
+        self.header = getattr(settings, "CHAT_SERVER_TIMING", True)
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+        timings, token = metrics.begin_request()
+        metrics.IN_FLIGHT.inc()
+        t0 = perf_counter()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            metrics.IN_FLIGHT.dec()
+            raise
+        finally:
+            metrics.end_request(token)
+        return self._finish(response, timings, t0)
+
+    async def __acall__(self, request):
+        timings, token = metrics.begin_request()
+        metrics.IN_FLIGHT.inc()
+        t0 = perf_counter()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            metrics.IN_FLIGHT.dec()
+            raise
+        finally:
+            metrics.end_request(token)
+        return self._finish(response, timings, t0)
+
+    def _finish(self, response, timings: list, t0: float):
+        metrics.RESPONSES.inc(str(response.status_code))
+        if self.header:
+            response["Server-Timing"] = metrics.server_timing(timings, perf_counter() - t0)
+
+        def done():
+            metrics.IN_FLIGHT.dec()
+            metrics.observe("total", perf_counter() - t0)
+
+        if not response.streaming:
+            done()
+        elif response.is_async:
+            response.streaming_content = _aclose_after(response.streaming_content, done)
+        else:
+            response.streaming_content = _close_after(response.streaming_content, done)
+        return response
+
+
+def _close_after(content, done):
+    try:
+        yield from content
+    finally:
+        done()
+
+
+async def _aclose_after(content, done):
+    try:
+        async for chunk in content:
+            yield chunk
+    finally:
+        done()
+
+
+class TimedCustosCaptureMiddleware(CustosCaptureMiddleware):
+    """
+    CustosCaptureMiddleware with its work reported as the `custos` stage and
+    its beats queued on chatbot1.telemetry's shipper (no thread per POST).
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.guardian = telemetry.guardian()
+
+    def process_request(self, request):
+        with metrics.stage("custos"):
+            return super().process_request(request)
+
+    def process_response(self, request, response):
+        with metrics.stage("custos"):
+            return super().process_response(request, response)
@@ -7,20 +7,13 @@ import os
 from dotenv import load_dotenv
 import dj_database_url
 
+from chatbot1.env import get_bool
+
 # Load environment variables from .env file
 load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# ------------------------
-# Helper: Parse boolean envs
-# ------------------------
-def get_bool(name: str, default: bool = False) -> bool:
-    val = os.getenv(name)
-    if val is None:
-        return default
-    return val.strip().lower() in {"1", "true", "yes", "y", "on"}
-
 # ------------------------
 # Core settings
 # ------------------------
@@ -51,6 +44,13 @@ MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "140"))
 
 SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT", "")
 
+# Serve /chatbot1/chat/ with the async views (set by bot_testing/asgi.py)
+CHAT_ASYNC_VIEWS = get_bool("CHAT_ASYNC_VIEWS", False)
+
+# Build the chat backend, HTTP pool and Custos guardian in each gunicorn worker
+# before it accepts traffic (gunicorn.conf.py), not on the first chat.
+CHAT_WARMUP = get_bool("CHAT_WARMUP", False)
+
 # ------------------------
 # Installed apps
 # ------------------------
@@ -72,8 +72,9 @@ INSTALLED_APPS = [
 # Middleware
 # ------------------------
 MIDDLEWARE = [
+    "bot_testing.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",      
+    "bot_testing.middleware.AsyncWhiteNoiseMiddleware",
     "corsheaders.middleware.CorsMiddleware",       
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -83,7 +84,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 
 
-    "custos.integrations.django.CustosCaptureMiddleware",
+    "bot_testing.middleware.TimedCustosCaptureMiddleware",
 
 ]
 
@@ -120,6 +121,73 @@ DATABASES = {
     )
 }
 
+# ------------------------
+# Caches (response cache shared tier)
+# ------------------------
+# CHAT_CACHE_SHARED: "" (per-process only), "db" (DatabaseCache; run
+# `manage.py createcachetable`), or a redis:// URL.
+CHAT_CACHE_SHARED = os.getenv("CHAT_CACHE_SHARED", "").strip()
+
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+if CHAT_CACHE_SHARED == "db":
+    CACHES["chat"] = {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "chat_cache"}
+elif CHAT_CACHE_SHARED.startswith(("redis://", "rediss://")):
+    CACHES["chat"] = {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": CHAT_CACHE_SHARED}
+
+CHAT_CACHE_ENABLED = get_bool("CHAT_CACHE", True)
+CHAT_CACHE_TTL = int(os.getenv("CHAT_CACHE_TTL", "600"))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "1024"))
+CHAT_CACHE_ALIAS = "chat" if "chat" in CACHES else ""
+
+# Semantic (near-duplicate) cache: opt-in, per-process, NumPy-backed.
+CHAT_SEMANTIC_CACHE = get_bool("CHAT_SEMANTIC_CACHE", False)
+CHAT_SEMANTIC_THRESHOLD = float(os.getenv("CHAT_SEMANTIC_THRESHOLD", "0.9"))
+CHAT_SEMANTIC_CAPACITY = int(os.getenv("CHAT_SEMANTIC_CAPACITY", "10000"))
+CHAT_SEMANTIC_DIM = int(os.getenv("CHAT_SEMANTIC_DIM", "256"))
+
+# ------------------------
+# Batch endpoint (chatbot1/chat/batch/)
+# ------------------------
+# Most prompts per request, and the most that run at once per batch (a request
+# may ask for fewer via "concurrency").
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "500"))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+
+# ------------------------
+# Conversation sessions (chatbot1/sessions.py)
+# ------------------------
+# Stored in the shared chat cache when CHAT_CACHE_SHARED is set, else per
+# process. The history sent with each turn is kept under MAX_TOKENS
+# (estimated; 0 = unbounded), older turns folded into a summary of up to
+# SUMMARY_TOKENS.
+CHAT_SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", "1800"))
+CHAT_SESSION_MAX_TOKENS = int(os.getenv("CHAT_SESSION_MAX_TOKENS", "600"))
+CHAT_SESSION_SUMMARY_TOKENS = int(os.getenv("CHAT_SESSION_SUMMARY_TOKENS", "120"))
+CHAT_SESSION_MAX_ENTRIES = int(os.getenv("CHAT_SESSION_MAX_ENTRIES", "10000"))
+
+# ------------------------
+# Transcripts (chatbot1.Transcript)
+# ------------------------
+# Replies are queued per process and written with bulk_create by a background
+# thread; a full queue drops the oldest rows rather than slowing requests.
+# `python manage.py prune_transcripts` deletes rows older than the retention.
+CHAT_TRANSCRIPTS = get_bool("CHAT_TRANSCRIPTS", True)
+CHAT_TRANSCRIPT_QUEUE = int(os.getenv("CHAT_TRANSCRIPT_QUEUE", "10000"))
+CHAT_TRANSCRIPT_BATCH = int(os.getenv("CHAT_TRANSCRIPT_BATCH", "500"))
+CHAT_TRANSCRIPT_FLUSH_INTERVAL = float(os.getenv("CHAT_TRANSCRIPT_FLUSH_INTERVAL", "1.0"))
+CHAT_TRANSCRIPT_RETENTION_DAYS = int(os.getenv("CHAT_TRANSCRIPT_RETENTION_DAYS", "30"))
+
+# ------------------------
+# Observability
+# ------------------------
+# Server-Timing response header with per-stage durations (init, cache,
+# provider, clean, fallback, custos, total). /metrics is Prometheus text;
+# set METRICS_TOKEN to require `Authorization: Bearer <token>`.
+CHAT_SERVER_TIMING = get_bool("CHAT_SERVER_TIMING", True)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 # ------------------------
 # Password validation
 # ------------------------
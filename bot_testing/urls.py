@@ -6,8 +6,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
 
+from chatbot1.diag import prometheus_metrics
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("chatbot1/", include("chatbot1.urls")),
     path("ping/", lambda r: JsonResponse({"ok": True})),
+    path("metrics", prometheus_metrics, name="metrics"),
 ]
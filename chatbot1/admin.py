@@ -1,3 +1,12 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Transcript
+
+
+@admin.register(Transcript)
+class TranscriptAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "source", "provider", "model", "latency_ms", "fallback_used", "completion_tokens")
+    list_filter = ("source", "provider", "model", "fallback_used")
+    search_fields = ("prompt", "response")
+    date_hierarchy = "created_at"
+    ordering = ("-created_at",)
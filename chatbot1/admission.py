@@ -0,0 +1,370 @@
+# chatbot1/admission.py
+# Per-process admission control in front of the chat views. At most `limit`
+# chats run at once; up to `queue_size` more wait in FIFO order for at most
+# `max_wait` seconds. Anything beyond that is shed immediately: 429 when the
+# queue is full, 503 when the wait ran out, both with a Retry-After estimate.
+# A batch holds one slot per prompt it runs at once (see `widen`).
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from . import metrics
+from .env import get_bool
+
+ADMISSION_CONTROL = get_bool("ADMISSION_CONTROL", True)
+# Concurrent chats per process; local HF takes far less than a hosted API (which replay stands in for).
+# Override with ADMISSION_LIMIT, or per provider with ADMISSION_LIMIT_<PROVIDER> (0 = unlimited).
+_DEFAULT_LIMITS = {"openai": 32, "ollama": 4, "hf": 2, "replay": 32}
+# Same override scheme: ADMISSION_QUEUE[_<PROVIDER>], ADMISSION_MAX_WAIT[_<PROVIDER>] (seconds).
+_DEFAULT_QUEUE = 16
+_DEFAULT_MAX_WAIT = 10.0
+_RETRY_AFTER_MAX = 60
+
+
+def _env(name: str, provider: str, default, cast):
+    for key in (f"{name}_{provider.upper()}", name):
+        raw = os.getenv(key, "").strip()
+        if raw:
+            return cast(raw)
+    return default
+
+
+def settings_for(provider: str) -> dict:
+    return {
+        "limit": _env("ADMISSION_LIMIT", provider, _DEFAULT_LIMITS.get(provider, 8), int),
+        "queue_size": _env("ADMISSION_QUEUE", provider, _DEFAULT_QUEUE, int),
+        "max_wait": _env("ADMISSION_MAX_WAIT", provider, _DEFAULT_MAX_WAIT, float),
+    }
+
+
+class Rejected(Exception):
+    """Shed without running: `status` is 429 (queue full) or 503 (waited too long)."""
+
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.event, self.loop, self.future = event, loop, future
+        self.granted = False
+
+    def wake(self) -> bool:
+        if self.event is not None:
+            self.event.set()
+            return True
+        try:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        except RuntimeError:  # its event loop is gone
+            return False
+        return True
+
+
+def _resolve(future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class Slot:
+    """One admitted chat. `release` is idempotent; also a context manager."""
+    __slots__ = ("_ctl", "_t0", "_released")
+
+    def __init__(self, ctl: "AdmissionController"):
+        self._ctl = ctl
+        self._t0 = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._ctl._release(time.monotonic() - self._t0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class AdmissionController:
+    """
+    Concurrency limit plus a bounded FIFO wait queue, shared by threaded (WSGI)
+    and async (ASGI) callers. A released slot is handed straight to the oldest
+    waiter, so queued requests are not overtaken by new arrivals.
+    """
+
+    def __init__(self, provider: str, limit: int, queue_size: int, max_wait: float):
+        self.provider = provider
+        self.limit = limit
+        self.queue_size = max(0, queue_size)
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()
+        self._service_s = 0.0  # EWMA of how long an admitted chat holds its slot
+        self._counts = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_timeout": 0, "shed_busy": 0}
+
+    # ----- Admission -----
+    def _enter(self, waiter: _Waiter) -> bool:
+        """Under the lock: True = admitted now, False = queued; raises when the queue is full."""
+        if self._free():
+            self._active += 1
+            self._counts["admitted"] += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            raise self._shed(429, "queue_full")
+        self._waiters.append(waiter)
+        self._counts["queued"] += 1
+        return False
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """Under the lock, after a wait ended without a wake-up: True if the slot arrived anyway."""
+        if waiter.granted:
+            return True
+        self._waiters.remove(waiter)
+        return False
+
+    def _shed(self, status: int, reason: str) -> Rejected:
+        self._counts[f"shed_{reason}"] += 1
+        metrics.SHED.inc(self.provider, reason)
+        backlog = len(self._waiters) + 1
+        estimate = self._service_s * backlog / max(1, self.limit) if self._service_s else 1
+        return Rejected(status, reason, min(_RETRY_AFTER_MAX, max(1, math.ceil(estimate))))
+
+    def _admitted(self, t0: float) -> Slot:
+        metrics.observe("queue", time.monotonic() - t0, self.provider)
+        return Slot(self)
+
+    def _free(self) -> bool:
+        return self.limit <= 0 or (self._active < self.limit and not self._waiters)
+
+    def admit(self, wait: bool = True) -> Slot:
+        """wait=False: a slot only if one is free now, else 429 "busy" (never parks the calling thread)."""
+        t0 = time.monotonic()
+        if not wait:
+            with self._lock:
+                if not self._free():
+                    raise self._shed(429, "busy")
+                self._active += 1
+                self._counts["admitted"] += 1
+            return self._admitted(t0)
+        waiter = _Waiter(event=threading.Event())
+        with self._lock:
+            if self._enter(waiter):
+                return self._admitted(t0)
+        waiter.event.wait(self.max_wait)
+        with self._lock:
+            if not self._give_up(waiter):
+                raise self._shed(503, "timeout")
+        return self._admitted(t0)
+
+    async def aadmit(self) -> Slot:
+        t0 = time.monotonic()
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop=loop, future=loop.create_future())
+        with self._lock:
+            if self._enter(waiter):
+                return self._admitted(t0)
+        try:
+            await asyncio.wait_for(waiter.future, self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Client went away while queued: leave the queue, or pass on a slot we were just handed.
+            with self._lock:
+                granted = self._give_up(waiter)
+            if granted:
+                self._release(None)
+            raise
+        with self._lock:
+            if not self._give_up(waiter):
+                raise self._shed(503, "timeout")
+        return self._admitted(t0)
+
+    def try_admit(self, n: int) -> list:
+        """Up to `n` slots that are free right now: no queueing, no shedding, queued chats go first."""
+        slots = []
+        with self._lock:
+            while len(slots) < n and self._free():
+                self._active += 1
+                self._counts["admitted"] += 1
+                slots.append(Slot(self))
+        return slots
+
+    def _release(self, held) -> None:
+        with self._lock:
+            if held is not None:
+                self._service_s = held if not self._service_s else 0.8 * self._service_s + 0.2 * held
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.wake():
+                    waiter.granted = True  # the slot moves over; _active is unchanged
+                    self._counts["admitted"] += 1
+                    return
+            self._active -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "provider": self.provider,
+                "limit": self.limit,
+                "queue_size": self.queue_size,
+                "max_wait_s": self.max_wait,
+                "active": self._active,
+                "queue_depth": len(self._waiters),
+                "service_ms_avg": round(self._service_s * 1000, 1),
+                **self._counts,
+            }
+
+
+class _NoSlot:
+    """Stand-in Slot when admission control is off."""
+
+    def release(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SLOT = _NoSlot()
+
+
+class Slots:
+    """Slots held together (a batch's lanes); released together."""
+    __slots__ = ("_slots",)
+
+    def __init__(self, slots):
+        self._slots = list(slots)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def release(self) -> None:
+        for slot in self._slots:
+            slot.release()
+
+    def hold(self, futures) -> None:
+        """Move one slot onto each of `futures` still running: freed when that call returns, not with the rest."""
+        for fut in futures:
+            if self._slots and not fut.done():
+                slot = self._slots.pop()
+                fut.add_done_callback(lambda _, slot=slot: slot.release())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class _SyncRelease:
+    def __init__(self, content, slot: Slot):
+        self._content, self._slot = content, slot
+
+    def __iter__(self):
+        try:
+            yield from self._content
+        finally:
+            self._slot.release()
+
+    def close(self):
+        # Content first: its cleanup may keep some of the slots (Slots.hold).
+        try:
+            if hasattr(self._content, "close"):
+                self._content.close()
+        finally:
+            self._slot.release()
+
+
+class _AsyncRelease:
+    def __init__(self, content, slot: Slot):
+        self._content, self._slot = content, slot
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._content:
+                yield chunk
+        finally:
+            self._slot.release()
+
+    def close(self):
+        self._slot.release()
+
+
+def release_after(content, slot: Slot):
+    """
+    Streaming content that frees `slot` when the stream ends. The wrapper has a
+    close() method, so StreamingHttpResponse.close() releases it too, even if
+    the body was never iterated (client gone before the first chunk).
+    """
+    if hasattr(content, "__aiter__"):
+        return _AsyncRelease(content, slot)
+    return _SyncRelease(content, slot)
+
+
+def _provider() -> str:
+    from .models import PROVIDER
+    from .router import MODEL_ROUTES, parse_routes
+    if not MODEL_ROUTES:
+        return PROVIDER
+    # Routed: size the gate for the most constrained backend.
+    providers = [p for p, _ in parse_routes(MODEL_ROUTES)] or [PROVIDER]
+    return min(providers, key=lambda p: settings_for(p)["limit"] or math.inf)
+
+
+_lock = threading.Lock()
+_controller = None
+_controller_pid = None
+
+
+def controller():
+    """This process's AdmissionController, or None when ADMISSION_CONTROL is off."""
+    global _controller, _controller_pid
+    if not ADMISSION_CONTROL:
+        return None
+    pid = os.getpid()
+    if _controller is None or _controller_pid != pid:
+        with _lock:
+            if _controller is None or _controller_pid != pid:
+                provider = _provider()
+                _controller = AdmissionController(provider, **settings_for(provider))
+                _controller_pid = pid
+    return _controller
+
+
+def admit(wait: bool = True):
+    """A slot for one chat (release it when done); raises Rejected when shed."""
+    ctl = controller()
+    return ctl.admit(wait) if ctl is not None else _NO_SLOT
+
+
+async def aadmit():
+    ctl = controller()
+    return await ctl.aadmit() if ctl is not None else _NO_SLOT
+
+
+def widen(slot, width: int) -> Slots:
+    """
+    `slot` plus up to `width - 1` more that are free right now, one per
+    prompt a batch runs at once, so a batch never has more upstream calls
+    in flight than slots. len() of the result is the width to run at.
+    """
+    ctl = controller()
+    if ctl is None:
+        return Slots([slot] * width)  # _NO_SLOT: nothing to hold
+    return Slots([slot, *ctl.try_admit(width - 1)])
@@ -1,14 +1,12 @@
 # custos-chatbot/bot_testing/chatbot1/alignment.py
 
-import os
-from dotenv import load_dotenv
-import custos 
+# `alignment.guardian` is the process's Custos guardian (see chatbot1.telemetry),
+# built on first access rather than at import: importing this module neither
+# reads .env (settings already does) nor starts heartbeats.
 
-# Load .env so we don't hardcode any secrets in code
-load_dotenv()
 
-# Hand the key to Custos (reads backend URL from env automatically)
-custos.set_api_key(os.getenv("CUSTOS_API_KEY", ""))
-
-# Create the guardian. This auto-starts HRV heartbeats in the simulator.
-guardian = custos.guardian()
\ No newline at end of file
+def __getattr__(name):
+    if name == "guardian":
+        from . import telemetry
+        return telemetry.guardian()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
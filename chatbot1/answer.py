@@ -0,0 +1,127 @@
+# chatbot1/answer.py
+# Where a reply of the shape SYSTEM_PROMPT asks for is complete: the line that
+# ends the EARLY_STOP_BULLETS-th meal bullet after any clarifying question, or
+# the last word allowed by EARLY_STOP_WORDS. Anything a model writes past that
+# point ("Enjoy!", more ideas, a second answer) is cut by _clean, and streams
+# and HF generate() stop there instead of decoding it.
+#
+# A bullet is a line led by a list marker (-, *, •, 1., 1)) or an emoji with at
+# least BULLET_MIN_WORDS words after it. Bullets ending in "?" are options of
+# the clarifying question, and a question line after bullets starts the count
+# over, so "Which diet?\n- vegan\n- keto\n- none" never ends an answer.
+#
+# Opt-in (EARLY_STOP=1): it only fits the built-in SYSTEM_PROMPT. Under any
+# other prompt a recipe's fourth step or a long explanation is a real answer.
+
+import os
+import re
+import unicodedata
+
+from .env import get_bool
+
+EARLY_STOP = get_bool("EARLY_STOP")
+EARLY_STOP_BULLETS = int(os.getenv("EARLY_STOP_BULLETS", "3"))
+# Hard cap on words (0 = none); above the prompt's 100 so a slightly long answer is not clipped.
+EARLY_STOP_WORDS = int(os.getenv("EARLY_STOP_WORDS", "120"))
+BULLET_MIN_WORDS = 3
+
+_MARKER_RE = re.compile(r"(?:[-*•·‣▪◦–]|\d{1,2}[.)])\s+")
+_WORD_RE = re.compile(r"\S+")
+
+
+def _bullet_words(line: str) -> int:
+    """Words after the bullet marker of a stripped line, or 0 when it is not a bullet."""
+    m = _MARKER_RE.match(line)
+    if m:
+        body = line[m.end():]
+    elif unicodedata.category(line[0]) == "So":  # emoji-led
+        body = line[1:]
+    else:
+        return 0
+    return len(_WORD_RE.findall(body))
+
+
+class Detector:
+    """
+    Incremental `end`: call `scan` with the text so far, each call extending
+    the previous one. Complete lines are looked at once; only the unfinished
+    last line is rescanned (for the word cap).
+    """
+    __slots__ = ("bullets", "words", "end", "reason", "_pos", "_prev", "_words", "_bullets")
+
+    def __init__(self, bullets: int = EARLY_STOP_BULLETS, words: int = EARLY_STOP_WORDS):
+        self.bullets = bullets
+        self.words = words
+        self.end = -1        # index where the answer ends, once found
+        self.reason = None   # "answer" (bullets) | "words"
+        self._pos = 0        # start of the first line not yet counted
+        self._prev = None    # last non-empty line
+        self._words = 0      # in the counted lines
+        self._bullets = 0    # since the last question
+
+    def _cap(self, text: str, start: int, stop: int) -> int:
+        """Count words in text[start:stop]; index after the last allowed word once one more begins, else -1."""
+        if not self.words:
+            return -1
+        last = start
+        n = self._words
+        for m in _WORD_RE.finditer(text, start, stop):
+            if n == self.words:
+                return last
+            n += 1
+            last = m.end()
+        self._words = n
+        return -1
+
+    def _found(self, end: int, reason: str) -> int:
+        self.end, self.reason = end, reason
+        return end
+
+    def scan(self, text: str) -> int:
+        """Index in `text` where the answer is complete, or -1 (so far)."""
+        if self.end != -1:
+            return self.end
+        pos = self._pos
+        while True:
+            nl = text.find("\n", pos)
+            if nl == -1:
+                break
+            cut = self._cap(text, pos, nl)
+            if cut != -1:
+                return self._found(cut, "words")
+            line = text[pos:nl].strip()
+            pos = self._pos = nl + 1
+            if not line or line == self._prev:
+                continue
+            self._prev = line
+            if line.endswith("?"):
+                if not _MARKER_RE.match(line):
+                    self._bullets = 0  # a question: the ideas come after it
+            elif _bullet_words(line) >= BULLET_MIN_WORDS:
+                self._bullets += 1
+                if self._bullets >= self.bullets:
+                    return self._found(nl, "answer")
+        # The unfinished line can only hit the word cap; it is counted again once complete.
+        words = self._words
+        cut = self._cap(text, pos, len(text))
+        self._words = words
+        return cut if cut == -1 else self._found(cut, "words")
+
+
+def end(text: str) -> int:
+    """Index in `text` where the answer is complete, or -1 (also when EARLY_STOP is off)."""
+    if not EARLY_STOP or not text:
+        return -1
+    return Detector().scan(text)
+
+
+def detector():
+    """A fresh Detector, or None when EARLY_STOP is off."""
+    return Detector() if EARLY_STOP else None
+
+
+def settings():
+    """The detector settings (cache key input), or None when it is off."""
+    if not EARLY_STOP:
+        return None
+    return {"bullets": EARLY_STOP_BULLETS, "words": EARLY_STOP_WORDS}
@@ -0,0 +1,132 @@
+# chatbot1/batching.py
+
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching in front of a batch function.
+
+    Callers submit single prompts; one worker thread takes the first waiting
+    request, keeps collecting for up to `window` seconds or until `max_batch`
+    requests are queued, then runs them through `run_batch` in one call and
+    resolves each caller's future with its own result. A failing batch fails
+    every request in it with the same exception. Every submitted future is
+    resolved: if the worker dies (SystemExit, KeyboardInterrupt) it fails the
+    batch it was running and everything still queued, and the batcher closes.
+
+    `run_batch(prompts, contexts)` also gets each caller's contextvars, so what
+    it records per request (token usage for the transcript, stage timings) can
+    be run in that request's context rather than the worker thread's.
+    """
+
+    def __init__(self, run_batch: Callable[[List[str], List[contextvars.Context]], List[str]],
+                 window: float, max_batch: int):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._counts = {"batches": 0, "requests": 0, "max_seen": 0}
+        self._closed = False
+        self._worker = threading.Thread(target=self._loop, name="hf-microbatch", daemon=True)
+        self._worker.start()
+
+    def submit_future(self, prompt: str) -> Future:
+        fut = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._queue.put((prompt, fut, contextvars.copy_context()))
+        return fut
+
+    def submit(self, prompt: str) -> str:
+        return self.submit_future(prompt).result()
+
+    async def asubmit(self, prompt: str) -> str:
+        return await asyncio.wrap_future(self.submit_future(prompt))
+
+    def close(self) -> None:
+        """Let the worker exit after the requests already queued; submitting afterwards raises RuntimeError."""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(_CLOSE)
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        closing = False
+        while not closing:
+            batch = self._collect()
+            closing = any(item is _CLOSE for item in batch)
+            batch = [(p, f, c) for p, f, c in (item for item in batch if item is not _CLOSE)
+                     if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.run_batch([p for p, _, _ in batch], [c for _, _, c in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"batch returned {len(results)} results for {len(batch)} prompts")
+            except Exception as e:
+                logger.exception("HF batch of %d failed", len(batch))
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+            except BaseException as e:
+                # The worker is going away: nobody would resolve these futures, so fail them now.
+                self._abort(batch, RuntimeError(f"HF batch aborted ({type(e).__name__})"))
+                raise
+            finally:
+                with self._lock:
+                    self._counts["batches"] += 1
+                    self._counts["requests"] += len(batch)
+                    self._counts["max_seen"] = max(self._counts["max_seen"], len(batch))
+            for (_, fut, _), text in zip(batch, results):
+                fut.set_result(text)
+
+    def _abort(self, running: list, error: Exception) -> None:
+        with self._lock:
+            self._closed = True  # nothing is enqueued after this, so the drain below is complete
+        queued = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _CLOSE:
+                queued.append(item)
+        for _, fut, _ in running:
+            fut.set_exception(error)
+        for _, fut, _ in queued:
+            if fut.set_running_or_notify_cancel():
+                fut.set_exception(error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        counts["avg_batch"] = round(counts["requests"] / counts["batches"], 2) if counts["batches"] else 0.0
+        counts["queued"] = self._queue.qsize()
+        return counts
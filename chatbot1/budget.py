@@ -0,0 +1,212 @@
+# chatbot1/budget.py
+# Load-adaptive generation budget. With BUDGET_TARGET_P95_MS set, each
+# backend gets a controller that moves its per-request token cap between
+# BUDGET_MIN_TOKENS and MAX_NEW_TOKENS:
+#   - down (x BUDGET_DECREASE) when chats are queueing for admission or the
+#     provider p95 since the last change is over target;
+#   - up (one step) when p95 is well under target and admission has free
+#     slots, and straight back to the full cap once traffic has gone quiet.
+# At most one change per BUDGET_INTERVAL. In the bottom BUDGET_GREEDY_BELOW of
+# the range sampling also goes greedy. Replies made under a reduced cap are
+# not cached (see MyChatbot1), so a truncated answer never outlives the load.
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from time import perf_counter
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+BUDGET_TARGET_P95_MS = float(os.getenv("BUDGET_TARGET_P95_MS", "0"))  # 0 = off: always MAX_NEW_TOKENS
+BUDGET_MIN_TOKENS = int(os.getenv("BUDGET_MIN_TOKENS", "32"))
+BUDGET_INTERVAL = float(os.getenv("BUDGET_INTERVAL", "5"))
+BUDGET_DECREASE = float(os.getenv("BUDGET_DECREASE", "0.8"))
+# Raise the cap only while p95 is under this fraction of the target.
+BUDGET_HEADROOM = float(os.getenv("BUDGET_HEADROOM", "0.7"))
+# Fraction of the [min, max] range at the bottom where decoding is greedy (0 = never).
+BUDGET_GREEDY_BELOW = float(os.getenv("BUDGET_GREEDY_BELOW", "0.25"))
+BUDGET_MIN_SAMPLES = 10
+BUDGET_WINDOW = 500
+BUDGET_STEPS = 10    # increase by 1/BUDGET_STEPS of the range
+BUDGET_IDLE_INTERVALS = 6
+
+
+class Budget:
+    """Limits for one provider call."""
+    __slots__ = ("tokens", "greedy")
+
+    def __init__(self, tokens: int, greedy: bool = False):
+        self.tokens = tokens
+        self.greedy = greedy
+
+
+def _load() -> tuple:
+    """(chats in flight, chat limit or 0, chats queued) from admission control; zeros when it is off."""
+    from . import admission
+    ctl = admission.controller()
+    if ctl is None:
+        return 0, 0, 0
+    st = ctl.stats()
+    return st["active"], st["limit"], st["queue_depth"]
+
+
+class BudgetController:
+    """Token cap for one upstream; `current()` is called per provider call, `track()` wraps it."""
+
+    def __init__(self, name: str, max_tokens: int, min_tokens: int = BUDGET_MIN_TOKENS,
+                 target_s: float = BUDGET_TARGET_P95_MS / 1000):
+        self.name = name
+        self.max_tokens = max_tokens
+        self.min_tokens = max(1, min(min_tokens, max_tokens))
+        self.target_s = target_s
+        self._step = max(1, math.ceil((self.max_tokens - self.min_tokens) / BUDGET_STEPS))
+        self._greedy_at = self.min_tokens + BUDGET_GREEDY_BELOW * (self.max_tokens - self.min_tokens)
+        self._lock = threading.Lock()
+        self._tokens = max_tokens
+        self._samples = deque(maxlen=BUDGET_WINDOW)  # provider seconds since the last change
+        self._changed_at = time.monotonic()
+        self._next = self._changed_at + BUDGET_INTERVAL
+        self._last = {"p95_ms": None, "in_flight": 0, "limit": 0, "queued": 0, "reason": ""}
+        self._counts = {"decreases": 0, "increases": 0}
+        self._publish()
+
+    def _greedy(self) -> bool:
+        return self._tokens < self.max_tokens and self._tokens <= self._greedy_at
+
+    def _publish(self) -> None:
+        metrics.BUDGET_TOKENS.set(self.name, value=self._tokens)
+        metrics.BUDGET_GREEDY.set(self.name, value=1 if self._greedy() else 0)
+
+    # ----- Per call -----
+    def current(self) -> Budget:
+        now = time.monotonic()
+        if now >= self._next:
+            self._adjust(now, _load())
+        return Budget(self._tokens, self._greedy())
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def reduced(self) -> bool:
+        return self._tokens < self.max_tokens
+
+    # ----- Control -----
+    def _p95(self):
+        if len(self._samples) < BUDGET_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def _adjust(self, now: float, load: tuple) -> None:
+        in_flight, limit, queued = load
+        with self._lock:
+            if now < self._next:
+                return  # another caller just did it
+            self._next = now + BUDGET_INTERVAL
+            p95 = self._p95()
+            self._last = {"p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                          "in_flight": in_flight, "limit": limit, "queued": queued, "reason": ""}
+            if p95 is not None:
+                metrics.BUDGET_P95.set(self.name, value=p95)
+            tokens, reason = self._tokens, ""
+            if queued:
+                tokens, reason = int(self._tokens * BUDGET_DECREASE), "queue"
+            elif p95 is not None and p95 > self.target_s:
+                tokens, reason = int(self._tokens * BUDGET_DECREASE), "latency"
+            elif p95 is not None and p95 < self.target_s * BUDGET_HEADROOM and (not limit or in_flight < limit):
+                tokens, reason = self._tokens + self._step, "headroom"
+            elif not self._samples and now - self._changed_at >= BUDGET_IDLE_INTERVALS * BUDGET_INTERVAL:
+                tokens, reason = self.max_tokens, "idle"
+            tokens = max(self.min_tokens, min(self.max_tokens, tokens))
+            if tokens == self._tokens:
+                return
+            direction = "down" if tokens < self._tokens else "up"
+            logger.info("Token budget for %s: %d -> %d (%s, p95 %s ms, %d queued)",
+                        self.name, self._tokens, tokens, reason, self._last["p95_ms"], queued)
+            self._tokens = tokens
+            self._last["reason"] = reason
+            self._counts["decreases" if direction == "down" else "increases"] += 1
+            # Judge the new cap on its own latencies.
+            self._samples.clear()
+            self._changed_at = now
+            self._publish()
+        metrics.BUDGET_ADJUSTMENTS.inc(self.name, direction, reason)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tokens": self._tokens,
+                "greedy": self._greedy(),
+                "min_tokens": self.min_tokens,
+                "max_tokens": self.max_tokens,
+                "target_p95_ms": round(self.target_s * 1000, 1),
+                "samples": len(self._samples),
+                "last": dict(self._last),
+                **self._counts,
+            }
+
+
+class _Track:
+    __slots__ = ("ctl", "t0")
+
+    def __init__(self, ctl: BudgetController):
+        self.ctl = ctl
+
+    def __enter__(self):
+        self.t0 = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:  # failed or abandoned calls say nothing about latency
+            self.ctl.observe(perf_counter() - self.t0)
+        return False
+
+
+class _NoTrack:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_TRACK = _NoTrack()
+
+
+def track(ctl):
+    """`with track(backend.budget): call()` — feeds the call's duration to the controller; no-op for None."""
+    return _Track(ctl) if ctl is not None else _NO_TRACK
+
+
+def enabled() -> bool:
+    return BUDGET_TARGET_P95_MS > 0
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def controller(name: str, max_tokens: int) -> BudgetController:
+    """The controller for upstream `name` (shared by every backend that talks to it)."""
+    ctl = _controllers.get(name)
+    if ctl is None:
+        with _controllers_lock:
+            ctl = _controllers.get(name)
+            if ctl is None:
+                ctl = _controllers[name] = BudgetController(name, max_tokens)
+    return ctl
+
+
+def reduced() -> bool:
+    """True while any upstream runs below its full token cap."""
+    return any(ctl.reduced() for ctl in list(_controllers.values()))
+
+
+def stats() -> dict:
+    return {name: ctl.stats() for name, ctl in list(_controllers.items())}
@@ -0,0 +1,199 @@
+# chatbot1/cache.py
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join((prompt or "").lower().split())
+
+
+def cache_key(prompt: str, config: dict) -> str:
+    """Stable digest of the normalized prompt plus everything that shapes the output."""
+    raw = json.dumps({"prompt": normalize_prompt(prompt), **config}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def config_id(config: dict) -> int:
+    """Compact integer tag of the generation config (semantic cache rows)."""
+    raw = json.dumps(config, sort_keys=True, ensure_ascii=False)
+    return int(hashlib.sha256(raw.encode("utf-8")).hexdigest()[:15], 16)
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class ResponseCache:
+    """
+    Two-tier cache for generated replies.
+
+    Tier 1 is a per-process LRU. Tier 2 (optional) is the Django cache named by
+    CHAT_CACHE_ALIAS, e.g. the database cache, so every gunicorn worker shares
+    hits. A shared-tier outage only costs a miss; it never fails a chat.
+    """
+
+    def __init__(self):
+        self.enabled = settings.CHAT_CACHE_ENABLED
+        self.ttl = settings.CHAT_CACHE_TTL
+        self.local = LRUCache(settings.CHAT_CACHE_MAX_ENTRIES, self.ttl)
+        self.alias = settings.CHAT_CACHE_ALIAS
+        self._counts = {"hits_local": 0, "hits_shared": 0, "misses": 0, "bypassed": 0, "shared_errors": 0}
+        self._lock = threading.Lock()
+        self.semantic = None
+        if self.enabled and settings.CHAT_SEMANTIC_CACHE:
+            from .semcache import SemanticCache
+            self.semantic = SemanticCache(
+                capacity=settings.CHAT_SEMANTIC_CAPACITY,
+                threshold=settings.CHAT_SEMANTIC_THRESHOLD,
+                ttl=self.ttl,
+                dim=settings.CHAT_SEMANTIC_DIM,
+            )
+
+    def _shared(self):
+        if not self.alias:
+            return None
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hits_local")
+            return value
+        shared = self._shared()
+        if shared is not None:
+            try:
+                value = shared.get("chat:" + key)
+            except Exception:
+                logger.warning("Shared response cache get failed", exc_info=True)
+                self._count("shared_errors")
+                value = None
+            if value is not None:
+                self.local.set(key, value)
+                self._count("hits_shared")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        if not self.enabled or not value:
+            return
+        self.local.set(key, value)
+        shared = self._shared()
+        if shared is not None:
+            try:
+                shared.set("chat:" + key, value, timeout=self.ttl)
+            except Exception:
+                logger.warning("Shared response cache set failed", exc_info=True)
+                self._count("shared_errors")
+
+    async def aget(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hits_local")
+            return value
+        shared = self._shared()
+        if shared is not None:
+            try:
+                value = await shared.aget("chat:" + key)
+            except Exception:
+                logger.warning("Shared response cache get failed", exc_info=True)
+                self._count("shared_errors")
+                value = None
+            if value is not None:
+                self.local.set(key, value)
+                self._count("hits_shared")
+                return value
+        self._count("misses")
+        return None
+
+    async def aset(self, key: str, value: str) -> None:
+        if not self.enabled or not value:
+            return
+        self.local.set(key, value)
+        shared = self._shared()
+        if shared is not None:
+            try:
+                await shared.aset("chat:" + key, value, timeout=self.ttl)
+            except Exception:
+                logger.warning("Shared response cache set failed", exc_info=True)
+                self._count("shared_errors")
+
+    def get_similar(self, prompt: str, config: dict) -> Optional[str]:
+        """Semantic tier, consulted after an exact miss. Not for a turn of a conversation (config has its history)."""
+        if self.semantic is None or "history" in config:
+            return None
+        return self.semantic.lookup(prompt, config_id(config))
+
+    def set_similar(self, prompt: str, config: dict, value: str) -> None:
+        if self.semantic is None or not value or "history" in config:
+            return
+        self.semantic.insert(prompt, config_id(config), value)
+
+    def bypass(self) -> None:
+        self._count("bypassed")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        hits = counts["hits_local"] + counts["hits_shared"]
+        lookups = hits + counts["misses"]
+        return {
+            **counts,
+            "enabled": self.enabled,
+            "shared_alias": self.alias or None,
+            "local_entries": len(self.local),
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            **(self.semantic.stats() if self.semantic is not None else {}),
+        }
@@ -1,8 +1,10 @@
 # chatbot1/diag.py
-import os, importlib, json, requests
+import os, importlib, json
 from django.http import JsonResponse
 from django.conf import settings
 
+from . import health, telemetry, transport
+
 
 def _mask(s: str) -> str:
     if not s:
@@ -40,55 +42,189 @@ def custos_diag(request):
     except Exception as e:
         info["middleware_check_error"] = str(e)
 
-    # try to ping your Custos backend
-    try:
-        import requests
-        url = (info["backend_url"] or "").rstrip("/") + "/simulator/ping/"
-        r = requests.get(url, timeout=4)
-        info["backend_ping_status"] = r.status_code
-        info["backend_ping_ok"] = (200 <= r.status_code < 300)
-    except Exception as e:
-        info["backend_ping_error"] = str(e)
+    # Custos backend reachability: the health monitor's last probe (waits for
+    # the first one only); pinged here only when the monitor is off.
+    status = health.status("custos", wait=health.HEALTH_TIMEOUT)
+    if status is not None:
+        info["backend_ping_status"] = status.get("status_code")
+        info["backend_ping_ok"] = status["ok"]
+        if status.get("error"):
+            info["backend_ping_error"] = status["error"]
+        info["backend_ping_age_s"] = status.get("age_s")
+        info["backend_breaker"] = health.breaker("custos").state
+    else:
+        try:
+            url = (info["backend_url"] or "").rstrip("/") + "/simulator/ping/"
+            r = transport.session().get(url, timeout=transport.timeout(read=4))
+            info["backend_ping_status"] = r.status_code
+            info["backend_ping_ok"] = (200 <= r.status_code < 300)
+        except Exception as e:
+            info["backend_ping_error"] = str(e)
 
     return JsonResponse(info)
 
 
 def custos_force_beat(request):
-    """Send a one-off 'response' beat to prove the wire is live."""
+    """Queue a one-off 'response' beat to prove the wire is live (`?wait=1` also flushes)."""
+    ship = telemetry.shipper()
+    guardian = telemetry.guardian()
+    if ship is None or guardian is None:
+        return JsonResponse({"sent": False, "error": "No CUSTOS_API_KEY env"}, status=500)
     try:
-        import custos
-        g = custos.guardian()  # starts HB if not already
-        g.evaluate("diag-prompt", "diag-response", confidence=0.95)
-        return JsonResponse({"sent": True})
+        guardian.evaluate("diag-prompt", "diag-response", confidence=0.95)
+        flushed = ship.flush(timeout=10) if request.GET.get("wait") else None
+        return JsonResponse({"sent": True, "flushed": flushed, "shipper": ship.stats()})
     except Exception as e:
-        return JsonResponse({"sent": False, "error": str(e)}, status=500)
-
-
+        return JsonResponse({"sent": False, "error": str(e), "shipper": ship.stats()}, status=500)
 
 
 def custos_selftest(request):
-    url = (os.getenv("CUSTOS_BACKEND_URL", "").rstrip("/") + "/simulator/logs/")
-    key = os.getenv("CUSTOS_API_KEY", "")
-    if not key:
+    """Push one beat through the shipper and wait for it to be delivered."""
+    ship = telemetry.shipper()
+    if ship is None:
         return JsonResponse({"ok": False, "error": "No CUSTOS_API_KEY env"}, status=500)
 
-    payload = {
+    before = ship.stats()
+    ship.submit({
         "kind": "response",
         "prompt": "selftest-prompt",
         "response": "selftest-response",
         "confidence": 0.96,
-    }
-    try:
-        r = requests.post(
-            url,
-            data=json.dumps(payload),
-            headers={"Authorization": f"ApiKey {key}", "Content-Type": "application/json"},
-            timeout=8,
-        )
-        try:
-            body = r.json()
-        except Exception:
-            body = {"text": r.text[:500]}
-        return JsonResponse({"ok": 200 <= r.status_code < 300, "status": r.status_code, "body": body})
-    except Exception as e:
-        return JsonResponse({"ok": False, "error": str(e)}, status=500)
+    })
+    flushed = ship.flush(timeout=ship.read_timeout + 2)
+    after = ship.stats()
+    ok = flushed and after["sent"] > before["sent"]
+    return JsonResponse({"ok": ok, "flushed": flushed, "url": ship.url, "shipper": after},
+                        status=200 if ok else 502)
+
+
+def chat_cache_stats(request):
+    """Response-cache and in-flight coalescing counters for this worker process."""
+    from . import views
+    bot = views._bot
+    if bot is None:
+        return JsonResponse({"initialized": False})
+    coalesce = bot.flights.stats() if bot.flights is not None else None
+    return JsonResponse({"initialized": True, **bot.cache.stats(), "coalesce": coalesce})
+
+
+def chat_router_stats(request):
+    """Per-backend rolling latency/error stats when MODEL_ROUTES is configured."""
+    from . import views
+    backend = getattr(views._bot, "backend", None)
+    if getattr(backend, "routes", None) is None:
+        return JsonResponse({"router": False})
+    return JsonResponse({"router": True, **backend.stats()})
+
+
+def chat_models_stats(request):
+    """HF model pool (this worker's, or the inference server's): loaded models, memory against the budget, loads and evictions."""
+    from . import views
+    backend = getattr(views._bot, "backend", None)
+    if getattr(backend, "check", None) is None:
+        return JsonResponse({"pool": False})
+    return JsonResponse({"pool": True, **backend.stats()})
+
+
+def chat_admission_stats(request):
+    """Admission control for this worker process: limit, active, queue depth, shed counts."""
+    from . import admission
+    ctl = admission.controller()
+    if ctl is None:
+        return JsonResponse({"enabled": False})
+    return JsonResponse({"enabled": True, **ctl.stats()})
+
+
+def chat_transcript_stats(request):
+    """Transcript writer for this worker process: queue depth, rows written/dropped/failed, write times."""
+    from . import transcripts
+    w = transcripts.writer()
+    if w is None:
+        return JsonResponse({"enabled": False})
+    return JsonResponse({"enabled": True, **w.stats()})
+
+
+def chat_health_stats(request):
+    """Last probe result and circuit breaker state per upstream (cached; probes run in the background)."""
+    mon = health.monitor()
+    if mon is None:
+        breakers = {name: b.stats() for name, b in list(health._breakers.items())}
+        return JsonResponse({"monitor": False, "breakers": breakers})
+    return JsonResponse({"monitor": True, **mon.stats()})
+
+
+def chat_budget_stats(request):
+    """Adaptive token budget per upstream: current cap, greedy flag and the signals of the last decision."""
+    from . import budget
+    if not budget.enabled():
+        return JsonResponse({"enabled": False})
+    return JsonResponse({"enabled": True, "upstreams": budget.stats()})
+
+
+def chat_session_stats(request):
+    """Conversation sessions: store, TTL, context budget and created/resumed/unknown counts."""
+    from . import sessions
+    return JsonResponse(sessions.store().stats())
+
+
+def _counter_lines(name: str, doc: str, stats: dict, events: tuple) -> list:
+    lines = [f"# HELP {name} {doc}", f"# TYPE {name} counter"]
+    lines += [f'{name}{{event="{e}"}} {stats[e]}' for e in events if e in stats]
+    return lines
+
+
+def prometheus_metrics(request):
+    """Prometheus text exposition: stage histograms, tokens/s, in-flight gauges, cache counters."""
+    from django.http import HttpResponse
+    from . import metrics, views
+
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token and request.headers.get("Authorization", "") != f"Bearer {token}":
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+
+    # Cache/coalescing counters already live on the bot; read them at scrape time.
+    extra = []
+    bot = views._bot
+    if bot is not None:
+        cache = bot.cache.stats()
+        extra += _counter_lines("chat_cache_events_total", "Response-cache lookups by outcome.", cache,
+                                ("hits_local", "hits_shared", "misses", "bypassed", "shared_errors",
+                                 "semantic_hits", "semantic_misses"))
+        extra += ["# HELP chat_cache_entries Entries in the per-process response caches.",
+                  "# TYPE chat_cache_entries gauge",
+                  f'chat_cache_entries{{tier="local"}} {cache["local_entries"]}']
+        if "semantic_entries" in cache:
+            extra.append(f'chat_cache_entries{{tier="semantic"}} {cache["semantic_entries"]}')
+        if bot.flights is not None:
+            extra += _counter_lines("chat_coalesce_events_total", "In-flight request coalescing.",
+                                    bot.flights.stats(), ("calls", "leaders", "coalesced", "errors", "timeouts"))
+    from . import admission
+    ctl = admission.controller()
+    if ctl is not None:
+        adm = ctl.stats()
+        for name, key, doc in (("chat_admission_active", "active", "Chats holding an admission slot."),
+                               ("chat_admission_queue_depth", "queue_depth", "Chats waiting for a slot."),
+                               ("chat_admission_limit", "limit", "Concurrent chat limit (0 = unlimited).")):
+            extra += [f"# HELP {name} {doc}", f"# TYPE {name} gauge", f'{name}{{provider="{adm["provider"]}"}} {adm[key]}']
+    from . import transcripts
+    tw = transcripts.writer()
+    if tw is not None:
+        written = tw.stats()
+        extra += _counter_lines("chat_transcripts_total", "Transcript rows by outcome.", written,
+                                ("enqueued", "written", "dropped", "failed"))
+        extra += ["# HELP chat_transcripts_queue_depth Transcript rows waiting to be written.",
+                  "# TYPE chat_transcripts_queue_depth gauge",
+                  f"chat_transcripts_queue_depth {written['queue_depth']}"]
+    from . import replay
+    for st in list(replay._stores.values()):
+        extra += _counter_lines("chat_replay_lookups_total", "Replay corpus lookups and recordings.", st.stats(),
+                                ("hits", "misses", "substituted", "recorded"))
+    ship = telemetry.shipper()
+    if ship is not None:
+        shipped = ship.stats()
+        extra += _counter_lines("chat_custos_beats_total", "Custos beats by outcome.", shipped,
+                                ("enqueued", "sent", "dropped", "failed", "short_circuited"))
+        extra += ["# HELP chat_custos_queue_depth Custos beats waiting to be shipped.",
+                  "# TYPE chat_custos_queue_depth gauge",
+                  f"chat_custos_queue_depth {shipped['queue_depth']}"]
+    return HttpResponse(metrics.render(extra), content_type="text/plain; version=0.0.4; charset=utf-8")
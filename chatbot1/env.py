@@ -0,0 +1,14 @@
+# chatbot1/env.py
+# Environment flags. Plain Python with no Django imports, so settings.py and
+# gunicorn.conf.py (through startup.py) can use it before Django is set up.
+
+import os
+
+_TRUTHY = {"1", "true", "yes", "y", "on"}
+
+
+def get_bool(name: str, default: bool = False) -> bool:
+    val = os.getenv(name)
+    if val is None:
+        return default
+    return val.strip().lower() in _TRUTHY
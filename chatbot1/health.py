@@ -0,0 +1,433 @@
+# chatbot1/health.py
+# Upstream health: a circuit breaker per upstream (LLM provider, Custos
+# backend) plus a background monitor that probes them on an interval.
+#
+# Breakers see every chat call: BREAKER_FAILURES consecutive failures (or
+# HEALTH_PROBE_FAILURES failed probes) open one, and while it is open calls
+# fail at once with `Unavailable` instead of waiting out the client timeout.
+# After BREAKER_COOLDOWN seconds (or as soon as a probe succeeds) it goes
+# half-open and lets a single trial call through to decide. Only errors that
+# say the upstream is unwell count (transport errors, timeouts, 5xx, 429); a
+# 4xx for a bad prompt or key is the upstream answering.
+#
+# The monitor keeps the last probe result per upstream, so diagnostics read a
+# cached status instead of pinging on the request path.
+
+import atexit
+import logging
+import math
+import os
+import threading
+import time
+
+from . import metrics
+from .env import get_bool
+
+logger = logging.getLogger(__name__)
+
+HEALTH_MONITOR = get_bool("HEALTH_MONITOR", True)
+HEALTH_INTERVAL = float(os.getenv("HEALTH_INTERVAL", "10"))
+HEALTH_TIMEOUT = float(os.getenv("HEALTH_TIMEOUT", "2"))
+HEALTH_PROBE_FAILURES = int(os.getenv("HEALTH_PROBE_FAILURES", "2"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class Unavailable(Exception):
+    """Failed fast because the upstream's breaker is open; `retry_after` is in seconds."""
+
+    def __init__(self, upstream: str, retry_after: int):
+        super().__init__(f"{upstream} is unavailable (circuit open, retry in {retry_after}s)")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed: calls pass, `failures` consecutive failures open it. Open: calls
+    are refused for `cooldown` seconds. Half-open: one trial call at a time
+    (a trial that never reports back expires after `cooldown`); its success
+    closes the breaker, its failure re-opens it.
+    """
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.name = name
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._lock = threading.Lock()
+        self._failed = 0
+        self._opened_at = 0.0
+        self._trial_at = None  # when the half-open trial in flight started
+        self._reason = ""
+        self._counts = {"rejected": 0, "opened": 0}
+        metrics.BREAKER_STATE.set(name, value=_STATE_VALUES[CLOSED])
+
+    def _move(self, to: str, reason: str = "") -> None:
+        """Under the lock."""
+        frm, self.state = self.state, to
+        self._trial_at = None
+        if to == OPEN:
+            self._opened_at = time.monotonic()
+            self._reason = reason
+            self._counts["opened"] += 1
+            logger.warning("Circuit for %s opened: %s", self.name, reason)
+        elif to == CLOSED:
+            self._failed = 0
+            self._reason = ""
+            logger.info("Circuit for %s closed", self.name)
+        metrics.BREAKER_TRANSITIONS.inc(self.name, frm, to)
+        metrics.BREAKER_STATE.set(self.name, value=_STATE_VALUES[to])
+
+    # ----- Calls -----
+    def allow(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self._opened_at >= self.cooldown:
+                self._move(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and (self._trial_at is None or now - self._trial_at >= self.cooldown):
+                self._trial_at = now
+                return True
+            self._counts["rejected"] += 1
+        metrics.BREAKER_REJECTED.inc(self.name)
+        return False
+
+    def before(self) -> None:
+        """Raise Unavailable unless a call may go out now."""
+        if not self.allow():
+            raise Unavailable(self.name, self.retry_after())
+
+    def success(self) -> None:
+        with self._lock:
+            self._failed = 0
+            if self.state == HALF_OPEN:
+                self._move(CLOSED)
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failed += 1
+            if self.state == HALF_OPEN:
+                self._move(OPEN, "trial call failed")
+            elif self.state == CLOSED and self._failed >= self.failures:
+                self._move(OPEN, f"{self._failed} consecutive failures")
+
+    def release(self) -> None:
+        """The call ended without a verdict (cancelled, client gone): free the trial slot."""
+        with self._lock:
+            self._trial_at = None
+
+    # ----- Monitor -----
+    def trip(self, reason: str) -> None:
+        with self._lock:
+            if self.state == OPEN:
+                self._opened_at = time.monotonic()  # still down: restart the cooldown
+            else:
+                self._move(OPEN, reason)
+
+    def probe_ok(self) -> None:
+        with self._lock:
+            if self.state == OPEN:
+                self._move(HALF_OPEN)
+
+    def retry_after(self) -> int:
+        with self._lock:
+            left = self._opened_at + self.cooldown - time.monotonic() if self.state == OPEN else 1
+        return max(1, math.ceil(left))
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = {"state": self.state, "consecutive_failures": self._failed, "reason": self._reason, **self._counts}
+        if out["state"] == OPEN:
+            out["retry_after_s"] = self.retry_after()
+        return out
+
+
+def upstream_fault(exc: BaseException) -> bool:
+    """
+    Whether a failed call counts against the upstream's breaker. The HTTP
+    status is looked for along the exception chain (the backends re-raise
+    SDK errors as RuntimeError): 5xx and 429 count, any other status does
+    not; no status at all (connection refused, timeout, bad body) counts.
+    """
+    seen = 0
+    while exc is not None and seen < 8:
+        status = getattr(exc, "status_code", None)
+        if status is None:
+            status = getattr(getattr(exc, "response", None), "status_code", None)
+        if isinstance(status, int):
+            return status >= 500 or status == 429
+        exc = exc.__cause__ or exc.__context__
+        seen += 1
+    return True
+
+
+def _verdict(breaker: CircuitBreaker, exc: BaseException) -> None:
+    if upstream_fault(exc):
+        breaker.failure()
+    else:
+        breaker.success()
+
+
+class _Guard:
+    __slots__ = ("breaker",)
+
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+
+    def __enter__(self):
+        self.breaker.before()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.breaker.success()
+        elif issubclass(exc_type, Exception):
+            _verdict(self.breaker, exc)
+        else:
+            self.breaker.release()  # cancelled (e.g. a lost hedge)
+        return False
+
+
+class _NoGuard:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_GUARD = _NoGuard()
+
+
+def guard(breaker):
+    """`with guard(backend.breaker): call()` — fails fast when open, reports the outcome; no-op for None."""
+    return _Guard(breaker) if breaker is not None else _NO_GUARD
+
+
+def guard_stream(breaker, chunks):
+    """Stream twin of `guard`: the upstream counts as healthy once it sends its first chunk."""
+    return _guarded(breaker, chunks) if breaker is not None else chunks
+
+
+def _guarded(breaker, chunks):
+    breaker.before()
+    answered = False
+    try:
+        for chunk in chunks:
+            if not answered:
+                answered = True
+                breaker.success()
+            yield chunk
+        if not answered:
+            breaker.success()
+    except Exception as e:
+        _verdict(breaker, e)
+        raise
+    except BaseException:
+        if not answered:
+            breaker.release()
+        raise
+    finally:
+        chunks.close()
+
+
+def aguard_stream(breaker, chunks):
+    return _aguarded(breaker, chunks) if breaker is not None else chunks
+
+
+async def _aguarded(breaker, chunks):
+    breaker.before()
+    answered = False
+    try:
+        async for chunk in chunks:
+            if not answered:
+                answered = True
+                breaker.success()
+            yield chunk
+        if not answered:
+            breaker.success()
+    except Exception as e:
+        _verdict(breaker, e)
+        raise
+    except BaseException:
+        if not answered:
+            breaker.release()
+        raise
+    finally:
+        await chunks.aclose()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name: str) -> CircuitBreaker:
+    """The breaker for upstream `name` (shared by every backend that talks to it)."""
+    b = _breakers.get(name)
+    if b is None:
+        with _breakers_lock:
+            b = _breakers.get(name)
+            if b is None:
+                b = _breakers[name] = CircuitBreaker(name)
+    return b
+
+
+# ----- Monitor -----
+class HealthMonitor:
+    """
+    One daemon thread that GETs each watched upstream every `interval` seconds
+    (no retries, `timeout` per probe) and keeps the result. A status below
+    500 counts as up: the upstream answered, even if it refused the probe.
+    """
+
+    def __init__(self, interval: float = HEALTH_INTERVAL, timeout: float = HEALTH_TIMEOUT):
+        self.interval = interval
+        self.timeout = timeout
+        self._targets = {}  # name -> (url, headers, breaker)
+        self._status = {}   # name -> last probe result
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="health-monitor", daemon=True)
+        self._thread.start()
+
+    def watch(self, name: str, url: str, headers: dict = None, breaker: CircuitBreaker = None) -> None:
+        with self._cond:
+            if name in self._targets:
+                return
+            self._targets[name] = (url, headers or {}, breaker)
+        self._wake.set()  # probe it now rather than at the next tick
+
+    def status(self, name: str, wait: float = 0.0):
+        """Last probe result for `name`; waits up to `wait` seconds for the first one. None if not watched."""
+        with self._cond:
+            if name not in self._targets:
+                return None
+            self._cond.wait_for(lambda: name in self._status, timeout=wait)
+            st = self._status.get(name)
+        if st is None:
+            return {"ok": None, "checked": False}
+        return {**st, "age_s": round(time.time() - st["checked_at"], 1)}
+
+    def stats(self) -> dict:
+        with self._cond:
+            names = list(self._targets)
+        upstreams = {}
+        for name in names:
+            brk = self._targets[name][2]
+            upstreams[name] = {**self.status(name), **({"breaker": brk.stats()} if brk is not None else {})}
+        return {"interval_s": self.interval, "timeout_s": self.timeout, "upstreams": upstreams}
+
+    def close(self) -> None:
+        self._closing = True
+        self._wake.set()
+
+    # ----- Worker -----
+    def _session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        # No retries: a failed probe is the signal.
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=1, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _run(self) -> None:
+        session = self._session()
+        while not self._closing:
+            self._wake.clear()
+            with self._cond:
+                targets = list(self._targets.items())
+            for name, (url, headers, brk) in targets:
+                self._check(session, name, url, headers, brk)
+            self._wake.wait(self.interval)
+
+    def _check(self, session, name: str, url: str, headers: dict, brk) -> None:
+        t0 = time.perf_counter()
+        code, error = None, ""
+        try:
+            r = session.get(url, headers=headers, timeout=self.timeout)
+            r.close()
+            code = r.status_code
+            ok = code < 500
+            if not ok:
+                error = f"HTTP {code}"
+        except Exception as e:
+            ok, error = False, f"{type(e).__name__}: {e}"
+        latency = time.perf_counter() - t0
+        with self._cond:
+            prev = self._status.get(name, {})
+            failed = 0 if ok else prev.get("consecutive_failures", 0) + 1
+            self._status[name] = {
+                "ok": ok,
+                "status_code": code,
+                "error": error,
+                "latency_ms": round(latency * 1000, 1),
+                "checked_at": time.time(),
+                "consecutive_failures": failed,
+            }
+            self._cond.notify_all()
+        metrics.UPSTREAM_UP.set(name, value=1 if ok else 0)
+        if prev.get("ok", True) != ok:
+            logger.log(logging.INFO if ok else logging.WARNING, "Upstream %s is %s%s", name,
+                       "up" if ok else "down", f" ({error})" if error else "")
+        if brk is not None:
+            if ok:
+                brk.probe_ok()
+            elif failed >= HEALTH_PROBE_FAILURES:
+                brk.trip(f"{failed} failed probes ({error})")
+
+
+def _backends(backend) -> list:
+    # Router -> its routes' backends; replay in record mode -> its upstream.
+    routes = getattr(backend, "routes", None)
+    if routes is not None:
+        return [b for r in routes for b in _backends(r.backend)]
+    upstream = getattr(backend, "_replay_upstream", None)
+    return [backend] + (_backends(upstream) if upstream is not None else [])
+
+
+_lock = threading.Lock()
+_monitor = None
+_monitor_pid = None
+
+
+def monitor():
+    """This process's HealthMonitor (watching the Custos backend), or None when HEALTH_MONITOR is off."""
+    global _monitor, _monitor_pid
+    if not HEALTH_MONITOR:
+        return None
+    pid = os.getpid()
+    if _monitor is None or _monitor_pid != pid:
+        with _lock:
+            if _monitor is None or _monitor_pid != pid:
+                _monitor = HealthMonitor()
+                _monitor_pid = pid
+                atexit.register(_monitor.close)
+                from custos.config import CustosConfig
+                cfg = CustosConfig()
+                if cfg.api_key or os.getenv("CUSTOS_BACKEND_URL"):
+                    _monitor.watch("custos", f"{cfg.backend_url}/simulator/ping/", breaker=breaker("custos"))
+    return _monitor
+
+
+def watch(backend) -> None:
+    """Probe every remote upstream behind `backend` (a ChatBackend or Router)."""
+    mon = monitor()
+    if mon is None:
+        return
+    for b in _backends(backend):
+        target = b.probe_target() if getattr(b, "breaker", None) is not None else None
+        if target is not None:
+            mon.watch(b.breaker.name, *target, breaker=b.breaker)
+
+
+def status(name: str, wait: float = 0.0):
+    mon = monitor()
+    return mon.status(name, wait) if mon is not None else None
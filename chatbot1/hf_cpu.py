@@ -0,0 +1,122 @@
+# chatbot1/hf_cpu.py
+# CPU tuning for the local HF provider: weight dtype, dynamic int8 quantization
+# of Linear layers, torch thread pools sized to the gunicorn worker count, and
+# an optional compile/warm-up pass at init. Ignored when the model runs on CUDA.
+
+import logging
+import os
+import warnings
+
+from .env import get_bool
+
+logger = logging.getLogger(__name__)
+
+# "float32" (default), "bfloat16", or "auto" = bfloat16 when the CPU has native bf16 (AVX512-BF16/AMX).
+HF_CPU_DTYPE = os.getenv("HF_CPU_DTYPE", "float32").strip().lower()
+# "int8" = dynamic int8 weights for nn.Linear (activations stay float32; overrides bfloat16).
+HF_QUANTIZE = os.getenv("HF_QUANTIZE", "").strip().lower()
+# Intra-op threads per process; 0 = CPU cores / gunicorn workers.
+HF_THREADS = int(os.getenv("HF_THREADS", "0"))
+HF_INTEROP_THREADS = int(os.getenv("HF_INTEROP_THREADS", "1"))
+HF_COMPILE = get_bool("HF_COMPILE")
+HF_WARMUP = get_bool("HF_WARMUP")
+
+_DTYPES = {"float32": "float32", "fp32": "float32", "bfloat16": "bfloat16", "bf16": "bfloat16"}
+
+
+def bf16_supported() -> bool:
+    import torch
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        try:
+            with open("/proc/cpuinfo") as fh:
+                flags = fh.read()
+        except OSError:
+            return False
+        return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def workers() -> int:
+    # Under gunicorn, gunicorn.conf.py exports the real count (also when given as --workers).
+    return max(1, int(os.getenv("GUNICORN_WORKERS") or os.getenv("WEB_CONCURRENCY") or 1))
+
+
+def intra_op_threads() -> int:
+    """HF_THREADS, else this process's share of the cores."""
+    return HF_THREADS or max(1, (os.cpu_count() or 1) // workers())
+
+
+def configure_threads() -> dict:
+    """Size torch's pools so N workers don't each spin up one thread per core."""
+    import torch
+    torch.set_num_threads(intra_op_threads())
+    try:
+        torch.set_num_interop_threads(max(1, HF_INTEROP_THREADS))
+    except RuntimeError:
+        pass  # only settable before the first inter-op parallel work in this process
+    return {"intra_op": torch.get_num_threads(), "inter_op": torch.get_num_interop_threads()}
+
+
+def load_dtype():
+    """torch dtype to load CPU weights in."""
+    import torch
+    name = HF_CPU_DTYPE
+    if HF_QUANTIZE == "int8":
+        if name not in ("float32", "fp32"):
+            logger.warning("HF_QUANTIZE=int8 needs float32 weights; ignoring HF_CPU_DTYPE=%s", name)
+        return torch.float32
+    if name == "auto":
+        name = "bfloat16" if bf16_supported() else "float32"
+    elif name not in _DTYPES:
+        logger.warning("Unknown HF_CPU_DTYPE=%s; using float32", name)
+        name = "float32"
+    elif _DTYPES[name] == "bfloat16" and not bf16_supported():
+        logger.warning("HF_CPU_DTYPE=%s but this CPU has no native bf16; it will be emulated (slow)", name)
+    return getattr(torch, _DTYPES.get(name, name))
+
+
+def optimize(model):
+    """Quantize/compile a loaded CPU model in eval mode; returns the model to use."""
+    import torch
+    model.eval()
+    if HF_QUANTIZE == "int8":
+        from torch.ao.quantization import quantize_dynamic
+        with warnings.catch_warnings():
+            # torch.ao eager quantization is deprecated in favour of torchao, which we don't ship.
+            warnings.simplefilter("ignore", DeprecationWarning)
+            warnings.simplefilter("ignore", UserWarning)
+            model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif HF_QUANTIZE:
+        logger.warning("Unknown HF_QUANTIZE=%s; leaving weights as loaded", HF_QUANTIZE)
+    if HF_COMPILE:
+        try:
+            model.forward = torch.compile(model.forward, dynamic=True)
+        except Exception as e:
+            logger.warning("torch.compile unavailable, running eager: %s", e)
+    return model
+
+
+def weight_bytes(model) -> int:
+    """Parameter and buffer bytes, counting dynamic-int8 Linear weights as packed (not parameters)."""
+    total = 0
+    for m in model.modules():
+        tensors = list(m.parameters(recurse=False)) + list(m.buffers(recurse=False))
+        if type(m).__module__.startswith("torch.ao.nn.quantized") and callable(getattr(m, "weight", None)):
+            tensors += [t for t in (m.weight(), m.bias()) if t is not None]
+        total += sum(t.numel() * t.element_size() for t in tensors)
+    return total
+
+
+def describe(model) -> dict:
+    """Effective CPU settings (for logs and the bench report)."""
+    import torch
+    quantized = any(type(m).__module__.startswith("torch.ao.nn.quantized") for m in model.modules())
+    return {
+        "dtype": str(getattr(model, "dtype", torch.float32)).replace("torch.", ""),
+        "int8": quantized,
+        "weights_mb": round(weight_bytes(model) / 2**20, 1),
+        "compile": HF_COMPILE,
+        "intra_op_threads": torch.get_num_threads(),
+        "inter_op_threads": torch.get_num_interop_threads(),
+    }
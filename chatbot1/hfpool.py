@@ -0,0 +1,345 @@
+# chatbot1/hfpool.py
+# Local HF models for MODEL_PROVIDER=hf. Instead of the one model _init_hf
+# loads at start, a ModelPool stands in for the backend (like the Router does)
+# and serves MODEL_NAME plus any model in HF_MODELS, chosen per request with
+# the "model" field of a chat:
+#   - models load on first use; requests that arrive while a model is loading
+#     wait for that one load instead of starting their own;
+#   - loaded models sit in an LRU bounded by HF_POOL_MB of weights and
+#     HF_POOL_MAX models; making room evicts the least recently used model
+#     that no request is using (in-use models are never evicted, so the pool
+#     can run over budget while they finish);
+#   - models whose tokenizer files are identical share one tokenizer object.
+
+import gc
+import hashlib
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import AsyncIterator, Iterator
+
+from . import hf_cpu, metrics
+
+logger = logging.getLogger(__name__)
+
+# Models a request may ask for besides MODEL_NAME and FALLBACK_MODEL_NAME (comma-separated ids or paths).
+HF_MODELS = [m.strip() for m in os.getenv("HF_MODELS", "").split(",") if m.strip()]
+HF_POOL_MB = float(os.getenv("HF_POOL_MB", "0"))  # weight budget; 0 = no byte limit
+HF_POOL_MAX = int(os.getenv("HF_POOL_MAX", "2"))  # models loaded at once; 0 = no count limit
+
+_TOKENIZER_FILES = ("tokenizer.json", "tokenizer_config.json", "special_tokens_map.json",
+                    "vocab.json", "merges.txt", "tokenizer.model")
+
+
+# ----- Tokenizers -----
+_tokenizers = weakref.WeakValueDictionary()  # files digest -> tokenizer, alive while a model uses it
+_tokenizers_lock = threading.Lock()
+
+
+def _tokenizer_digest(name: str) -> str:
+    """Digest of the tokenizer files of `name`; equal digests tokenize identically."""
+    from transformers.utils import cached_file
+    h = hashlib.blake2b(digest_size=16)
+    found = False
+    for fname in _TOKENIZER_FILES:
+        try:
+            path = cached_file(name, fname, _raise_exceptions_for_missing_entries=False)
+        except Exception:
+            path = None
+        if path:
+            found = True
+            h.update(fname.encode())
+            with open(path, "rb") as fh:
+                h.update(fh.read())
+    return h.hexdigest() if found else f"model:{name}"
+
+
+def tokenizer(name: str):
+    """The tokenizer for model `name`, set up for left-padded batching and shared where the files match."""
+    from transformers import AutoTokenizer
+    digest = _tokenizer_digest(name)
+    with _tokenizers_lock:
+        tok = _tokenizers.get(digest)
+        if tok is None:
+            tok = AutoTokenizer.from_pretrained(name)
+            if tok.pad_token is None:
+                tok.pad_token = tok.eos_token
+            # Decoder-only batching needs prompts right-aligned against the first generated token.
+            tok.padding_side = "left"
+            _tokenizers[digest] = tok
+        else:
+            logger.info("HF %s shares its tokenizer with an already loaded model", name)
+    return tok
+
+
+# ----- Memory -----
+def _estimate_bytes(name: str) -> int:
+    """Weight bytes `name` will take once loaded, from its config on the meta device (no allocation); 0 if unknown."""
+    try:
+        import torch
+        from transformers import AutoConfig, AutoModelForCausalLM
+        with torch.device("meta"):
+            model = AutoModelForCausalLM.from_config(AutoConfig.from_pretrained(name))
+        dtype = torch.float16 if torch.cuda.is_available() else hf_cpu.load_dtype()
+        return sum(p.numel() for p in model.parameters()) * torch.empty((), dtype=dtype).element_size()
+    except Exception:
+        logger.debug("No size estimate for %s", name, exc_info=True)
+        return 0
+
+
+def _give_back() -> None:
+    """Return freed weight memory after an eviction (collect cycles, trim the C heap, empty the CUDA cache)."""
+    gc.collect()
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except Exception:
+        pass  # not glibc
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except Exception:
+        pass
+
+
+# ----- Pool -----
+class _Entry:
+    __slots__ = ("name", "backend", "bytes", "users", "last_used", "hits")
+
+    def __init__(self, name: str, backend, size: int):
+        self.name, self.backend, self.bytes = name, backend, size
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.hits = 0
+
+
+class _Lease:
+    """`with pool.lease(name) as backend:` — keeps the model loaded (not evictable) until released."""
+    __slots__ = ("pool", "entry", "backend")
+
+    def __init__(self, pool: "ModelPool", entry: _Entry):
+        self.pool, self.entry, self.backend = pool, entry, entry.backend
+
+    def release(self) -> None:
+        if self.entry is not None:
+            self.pool._release(self.entry)
+            self.entry = None
+
+    def __enter__(self):
+        return self.backend
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class ModelPool:
+    """ChatBackend stand-in for MODEL_PROVIDER=hf; every call takes an optional `model`."""
+
+    provider = "hf"
+    breaker = None
+
+    def __init__(self, default: str, allowed=(), budget_mb: float = HF_POOL_MB, max_models: int = HF_POOL_MAX):
+        from .models import FALLBACK_MODEL_NAME
+        self.default = default
+        self.allowed = {default, FALLBACK_MODEL_NAME, *allowed}
+        self.budget = int(budget_mb * 2**20)
+        self.max_models = max_models
+        self._entries = OrderedDict()  # name -> _Entry, least recently used first
+        self._loading = {}             # name -> Future of the load in progress
+        self._sizes = {}               # name -> weight bytes when last loaded
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "loads": 0, "coalesced": 0, "evictions": 0, "load_failures": 0, "over_budget": 0}
+        self._peak = 0
+        with self.lease(default) as backend:  # loaded now, as before the pool
+            self._config = backend.config()
+            self.model_name = backend.model_name
+
+    # ----- Leases -----
+    def check(self, name: str) -> None:
+        """Raise ValueError unless a request may ask for model `name`."""
+        if name not in self.allowed:
+            raise ValueError(f"unknown model {name!r}; available: {', '.join(sorted(self.allowed))}")
+
+    def _hit(self, name: str):
+        # Caller holds the lock.
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        self._entries.move_to_end(name)
+        entry.users += 1
+        entry.hits += 1
+        entry.last_used = time.monotonic()
+        self._counts["hits"] += 1
+        metrics.HF_POOL_EVENTS.inc("hit")
+        return _Lease(self, entry)
+
+    def try_lease(self, name: str = None):
+        """A lease if the model is loaded, else None (never blocks on a load)."""
+        name = name or self.default
+        self.check(name)
+        with self._lock:
+            return self._hit(name)
+
+    def lease(self, name: str = None) -> _Lease:
+        """Lease model `name` (default: MODEL_NAME), loading it first or waiting for the load in progress."""
+        name = name or self.default
+        self.check(name)
+        while True:
+            with self._lock:
+                lease = self._hit(name)
+                if lease is not None:
+                    return lease
+                fut = self._loading.get(name)
+                owner = fut is None
+                if owner:
+                    fut = self._loading[name] = Future()
+                else:
+                    self._counts["coalesced"] += 1
+                    metrics.HF_POOL_EVENTS.inc("coalesced")
+            if owner:
+                return self._load(name, fut)
+            fut.result()  # the loader's error, if it failed; else take the loaded entry
+
+    async def alease(self, name: str = None) -> _Lease:
+        lease = self.try_lease(name)
+        if lease is not None:
+            return lease
+        from asgiref.sync import sync_to_async
+        return await sync_to_async(self.lease, thread_sensitive=False)(name)
+
+    def _release(self, entry: _Entry) -> None:
+        with self._lock:
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+            victims = self._evict()  # anything left over budget while this model was busy
+        self._close(victims)
+
+    # ----- Load / evict -----
+    def _load(self, name: str, fut: Future) -> _Lease:
+        from .models import ChatBackend
+        try:
+            need = self._sizes.get(name) or _estimate_bytes(name)
+            with self._lock:
+                victims = self._evict(need, adding=1)
+            self._close(victims)
+            t0 = time.perf_counter()
+            with metrics.stage("model_load", "hf", name):
+                backend = ChatBackend("hf", name)
+            size = hf_cpu.weight_bytes(backend._hf_model)
+        except BaseException as e:
+            with self._lock:
+                self._loading.pop(name, None)
+                self._counts["load_failures"] += 1
+            metrics.HF_POOL_EVENTS.inc("load_failure")
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            entry = self._entries[name] = _Entry(name, backend, size)
+            entry.users = 1
+            self._sizes[name] = size
+            self._loading.pop(name, None)
+            self._counts["loads"] += 1
+            victims = self._evict()  # the estimate may have been low
+            self._publish()
+        metrics.HF_POOL_EVENTS.inc("load")
+        logger.info("HF pool loaded %s (%.0f MB) in %.2fs; %d model(s), %.0f MB resident", name, size / 2**20,
+                    time.perf_counter() - t0, len(self._entries), self._resident() / 2**20)
+        self._close(victims)
+        fut.set_result(None)
+        return _Lease(self, entry)
+
+    def _resident(self) -> int:
+        return sum(e.bytes for e in self._entries.values())
+
+    def _evict(self, need: int = 0, adding: int = 0) -> list:
+        """Caller holds the lock. Unlink idle LRU entries until `adding` more models of `need` bytes fit."""
+        def over() -> bool:
+            return bool((self.budget and self._resident() + need > self.budget)
+                        or (self.max_models and len(self._entries) + adding > self.max_models))
+
+        victims = []
+        for name in list(self._entries):
+            if not over():
+                break
+            entry = self._entries[name]
+            if entry.users:
+                continue
+            del self._entries[name]
+            victims.append(entry)
+            self._counts["evictions"] += 1
+        if over() and (adding or victims):
+            self._counts["over_budget"] += 1
+            logger.warning("HF pool over budget: %d model(s), %.0f MB resident + %.0f MB needed, all in use",
+                           len(self._entries), self._resident() / 2**20, need / 2**20)
+        self._publish()
+        return victims
+
+    def _close(self, victims: list) -> None:
+        for entry in victims:
+            logger.info("HF pool evicting %s (%.0f MB, idle %.0fs)", entry.name, entry.bytes / 2**20,
+                        time.monotonic() - entry.last_used)
+            metrics.HF_POOL_EVENTS.inc("eviction")
+            entry.backend.close()
+            entry.backend = None
+        if victims:
+            _give_back()
+
+    def _publish(self) -> None:
+        # Caller holds the lock.
+        resident = self._resident()
+        self._peak = max(self._peak, resident)
+        metrics.HF_POOL_BYTES.set(value=resident)
+        metrics.HF_POOL_MODELS.set(value=len(self._entries))
+
+    # ----- ChatBackend interface -----
+    def config(self, model: str = None) -> dict:
+        return self._config if not model or model == self.default else {**self._config, "model": model}
+
+    def probe_target(self):
+        return None
+
+    @property
+    def _hf_batcher(self):
+        # For views._batch_width: the default model's micro-batcher, if loaded.
+        entry = self._entries.get(self.default)
+        return entry.backend._hf_batcher if entry is not None and entry.backend is not None else None
+
+    def generate(self, prompt: str, model: str = None) -> str:
+        with self.lease(model) as backend:
+            return backend.generate(prompt)
+
+    def stream(self, prompt: str, model: str = None) -> Iterator[str]:
+        with self.lease(model) as backend:
+            yield from backend.stream(prompt)
+
+    async def agenerate(self, prompt: str, model: str = None) -> str:
+        with await self.alease(model) as backend:
+            return await backend.agenerate(prompt)
+
+    async def astream(self, prompt: str, model: str = None) -> AsyncIterator[str]:
+        with await self.alease(model) as backend:
+            async for delta in backend.astream(prompt):
+                yield delta
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            models = [{"model": e.name, "mb": round(e.bytes / 2**20, 1), "in_use": e.users, "hits": e.hits,
+                       "idle_s": round(now - e.last_used, 1)} for e in reversed(self._entries.values())]
+            return {
+                "default": self.default,
+                "allowed": sorted(self.allowed),
+                "budget_mb": round(self.budget / 2**20, 1) if self.budget else None,
+                "max_models": self.max_models or None,
+                "resident_mb": round(self._resident() / 2**20, 1),
+                "peak_mb": round(self._peak / 2**20, 1),
+                "loading": sorted(self._loading),
+                "models": models,  # most recently used first
+                **self._counts,
+            }
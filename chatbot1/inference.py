@@ -0,0 +1,506 @@
+# chatbot1/inference.py
+# Out-of-process HF inference. `manage.py inference_server` loads the HF model
+# pool once per host and serves every web worker over a Unix socket. With
+# HF_SERVER set, MODEL_PROVIDER=hf workers load no weights (and never import
+# torch): ChatBackend runs in client mode over a small per-process pool of
+# connections. Concurrent chats from all workers meet in the one server
+# process, where they share its micro-batches.
+#
+# Framing: a 5-byte header (op, payload length; "!BI") then the payload.
+# Requests and control replies are JSON; TEXT frames are raw UTF-8, one per
+# streamed piece, so tokens are never JSON-escaped on the hot path.
+#   GENERATE {"prompt", "model", "history"?} -> TEXT, END {usage}
+#   STREAM   {"prompt", "model", "history"?} -> TEXT..., END {usage}
+#   CONFIG   {"model"}                      -> CONFIG {"config", "allowed", "max_batch"}
+#   STATS    {}                             -> STATS {server and pool counters}
+#   any failure                             -> ERROR {"error", "detail"}
+# One request at a time per connection. A client that stops reading a stream
+# closes its connection; the server sees it on the next write and stops
+# generating.
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from time import perf_counter
+from typing import AsyncIterator, Iterator
+
+logger = logging.getLogger(__name__)
+
+HF_SERVER = os.getenv("HF_SERVER", "").strip()  # socket path; set = hf workers use the inference server
+HF_SERVER_POOL = int(os.getenv("HF_SERVER_POOL", "8"))  # idle connections kept per process (per loop on ASGI)
+HF_SERVER_TIMEOUT = float(os.getenv("HF_SERVER_TIMEOUT", "130"))
+_MAX_FRAME = 16 * 2**20
+
+GENERATE, STREAM, CONFIG, STATS = 1, 2, 3, 4
+TEXT, END, ERROR = 16, 17, 18
+
+_HEADER = struct.Struct("!BI")
+
+_serving = False  # set in the server process, whose ChatBackends load models themselves
+
+
+class InferenceError(RuntimeError):
+    """The inference server failed a request."""
+
+
+def enabled() -> bool:
+    """True where HF work goes to the inference server (web workers with HF_SERVER set, not the server)."""
+    return bool(HF_SERVER) and not _serving
+
+
+# ----- Framing -----
+def _frame(op: int, payload: bytes = b"") -> bytes:
+    return _HEADER.pack(op, len(payload)) + payload
+
+
+def _json(op: int, obj) -> bytes:
+    return _frame(op, json.dumps(obj, separators=(",", ":")).encode())
+
+
+def _check(n: int) -> None:
+    if n > _MAX_FRAME:
+        raise ConnectionError(f"inference frame of {n} bytes")
+
+
+def _read(rfile):
+    """(op, payload) from a buffered reader, or None at a clean end of stream."""
+    head = rfile.read(_HEADER.size)
+    if not head:
+        return None
+    if len(head) < _HEADER.size:
+        raise ConnectionError("inference connection closed mid-frame")
+    op, n = _HEADER.unpack(head)
+    _check(n)
+    payload = rfile.read(n) if n else b""
+    if len(payload) < n:
+        raise ConnectionError("inference connection closed mid-frame")
+    return op, payload
+
+
+def _request(prompt: str, model: str) -> dict:
+    body = {"prompt": prompt, "model": model}
+    history = getattr(prompt, "history", None)
+    if history:
+        body["history"] = history
+    return body
+
+
+def _prompt(body: dict) -> str:
+    from .sessions import Turn
+    history = body.get("history")
+    return Turn(body["prompt"], history) if history else body["prompt"]
+
+
+def _fail(payload: bytes):
+    err = json.loads(payload)
+    if err.get("error") == "ValueError":  # bad request (unknown model): the caller's 400
+        raise ValueError(err.get("detail", ""))
+    raise InferenceError(f"{err.get('error')}: {err.get('detail')}")
+
+
+# ----- Client (web workers) -----
+class _Conn:
+    __slots__ = ("sock", "rfile")
+
+    def __init__(self, path: str, timeout: float):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+        except OSError as e:
+            sock.close()
+            raise ConnectionError(f"inference server at {path} is not reachable: {e.strerror or e}") from e
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+
+    def recv(self) -> tuple:
+        frame = _read(self.rfile)
+        if frame is None:
+            raise ConnectionError("inference server closed the connection")
+        return frame
+
+    def close(self) -> None:
+        self.rfile.close()
+        self.sock.close()
+
+
+class Client:
+    """Blocking client with a pool of idle connections; safe to share between threads."""
+
+    def __init__(self, path: str, pool: int = HF_SERVER_POOL, timeout: float = HF_SERVER_TIMEOUT):
+        self.path = path
+        self.pool = pool
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _get(self) -> tuple:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return _Conn(self.path, self.timeout), False
+
+    def _put(self, conn: _Conn) -> None:
+        with self._lock:
+            if len(self._idle) < self.pool:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _start(self, data: bytes) -> tuple:
+        """Send a request; (connection, first reply frame). An idle connection the server dropped is retried once."""
+        while True:
+            conn, reused = self._get()
+            try:
+                conn.sock.sendall(data)
+                return conn, conn.recv()
+            except ConnectionError:
+                conn.close()
+                if not reused:
+                    raise
+            except BaseException:
+                conn.close()
+                raise
+
+    def frames(self, op: int, body: dict) -> Iterator[tuple]:
+        """Reply frames of one request, through the terminal one; the connection goes back to the pool after it."""
+        conn, frame = self._start(_json(op, body))
+        try:
+            while True:
+                if frame[0] != TEXT:
+                    self._put(conn)
+                    conn = None
+                    if frame[0] == ERROR:
+                        _fail(frame[1])
+                    yield frame
+                    return
+                yield frame
+                frame = conn.recv()
+        finally:
+            if conn is not None:  # abandoned mid-reply: the server stops when it next writes
+                conn.close()
+
+    def generate(self, prompt: str, model: str) -> tuple:
+        """(raw text, usage)."""
+        parts, usage = [], {}
+        for op, payload in self.frames(GENERATE, _request(prompt, model)):
+            if op == TEXT:
+                parts.append(payload.decode())
+            else:
+                usage = json.loads(payload)
+        return "".join(parts), usage
+
+    def stream(self, prompt: str, model: str, usage: dict) -> Iterator[str]:
+        """Raw pieces; `usage` is filled once the reply is complete."""
+        for op, payload in self.frames(STREAM, _request(prompt, model)):
+            if op == TEXT:
+                yield payload.decode()
+            else:
+                usage.update(json.loads(payload))
+
+    def _call(self, op: int, body: dict) -> dict:
+        for _, payload in self.frames(op, body):
+            return json.loads(payload)
+
+    def config(self, model: str = None) -> dict:
+        return self._call(CONFIG, {"model": model})
+
+    def stats(self) -> dict:
+        return self._call(STATS, {})
+
+
+class AsyncClient:
+    """asyncio twin of Client, bound to one event loop (see ChatBackend._loop_client)."""
+
+    def __init__(self, path: str, pool: int = HF_SERVER_POOL, timeout: float = HF_SERVER_TIMEOUT):
+        self.path = path
+        self.pool = pool
+        self.timeout = timeout
+        self._idle = []
+
+    async def _recv(self, reader) -> tuple:
+        try:
+            async with asyncio.timeout(self.timeout):
+                op, n = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+                _check(n)
+                return op, (await reader.readexactly(n) if n else b"")
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("inference server closed the connection") from None
+
+    def _put(self, conn: tuple) -> None:
+        if len(self._idle) < self.pool:
+            self._idle.append(conn)
+        else:
+            conn[1].close()
+
+    async def _start(self, data: bytes) -> tuple:
+        while True:
+            reused = bool(self._idle)
+            if reused:
+                conn = self._idle.pop()
+            else:
+                try:
+                    conn = await asyncio.open_unix_connection(self.path)
+                except OSError as e:
+                    raise ConnectionError(f"inference server at {self.path} is not reachable: {e.strerror or e}") from e
+            try:
+                conn[1].write(data)
+                await conn[1].drain()
+                return conn, await self._recv(conn[0])
+            except ConnectionError:
+                conn[1].close()
+                if not reused:
+                    raise
+            except BaseException:
+                conn[1].close()
+                raise
+
+    async def frames(self, op: int, body: dict) -> AsyncIterator[tuple]:
+        conn, frame = await self._start(_json(op, body))
+        try:
+            while True:
+                if frame[0] != TEXT:
+                    self._put(conn)
+                    conn = None
+                    if frame[0] == ERROR:
+                        _fail(frame[1])
+                    yield frame
+                    return
+                yield frame
+                frame = await self._recv(conn[0])
+        finally:
+            if conn is not None:
+                conn[1].close()
+
+    async def generate(self, prompt: str, model: str) -> tuple:
+        parts, usage = [], {}
+        async for op, payload in self.frames(GENERATE, _request(prompt, model)):
+            if op == TEXT:
+                parts.append(payload.decode())
+            else:
+                usage = json.loads(payload)
+        return "".join(parts), usage
+
+    async def stream(self, prompt: str, model: str, usage: dict) -> AsyncIterator[str]:
+        frames = self.frames(STREAM, _request(prompt, model))
+        try:
+            async for op, payload in frames:
+                if op == TEXT:
+                    yield payload.decode()
+                else:
+                    usage.update(json.loads(payload))
+        finally:
+            await frames.aclose()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def client() -> Client:
+    """Per-process client for HF_SERVER; rebuilt after fork so workers never share sockets."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = Client(HF_SERVER)
+                _client_pid = pid
+    return _client
+
+
+class RemoteModels:
+    """
+    ChatBackend stand-in for MODEL_PROVIDER=hf with HF_SERVER (like hfpool.ModelPool,
+    which now lives in the server): one client-mode ChatBackend per model asked for.
+    The models a request may name are the server's, read once per process.
+    """
+
+    provider = "hf"
+    breaker = None
+    _hf_batcher = None
+
+    def __init__(self, default: str):
+        from .models import ChatBackend
+        info = client().config(default)
+        self.default = default
+        self.allowed = set(info["allowed"])
+        self.max_batch = info["max_batch"]  # for views._batch_width: keep the server's batches full
+        self._backends = {default: ChatBackend("hf", default)}
+        self._lock = threading.Lock()
+        self.model_name = self._backends[default].model_name
+
+    def check(self, name: str) -> None:
+        if name not in self.allowed:
+            raise ValueError(f"unknown model {name!r}; available: {', '.join(sorted(self.allowed))}")
+
+    def _backend(self, name: str = None):
+        name = name or self.default
+        backend = self._backends.get(name)
+        if backend is None:
+            from .models import ChatBackend
+            self.check(name)
+            with self._lock:
+                backend = self._backends.get(name)
+                if backend is None:
+                    backend = self._backends[name] = ChatBackend("hf", name)
+        return backend
+
+    def config(self, model: str = None) -> dict:
+        return self._backend(model).config()
+
+    def probe_target(self):
+        return None
+
+    def generate(self, prompt: str, model: str = None) -> str:
+        return self._backend(model).generate(prompt)
+
+    def stream(self, prompt: str, model: str = None) -> Iterator[str]:
+        return self._backend(model).stream(prompt)
+
+    async def agenerate(self, prompt: str, model: str = None) -> str:
+        return await self._backend(model).agenerate(prompt)
+
+    def astream(self, prompt: str, model: str = None) -> AsyncIterator[str]:
+        return self._backend(model).astream(prompt)
+
+    def stats(self) -> dict:
+        return {"server": HF_SERVER, **client().stats()}
+
+
+# ----- Server (one process per host) -----
+def _usage(backend, prompt: str, raw: str, seconds: float) -> dict:
+    # The server's token counters are not the workers' /metrics; the worker records these.
+    tok = backend._hf_tokenizer
+    return {
+        "completion_tokens": len(tok(raw, add_special_tokens=False)["input_ids"]),
+        "prompt_tokens": len(tok(backend._format_prompt(prompt))["input_ids"]),
+        "seconds": round(seconds, 4),
+    }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        server._count("connections", 1)
+        try:
+            while True:
+                frame = _read(self.rfile)
+                if frame is None:
+                    return
+                if not server.dispatch(frame[0], frame[1], self.request.sendall):
+                    return
+        except ConnectionError:
+            pass  # the worker went away (closed mid-stream or exited)
+        finally:
+            server._count("connections", -1)
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """A thread per connection; concurrent GENERATEs meet in the model's micro-batcher."""
+
+    daemon_threads = True
+
+    def __init__(self, path: str, pool):
+        self.path = path
+        self.pool = pool
+        self.started = time.time()
+        self._stats_lock = threading.Lock()
+        self._stats = {"connections": 0, "requests": 0, "streams": 0, "errors": 0, "cancelled": 0}
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                os.unlink(path)  # left behind by a server that died
+            else:
+                raise RuntimeError(f"an inference server is already listening on {path}")
+            finally:
+                probe.close()
+        super().__init__(path, _Handler)
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[name] += n
+
+    def dispatch(self, op: int, payload: bytes, send) -> bool:
+        """Serve one request; False once the connection is unusable."""
+        try:
+            body = json.loads(payload) if payload else {}
+            if op == GENERATE:
+                self._count("requests")
+                self._generate(body, send)
+            elif op == STREAM:
+                self._count("streams")
+                self._stream(body, send)
+            elif op == CONFIG:
+                model = body.get("model") or self.pool.default
+                self.pool.check(model)
+                from .models import HF_BATCH_MAX
+                send(_json(CONFIG, {"config": self.pool.config(model), "allowed": sorted(self.pool.allowed),
+                                    "max_batch": HF_BATCH_MAX if HF_BATCH_MAX > 1 else 0}))
+            elif op == STATS:
+                send(_json(STATS, self.stats()))
+            else:
+                raise InferenceError(f"unknown op {op}")
+        except ConnectionError:
+            self._count("cancelled")
+            return False
+        except Exception as e:
+            if not isinstance(e, ValueError):
+                self._count("errors")
+                logger.exception("Inference request failed")
+            send(_json(ERROR, {"error": type(e).__name__, "detail": str(e)}))
+        return True
+
+    def _generate(self, body: dict, send) -> None:
+        prompt = _prompt(body)
+        with self.pool.lease(body.get("model")) as backend:
+            t0 = perf_counter()
+            raw = backend._generate_raw(prompt)
+            usage = _usage(backend, prompt, raw, perf_counter() - t0)
+        send(_frame(TEXT, raw.encode()) + _json(END, usage))
+
+    def _stream(self, body: dict, send) -> None:
+        prompt = _prompt(body)
+        with self.pool.lease(body.get("model")) as backend:
+            t0 = perf_counter()
+            raw = backend._stream_raw(prompt)
+            parts = []
+            try:
+                for piece in raw:
+                    if piece:
+                        parts.append(piece)
+                        send(_frame(TEXT, piece.encode()))
+            finally:
+                raw.close()  # also when the worker hung up: stops generate()
+            usage = _usage(backend, prompt, "".join(parts), perf_counter() - t0)
+        send(_json(END, usage))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            server = {"pid": os.getpid(), "uptime_s": round(time.time() - self.started, 1), **self._stats}
+        return {**self.pool.stats(), "inference_server": server}
+
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def make_server(path: str) -> InferenceServer:
+    """Load MODEL_NAME (and allow HF_MODELS) in this process and bind `path`; call serve_forever() on it."""
+    global _serving
+    _serving = True
+    from .hfpool import HF_MODELS, ModelPool
+    from .models import MODEL_NAME
+    return InferenceServer(path, ModelPool(MODEL_NAME, HF_MODELS))
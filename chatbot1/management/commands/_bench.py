@@ -0,0 +1,100 @@
+# chatbot1/management/commands/_bench.py
+# Shared helpers for the bench_* management commands.
+
+import json
+import platform
+import threading
+import time
+
+import numpy as np
+
+
+def pct(samples, q: float) -> float:
+    return float(np.percentile(samples, q)) if len(samples) else 0.0
+
+
+def latency_summary(samples_s, prefix: str = "latency_ms") -> dict:
+    ms = [s * 1000 for s in samples_s]
+    return {
+        f"{prefix}_p50": round(pct(ms, 50), 2),
+        f"{prefix}_p95": round(pct(ms, 95), 2),
+        f"{prefix}_p99": round(pct(ms, 99), 2),
+    }
+
+
+def run_meta() -> dict:
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "node": platform.node(),
+    }
+
+
+def write_json(path: str, payload) -> None:
+    with open(path, "w") as fh:
+        json.dump(payload, fh, indent=2)
+
+
+def read_json(path: str):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def _flatten(obj, prefix: str = "") -> dict:
+    out = {}
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            out.update(_flatten(v, f"{prefix}{k}."))
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            name = v.get("name", i) if isinstance(v, dict) else i
+            out.update(_flatten(v, f"{prefix}{name}."))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        out[prefix.rstrip(".")] = float(obj)
+    return out
+
+
+def compare(baseline, current, tolerance: float) -> list:
+    """
+    Regressions between two result payloads. Keys containing `per_s` are
+    higher-is-better; keys ending in `_ms`/`_us` (or `_ms_pNN`/`_us_pNN`) are
+    lower-is-better; everything else is ignored.
+    Returns [(key, baseline, current, change)] beyond `tolerance` (0.1 = 10%).
+    """
+    base, cur = _flatten(baseline), _flatten(current)
+    regressions = []
+    for key, old in base.items():
+        new = cur.get(key)
+        if new is None or old <= 0:
+            continue
+        leaf = key.rsplit(".", 1)[-1]
+        change = (new - old) / old
+        if "per_s" in leaf:
+            worse = change < -tolerance
+        elif "_ms" in leaf or "_us" in leaf:
+            worse = change > tolerance
+        else:
+            continue
+        if worse:
+            regressions.append((key, old, new, change))
+    return regressions
+
+
+def serve_wsgi(app):
+    """Serve a WSGI app on a free local port from a background thread. Returns (server, base_url)."""
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+    class _Server(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+        request_queue_size = 1024
+
+    class _QuietHandler(WSGIRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, server_class=_Server, handler_class=_QuietHandler)
+    threading.Thread(target=server.serve_forever, name="bench-wsgi", daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
@@ -0,0 +1,115 @@
+# chatbot1/management/commands/bench_early_stop.py
+
+import os
+import random
+import tempfile
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot1 import answer, replay
+from chatbot1.models import _STOP_RE
+from chatbot1.stubserver import STUB_REPLY, tokenize
+
+from ._bench import pct, run_meta, write_json
+
+# What models append after the three ideas when nothing stops them.
+_RUN_ON = [
+    "\n\nEnjoy your meal! Let me know if you'd like more ideas or a full recipe for any of these.",
+    "\n• 🍲 Bonus: Lentil soup with crusty bread for a cozy night in.\n• 🍳 Extra: Veggie omelette with cheese.",
+    "\n\nTip: prep the rice and beans on Sunday so weekday dinners take five minutes. "
+    "You can also freeze portions of the soup, and the yogurt bowls keep well overnight in the fridge.",
+    "\n\nWould you like a shopping list for these? I can also suggest snacks, desserts or drinks that pair well.",
+]
+
+
+def _pieces_until(pieces: list, end: int) -> int:
+    """Pieces a stream has delivered once it has shown text[:end + 1]."""
+    seen = 0
+    for n, piece in enumerate(pieces, 1):
+        seen += len(piece)
+        if seen > end:
+            return n
+    return len(pieces)
+
+
+class Command(BaseCommand):
+    help = (
+        "Decode tokens and replay time saved by stopping at the end of the answer (EARLY_STOP): "
+        "per recorded reply, tokens a stream reads with only STOP_SEQS vs also with the answer detector."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="", help="Replay corpus (default: a synthetic one of run-on replies).")
+        parser.add_argument("--config", default="", help="Fingerprint prefix of the recorded config (default: latest).")
+        parser.add_argument("--synthetic", type=int, default=2000, help="Entries in the synthetic corpus.")
+        parser.add_argument("--json", dest="json_out", default="")
+
+    def _synthetic(self, path: str, n: int) -> None:
+        rng = random.Random(0)
+        pieces = len(tokenize(STUB_REPLY))
+        rows = []
+        for i in range(n):
+            # About a third stop on their own; the rest run on for one or two extras.
+            tail = "".join(rng.sample(_RUN_ON, rng.choice([0, 1, 1, 2])))
+            reply = STUB_REPLY + tail
+            total = len(tokenize(reply))
+            rows.append((f"synthetic prompt {i}", reply, 300.0, 300.0 + 1000 * (total - 1) / 50, 40, total))
+        st = replay.ReplayStore(path, readonly=False)
+        st.put_many({"provider": "synthetic", "model": "run-on"}, rows)
+        st.close()
+        self.stdout.write(f"built {n} synthetic entries ({pieces} tokens of answer + run-on tails)")
+
+    def handle(self, *args, **opts):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = opts["path"] or os.path.join(tmp, "corpus.sqlite3")
+            if not opts["path"]:
+                self._synthetic(path, opts["synthetic"])
+            elif not os.path.exists(path):
+                raise CommandError(f"No replay corpus at {path}")
+            st = replay.ReplayStore(path, readonly=True)
+            cid, fp, config = st.resolve(opts["config"])
+
+            reasons = Counter()
+            base_tokens = early_tokens = 0
+            base_ms, early_ms = [], []
+            for _, rec in st.entries(cid):
+                pieces = tokenize(rec.reply) or [""]
+                m = _STOP_RE.search(rec.reply)
+                stop = m.start() if m else len(rec.reply)
+                base = _pieces_until(pieces, stop) if m else len(pieces)
+                detector = answer.Detector()  # measured even with EARLY_STOP off
+                end = detector.scan(rec.reply[:stop])
+                early = base if end == -1 else min(base, _pieces_until(pieces, end))
+                reasons[detector.reason if early < base else "none"] += 1
+                ttft, gap = replay.timing(rec, len(pieces))
+                base_tokens += base
+                early_tokens += early
+                base_ms.append((ttft + gap * (base - 1)) * 1000)
+                early_ms.append((ttft + gap * (early - 1)) * 1000)
+            st.close()
+
+        n = len(base_ms)
+        if not n:
+            raise CommandError(f"Config {fp} has no entries")
+        results = {
+            "config": {"fingerprint": fp, "provider": config.get("provider"), "model": config.get("model")},
+            "entries": n,
+            "stopped_early": {k: v for k, v in reasons.items() if k != "none"},
+            "tokens_per_reply": {"baseline": round(base_tokens / n, 1), "early_stop": round(early_tokens / n, 1)},
+            "tokens_saved_pct": round(100 * (1 - early_tokens / base_tokens), 1) if base_tokens else 0.0,
+            "reply_ms": {
+                "baseline_p50": round(pct(base_ms, 50), 1), "baseline_p95": round(pct(base_ms, 95), 1),
+                "early_stop_p50": round(pct(early_ms, 50), 1), "early_stop_p95": round(pct(early_ms, 95), 1),
+            },
+        }
+        self.stdout.write(f"{fp} {results['config']['provider']}:{results['config']['model']}: {n} replies, "
+                          f"{sum(results['stopped_early'].values())} stopped early {results['stopped_early']}")
+        self.stdout.write(f"tokens/reply {results['tokens_per_reply']['baseline']} -> "
+                          f"{results['tokens_per_reply']['early_stop']} ({results['tokens_saved_pct']}% saved)")
+        r = results["reply_ms"]
+        self.stdout.write(f"reply time p50 {r['baseline_p50']} -> {r['early_stop_p50']} ms, "
+                          f"p95 {r['baseline_p95']} -> {r['early_stop_p95']} ms")
+        if opts["json_out"]:
+            write_json(opts["json_out"], {"meta": run_meta(), **results})
+            self.stdout.write(f"Wrote {opts['json_out']}")
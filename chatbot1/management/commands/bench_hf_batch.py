@@ -0,0 +1,65 @@
+# chatbot1/management/commands/bench_hf_batch.py
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from chatbot1.batching import MicroBatcher
+from chatbot1.models import FALLBACK_MODEL_NAME, ChatBackend
+
+from ._bench import latency_summary, write_json
+
+_PROMPTS = [
+    "I'm hungry, what should I eat?",
+    "What's for dinner tonight?",
+    "Quick breakfast ideas please",
+    "Cheap vegetarian lunch?",
+    "Healthy snack after the gym",
+    "Something spicy for dinner",
+    "Easy meal for kids",
+    "Late night craving, ideas?",
+]
+
+
+class Command(BaseCommand):
+    help = "Compare HF throughput: one generate() per request vs the micro-batching scheduler."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=FALLBACK_MODEL_NAME)
+        parser.add_argument("--requests", type=int, default=32)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--max-batch", type=int, default=8)
+        parser.add_argument("--window-ms", type=float, default=15.0)
+        parser.add_argument("--json", dest="json_out", default="")
+
+    def _run(self, fn, n: int, concurrency: int) -> dict:
+        def one(i):
+            t0 = time.perf_counter()
+            fn(_PROMPTS[i % len(_PROMPTS)])
+            return time.perf_counter() - t0
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            lat = list(pool.map(one, range(n)))
+        wall = time.perf_counter() - started
+        return {"requests": n, "wall_s": round(wall, 2), "req_per_s": round(n / wall, 3), **latency_summary(lat)}
+
+    def handle(self, *args, **opts):
+        self.stdout.write(f"Loading {opts['model']} …")
+        backend = ChatBackend("hf", opts["model"])
+        backend._gen_hf("warmup")
+
+        n, conc = opts["requests"], opts["concurrency"]
+        unbatched = self._run(backend._gen_hf, n, conc)
+        self.stdout.write(f"unbatched : {unbatched}")
+
+        batcher = MicroBatcher(backend._gen_hf_batch, window=opts["window_ms"] / 1000, max_batch=opts["max_batch"])
+        batched = self._run(batcher.submit, n, conc)
+        batched["batcher"] = batcher.stats()
+        self.stdout.write(f"batched   : {batched}")
+        self.stdout.write(f"speedup   : {batched['req_per_s'] / unbatched['req_per_s']:.2f}x")
+
+        if opts["json_out"]:
+            write_json(opts["json_out"], {"model": opts["model"], "concurrency": conc,
+                                          "unbatched": unbatched, "batched": batched})
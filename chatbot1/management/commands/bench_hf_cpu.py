@@ -0,0 +1,164 @@
+# chatbot1/management/commands/bench_hf_cpu.py
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot1.models import FALLBACK_MODEL_NAME
+
+from ._bench import run_meta, write_json
+
+_PROMPTS = [
+    "I'm hungry, what should I eat?",
+    "Quick lunch ideas?",
+    "Something healthy for dinner tonight",
+    "I have eggs, rice and spinach. What can I make?",
+]
+
+# name -> env overrides (see chatbot1/hf_cpu.py); each runs in a fresh process so RSS is its own.
+_MODES = {
+    "float32": {"HF_CPU_DTYPE": "float32", "HF_QUANTIZE": ""},
+    "bfloat16": {"HF_CPU_DTYPE": "bfloat16", "HF_QUANTIZE": ""},
+    "int8": {"HF_CPU_DTYPE": "float32", "HF_QUANTIZE": "int8"},
+}
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "HF CPU modes (float32 / bfloat16 / dynamic int8, see HF_CPU_DTYPE, HF_QUANTIZE, HF_THREADS): "
+        "decode tokens/sec, resident memory and greedy-output drift against float32."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=FALLBACK_MODEL_NAME, help="HF model id or local path.")
+        parser.add_argument("--modes", default=",".join(_MODES), help="Comma-separated subset of: " + ", ".join(_MODES))
+        parser.add_argument("--new-tokens", type=int, default=48)
+        parser.add_argument("--repeat", type=int, default=2)
+        parser.add_argument("--threads", type=int, default=0, help="HF_THREADS for every mode (0 = auto).")
+        parser.add_argument("--json", dest="json_out", default="")
+        # Internal: run one mode in this process and write its result to --child-out.
+        parser.add_argument("--child-out", default="", help="(internal)")
+        parser.add_argument("--reference", default="", help="(internal) float32 sequences to score drift against.")
+
+    # ----- One mode (child process) -----
+    def _measure(self, opts) -> dict:
+        import torch  # noqa: F401 -- import cost is not part of the model's footprint
+        import transformers  # noqa: F401
+        from chatbot1 import hf_cpu
+        from chatbot1.models import ChatBackend
+
+        rss_base = _rss_mb()
+        t0 = time.perf_counter()
+        backend = ChatBackend("hf", model_name=opts["model"])
+        load_s = time.perf_counter() - t0
+        tok, model = backend._hf_tokenizer, backend._hf_model
+        greedy = dict(do_sample=False, eos_token_id=tok.eos_token_id, pad_token_id=tok.eos_token_id)
+        n = opts["new_tokens"]
+
+        encoded = [tok([backend._format_prompt(p)], return_tensors="pt") for p in _PROMPTS]
+        backend._hf_generate(**encoded[0], max_new_tokens=4, **greedy)  # warm-up
+        sequences, seconds = [], 0.0
+        for _ in range(opts["repeat"]):
+            sequences = []
+            for inputs in encoded:
+                t0 = time.perf_counter()
+                out = backend._hf_generate(**inputs, max_new_tokens=n, min_new_tokens=n, **greedy)
+                seconds += time.perf_counter() - t0
+                sequences.append(out[0].tolist())
+        rss = _rss_mb()  # after generating: lazily mapped weights are resident by now
+        result = {
+            "settings": hf_cpu.describe(model),
+            "load_s": round(load_s, 2),
+            "tokens_per_s": round(n * len(encoded) * opts["repeat"] / seconds, 2),
+            "rss_mb": round(rss, 1),
+            "rss_mb_model": round(rss - rss_base, 1),
+            "rss_mb_peak": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "sequences": sequences,
+        }
+        if opts["reference"]:
+            with open(opts["reference"]) as fh:
+                result.update(self._drift(backend, encoded, json.load(fh)))
+        return result
+
+    def _drift(self, backend, encoded, reference: list) -> dict:
+        """Teacher-forced top-1 agreement with the float32 greedy tokens."""
+        import torch
+        agree = total = 0
+        for inputs, ref in zip(encoded, reference):
+            start = inputs["input_ids"].shape[1]
+            ids = torch.tensor([ref])
+            with torch.inference_mode():
+                logits = backend._hf_model(input_ids=ids).logits[0]
+            predicted = logits[start - 1:-1].argmax(-1).tolist()
+            agree += sum(p == r for p, r in zip(predicted, ref[start:]))
+            total += len(ref) - start
+        return {"top1_agreement": round(agree / total, 4) if total else 1.0}
+
+    # ----- Report (parent process) -----
+    def _spawn(self, mode: str, opts, out: str, reference: str = "") -> dict:
+        env = {**os.environ, **_MODES[mode], "HF_THREADS": str(opts["threads"]), "HF_BATCH_MAX": "1",
+               "HF_PREFIX_CACHE": "0"}
+        cmd = [sys.executable, str(settings.BASE_DIR / "manage.py"), "bench_hf_cpu", "--model", opts["model"],
+               "--new-tokens", str(opts["new_tokens"]), "--repeat", str(opts["repeat"]), "--child-out", out]
+        if reference:
+            cmd += ["--reference", reference]
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise CommandError(f"{mode} run failed:\n{proc.stderr[-2000:]}")
+        with open(out) as fh:
+            return json.load(fh)
+
+    def handle(self, *args, **opts):
+        if opts["child_out"]:
+            write_json(opts["child_out"], self._measure(opts))
+            return
+
+        modes = [m.strip() for m in opts["modes"].split(",") if m.strip()]
+        unknown = [m for m in modes if m not in _MODES]
+        if unknown:
+            raise CommandError(f"Unknown mode(s): {', '.join(unknown)}")
+        if "float32" in modes:
+            modes.remove("float32")
+        results = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            results["float32"] = self._spawn("float32", opts, os.path.join(tmp, "float32.json"))
+            reference = os.path.join(tmp, "reference.json")
+            write_json(reference, results["float32"]["sequences"])
+            results["float32"]["top1_agreement"] = 1.0
+            for mode in modes:
+                results[mode] = self._spawn(mode, opts, os.path.join(tmp, f"{mode}.json"), reference)
+
+        base = results["float32"]
+        base_sequences = base["sequences"]
+        for r in results.values():
+            r["exact_match"] = sum(a == b for a, b in zip(r.pop("sequences"), base_sequences))
+        for mode, r in results.items():
+            self.stdout.write(
+                f"{mode:<9} {r['tokens_per_s']:>8.1f} tok/s ({r['tokens_per_s'] / base['tokens_per_s']:.2f}x)  "
+                f"weights {r['settings']['weights_mb']:>6.1f} MB  rss {r['rss_mb']:>7.1f} MB (model {r['rss_mb_model']:.1f}, "
+                f"peak {r['rss_mb_peak']:.1f})  "
+                f"top-1 agreement {r['top1_agreement']:.1%}  exact {r['exact_match']}/{len(_PROMPTS)}  "
+                f"load {r['load_s']:.1f}s  threads {r['settings']['intra_op_threads']}"
+            )
+        if opts["json_out"]:
+            write_json(opts["json_out"], {"meta": run_meta(), "model": opts["model"], "new_tokens": opts["new_tokens"],
+                                          "results": results})
+            self.stdout.write(f"Wrote {opts['json_out']}")
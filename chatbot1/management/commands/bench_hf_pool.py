@@ -0,0 +1,114 @@
+# chatbot1/management/commands/bench_hf_pool.py
+
+import resource
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot1 import hfpool
+
+from ._bench import latency_summary, run_meta, write_json
+
+_PROMPTS = [
+    "I'm hungry, what should I eat?",
+    "Quick lunch ideas?",
+    "Something healthy for dinner tonight",
+    "Cheap vegetarian meals for the week",
+]
+
+
+def _rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+class Command(BaseCommand):
+    help = (
+        "HF model pool (HF_MODELS / HF_POOL_MB / HF_POOL_MAX): cold-load vs warm latency per model, "
+        "concurrent requests for a cold model coalescing into one load, evictions and peak memory vs the budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--models", required=True, help="Comma-separated HF ids or local paths; the first is the default.")
+        parser.add_argument("--budget-mb", type=float, default=hfpool.HF_POOL_MB, help="Weight budget (0 = none).")
+        parser.add_argument("--max-models", type=int, default=hfpool.HF_POOL_MAX, help="Models loaded at once (0 = any).")
+        parser.add_argument("--repeat", type=int, default=2, help="Passes over the model list.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Simultaneous requests for a cold model.")
+        parser.add_argument("--json", dest="json_out", default="")
+
+    def _timed(self, pool, name: str, prompt: str) -> float:
+        t0 = time.perf_counter()
+        pool.generate(prompt, model=name)
+        return time.perf_counter() - t0
+
+    def handle(self, *args, **opts):
+        names = [m.strip() for m in opts["models"].split(",") if m.strip()]
+        if not names:
+            raise CommandError("--models is empty")
+        rss_before = _rss_mb()
+        t0 = time.perf_counter()
+        pool = hfpool.ModelPool(names[0], names[1:], budget_mb=opts["budget_mb"], max_models=opts["max_models"])
+        init_s = time.perf_counter() - t0
+
+        # Cold = the request that finds its model unloaded (includes the load); warm = the ones after it.
+        cold, warm = {n: [] for n in names}, {n: [] for n in names}
+        for _ in range(opts["repeat"]):
+            for name in names:
+                loaded = {m["model"] for m in pool.stats()["models"]}
+                for i, prompt in enumerate(_PROMPTS):
+                    (warm if name in loaded or i else cold)[name].append(self._timed(pool, name, prompt))
+
+        # Concurrent requests for a model the passes above left evicted.
+        st = pool.stats()
+        loaded = [m["model"] for m in st["models"]]
+        target = next((n for n in names if n not in loaded), None)
+        burst = None
+        if target is None:
+            self.stdout.write(self.style.WARNING(
+                "Every model fits the pool; skipping the cold burst (lower --budget-mb or --max-models)."
+            ))
+        else:
+            before = dict(st)
+            took, threads = [], []
+            for i in range(opts["concurrency"]):
+                threads.append(threading.Thread(
+                    target=lambda i=i: took.append(self._timed(pool, target, _PROMPTS[i % len(_PROMPTS)]))))
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            after = pool.stats()
+            burst = {"model": target, "requests": len(took),
+                     "loads": after["loads"] - before["loads"],
+                     "coalesced": after["coalesced"] - before["coalesced"],
+                     **latency_summary(took, "request_ms")}
+
+        st = pool.stats()
+        results = {
+            "config": {"models": names, "budget_mb": st["budget_mb"], "max_models": st["max_models"]},
+            "init_ms": round(init_s * 1000, 1),  # imports + the default model's eager load
+            "models": [
+                {"name": n, "cold_loads": len(cold[n]),
+                 **latency_summary(cold[n], "cold_ms"), **latency_summary(warm[n], "warm_ms")}
+                for n in names
+            ],
+            "burst": burst,
+            "pool": {k: st[k] for k in ("loads", "hits", "coalesced", "evictions", "over_budget",
+                                        "resident_mb", "peak_mb")},
+            "rss_mb": {"before": round(rss_before, 1), "peak": round(_rss_mb(), 1)},
+        }
+
+        self.stdout.write(f"pool init (imports + {names[0]}): {results['init_ms']} ms")
+        for row in results["models"]:
+            self.stdout.write(f"{row['name']}: {row['cold_loads']} cold, cold p50 {row['cold_ms_p50']} ms, "
+                              f"warm p50 {row['warm_ms_p50']} ms")
+        if burst:
+            self.stdout.write(f"{burst['requests']} concurrent requests for cold {target}: {burst['loads']} load(s), "
+                              f"{burst['coalesced']} coalesced, p95 {burst['request_ms_p95']} ms")
+        p = results["pool"]
+        budget = f"{st['budget_mb']} MB" if st["budget_mb"] else "no budget"
+        self.stdout.write(f"pool: {p['loads']} loads, {p['evictions']} evictions, {p['over_budget']} over budget; "
+                          f"weights peak {p['peak_mb']} MB ({budget}), process RSS peak {results['rss_mb']['peak']} MB")
+        if opts["json_out"]:
+            write_json(opts["json_out"], {"meta": run_meta(), **results})
+            self.stdout.write(f"Wrote {opts['json_out']}")
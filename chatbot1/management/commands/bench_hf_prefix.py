@@ -0,0 +1,88 @@
+# chatbot1/management/commands/bench_hf_prefix.py
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot1 import models
+from chatbot1.models import FALLBACK_MODEL_NAME, ChatBackend
+
+from ._bench import latency_summary, run_meta, write_json
+
+_PROMPTS = [
+    "I'm hungry, what should I eat?",
+    "Quick lunch ideas?",
+    "Something healthy for dinner tonight",
+    "I have eggs, rice and spinach. What can I make?",
+    "Cheap vegetarian meals for the week",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "HF prefill with and without the cached system-prompt prefix (HF_PREFIX_CACHE): "
+        "time to first token and full greedy generation on a local model."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=FALLBACK_MODEL_NAME, help="HF model id or local path.")
+        parser.add_argument("--repeat", type=int, default=5, help="Passes over the prompt set per mode.")
+        parser.add_argument("--new-tokens", type=int, default=32, help="Tokens per full generation.")
+        parser.add_argument("--json", dest="json_out", default="")
+
+    def _run(self, backend, new_tokens: int, repeat: int) -> dict:
+        tok, model = backend._hf_tokenizer, backend._hf_model
+        greedy = dict(do_sample=False, eos_token_id=tok.eos_token_id, pad_token_id=tok.eos_token_id)
+        prefill, full, outputs = [], [], []
+        for _ in range(repeat):
+            for prompt in _PROMPTS:
+                inputs = tok([backend._format_prompt(prompt)], return_tensors="pt").to(model.device)
+                t0 = time.perf_counter()
+                model.generate(**inputs, **backend._hf_prefill(inputs), max_new_tokens=1, **greedy)
+                prefill.append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                out = model.generate(**inputs, **backend._hf_prefill(inputs),
+                                     max_new_tokens=new_tokens, min_new_tokens=new_tokens, **greedy)
+                full.append(time.perf_counter() - t0)
+                outputs.append(out[0].tolist())
+        return {**latency_summary(prefill, "prefill_ms"), **latency_summary(full, "generate_ms"),
+                "_outputs": outputs}
+
+    def handle(self, *args, **opts):
+        enabled = models.HF_PREFIX_CACHE
+        backend = ChatBackend("hf", model_name=opts["model"])
+        tok = backend._hf_tokenizer
+        prefix = backend._hf_prefix_cache()
+        if prefix is None:
+            self.stdout.write(self.style.WARNING(
+                "No cacheable system prefix for this model (no chat template?); both modes run the same path."
+            ))
+        prompt_tokens = [len(tok(backend._format_prompt(p))["input_ids"]) for p in _PROMPTS]
+        results = {}
+        try:
+            for name, on in (("no_prefix_cache", False), ("prefix_cache", True)):
+                models.HF_PREFIX_CACHE = on
+                self._run(backend, 2, 1)  # warm-up
+                results[name] = self._run(backend, opts["new_tokens"], opts["repeat"])
+        finally:
+            models.HF_PREFIX_CACHE = enabled
+
+        same = results["no_prefix_cache"].pop("_outputs") == results["prefix_cache"].pop("_outputs")
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<16} prefill p50 {r['prefill_ms_p50']:>8.2f} ms  p95 {r['prefill_ms_p95']:>8.2f} ms  "
+                f"generate({opts['new_tokens']}) p50 {r['generate_ms_p50']:>8.2f} ms"
+            )
+        self.stdout.write(
+            f"prefix tokens {len(prefix[0]) if prefix else 0}, prompt tokens {min(prompt_tokens)}-{max(prompt_tokens)}, "
+            f"greedy outputs identical: {same}"
+        )
+        if opts["json_out"]:
+            write_json(opts["json_out"], {
+                "meta": run_meta(),
+                "model": opts["model"],
+                "prefix_tokens": len(prefix[0]) if prefix else 0,
+                "identical_outputs": same,
+                "results": results,
+            })
+            self.stdout.write(f"Wrote {opts['json_out']}")
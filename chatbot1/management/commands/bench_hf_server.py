@@ -0,0 +1,151 @@
+# chatbot1/management/commands/bench_hf_server.py
+
+import multiprocessing as mp
+import os
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ._bench import latency_summary, run_meta, write_json
+
+
+def _worker(requests: int, concurrency: int, ready, go, out) -> None:
+    """One web worker: build the HF backend (in-process or client mode, per HF_SERVER), then chat."""
+    import django
+    django.setup()
+    from concurrent.futures import ThreadPoolExecutor
+    from chatbot1.models import MyChatbot1
+
+    t0 = time.perf_counter()
+    bot = MyChatbot1()
+    init_s = time.perf_counter() - t0
+    ready.put(os.getpid())
+    go.wait()
+
+    def one(i: int) -> float:
+        t = time.perf_counter()
+        bot.generate(f"bench {os.getpid()} {i}: what should I eat?", use_cache=False)
+        return time.perf_counter() - t
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        took = list(pool.map(one, range(requests)))
+    out.put({"init_s": init_s, "took": took, "torch": "torch" in sys.modules,
+             "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+
+
+def _peak_rss_mb(pid: int) -> float:
+    # VmHWM: the process's peak resident set (Linux).
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "HF in each web worker vs one shared inference server (HF_SERVER): host memory and throughput "
+        "as the number of worker processes grows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default="", help="HF model id or local path (default: FALLBACK_MODEL_NAME).")
+        parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker process counts.")
+        parser.add_argument("--requests", type=int, default=16, help="Chats per worker.")
+        parser.add_argument("--concurrency", type=int, default=2, help="Concurrent chats per worker.")
+        parser.add_argument("--new-tokens", type=int, default=32, help="MAX_NEW_TOKENS for every process.")
+        parser.add_argument("--json", dest="json_out", default="")
+
+    def _run(self, n: int, opts: dict, server: str) -> dict:
+        ctx = mp.get_context("spawn")  # fresh interpreters, like gunicorn workers that did not preload
+        ready, out, go = ctx.Queue(), ctx.Queue(), ctx.Event()
+        os.environ["HF_SERVER"] = server
+        os.environ["GUNICORN_WORKERS"] = str(n)  # in-process HF sizes its torch threads per worker
+        procs = [ctx.Process(target=_worker, args=(opts["requests"], opts["concurrency"], ready, go, out))
+                 for _ in range(n)]
+        for p in procs:
+            p.start()
+        started = 0
+        while started < n:
+            try:
+                ready.get(timeout=1)
+                started += 1
+            except queue.Empty:
+                if any(p.exitcode for p in procs):
+                    for p in procs:
+                        p.terminate()
+                    raise CommandError("a worker process failed to start (see its traceback above)")
+        t0 = time.perf_counter()
+        go.set()
+        results = [out.get(timeout=1200) for _ in procs]
+        wall = time.perf_counter() - t0
+        for p in procs:
+            p.join()
+        took = [s for r in results for s in r["took"]]
+        return {
+            "workers": n,
+            "chats_per_s": round(len(took) / wall, 2),
+            **latency_summary(took),
+            "worker_init_ms": round(1000 * max(r["init_s"] for r in results), 1),
+            "worker_rss_mb": round(sum(r["rss_mb"] for r in results), 1),
+            "workers_import_torch": any(r["torch"] for r in results),
+        }
+
+    def handle(self, *args, **opts):
+        # Imported here: spawned workers import this module before Django is set up.
+        from chatbot1.models import FALLBACK_MODEL_NAME
+        counts = [int(n) for n in opts["workers"].split(",") if n.strip()]
+        if not counts:
+            raise CommandError("--workers is empty")
+        opts["model"] = opts["model"] or FALLBACK_MODEL_NAME
+        os.environ.update(MODEL_PROVIDER="hf", MODEL_NAME=opts["model"], MAX_NEW_TOKENS=str(opts["new_tokens"]),
+                          CHAT_CACHE_SHARED="", SINGLEFLIGHT="0", HEALTH_MONITOR="0")
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings.SETTINGS_MODULE)
+        results = {"config": {"model": opts["model"], "requests_per_worker": opts["requests"],
+                              "concurrency": opts["concurrency"], "new_tokens": opts["new_tokens"]},
+                   "in_process": [], "server": []}
+
+        for n in counts:
+            row = self._run(n, opts, "")
+            row["host_rss_mb"] = row["worker_rss_mb"]
+            results["in_process"].append(row)
+            self.stdout.write(f"in-process x{n}: {row['chats_per_s']} chats/s, p95 {row['latency_ms_p95']} ms, "
+                              f"host RSS {row['host_rss_mb']} MB")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "hf.sock")
+            # One server per worker count, so its peak memory is that run's.
+            for n in counts:
+                srv = subprocess.Popen(
+                    [sys.executable, str(settings.BASE_DIR / "manage.py"), "inference_server", "--socket", path],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                )
+                try:
+                    deadline = time.monotonic() + 600
+                    while not os.path.exists(path):
+                        if srv.poll() is not None or time.monotonic() > deadline:
+                            raise CommandError("inference server did not start")
+                        time.sleep(0.2)
+                    row = self._run(n, opts, path)
+                    row["server_rss_mb"] = round(_peak_rss_mb(srv.pid), 1)
+                finally:
+                    srv.terminate()
+                    srv.wait()
+                row["host_rss_mb"] = round(row["worker_rss_mb"] + row["server_rss_mb"], 1)
+                results["server"].append(row)
+                self.stdout.write(f"server     x{n}: {row['chats_per_s']} chats/s, p95 {row['latency_ms_p95']} ms, "
+                                  f"host RSS {row['host_rss_mb']} MB (server {row['server_rss_mb']} MB, "
+                                  f"workers {row['worker_rss_mb']} MB, torch in workers: {row['workers_import_torch']})")
+
+        if opts["json_out"]:
+            write_json(opts["json_out"], {"meta": run_meta(), **results})
+            self.stdout.write(f"Wrote {opts['json_out']}")
@@ -0,0 +1,55 @@
+# chatbot1/management/commands/bench_http.py
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot1 import transport
+from chatbot1.stubserver import StubServer
+
+from ._bench import latency_summary, write_json
+
+
+class Command(BaseCommand):
+    help = "Per-request latency: a fresh connection per call vs the pooled keep-alive transport (local stub)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=300)
+        parser.add_argument("--latency-ms", type=float, default=0.0, help="Synthetic upstream latency.")
+        parser.add_argument("--json", dest="json_out", default="")
+
+    def _measure(self, post, url: str, n: int) -> list:
+        payload = {"model": "stub", "messages": [{"role": "user", "content": "hi"}], "stream": False}
+        samples = []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            r = post(url, json=payload, timeout=transport.timeout())
+            r.raise_for_status()
+            transport.json_body(r)
+            samples.append(time.perf_counter() - t0)
+        return samples
+
+    def handle(self, *args, **opts):
+        import requests
+
+        n = opts["requests"]
+        with StubServer(latency=opts["latency_ms"] / 1000) as stub:
+            url = stub.url + "/api/chat"
+            self._measure(requests.post, url, 5)
+            fresh = self._measure(requests.post, url, n)
+            pooled = self._measure(transport.session().post, url, n)
+
+        result = {
+            "requests": n,
+            "fresh": {"mean_ms": round(sum(fresh) / n * 1000, 3), **latency_summary(fresh)},
+            "pooled": {"mean_ms": round(sum(pooled) / n * 1000, 3), **latency_summary(pooled)},
+        }
+        result["saved_ms_per_request"] = round(result["fresh"]["mean_ms"] - result["pooled"]["mean_ms"], 3)
+        self.stdout.write(f"fresh connection : {result['fresh']}")
+        self.stdout.write(f"pooled keep-alive: {result['pooled']}")
+        self.stdout.write(
+            f"saved per request: {result['saved_ms_per_request']} ms "
+            "(loopback, plain HTTP; a remote TLS upstream saves the handshake RTTs on top)"
+        )
+        if opts["json_out"]:
+            write_json(opts["json_out"], result)
@@ -0,0 +1,157 @@
+# chatbot1/management/commands/bench_load.py
+
+import http.client
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot1.stubserver import StubServer
+
+from ._bench import compare, latency_summary, read_json, run_meta, serve_wsgi, write_json
+
+
+class Command(BaseCommand):
+    help = (
+        "End-to-end load test: drives /chatbot1/chat/ (or chat/stream/) through the real Django stack "
+        "against a local stub LLM server, so runs are repeatable without Groq/Ollama."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--provider", choices=["openai", "ollama", "both"], default="both")
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--latency-ms", type=float, default=50.0, help="Stub time to first token.")
+        parser.add_argument("--tokens-per-s", type=float, default=200.0, help="Stub decode rate (0 = instant).")
+        parser.add_argument("--stream", action="store_true", help="Hit chat/stream/ and record time to first delta.")
+        parser.add_argument("--same-prompt", action="store_true",
+                            help="Send one prompt for every request (exercises coalescing).")
+        parser.add_argument("--use-cache", action="store_true", help="Let the response cache answer repeats.")
+        parser.add_argument("--url", default="",
+                            help="Base URL of an already running server (skips the in-process app and stub wiring).")
+        parser.add_argument("--json", dest="json_out", default="")
+        parser.add_argument("--compare", default="", help="Baseline JSON; fail on regressions.")
+        parser.add_argument("--tolerance", type=float, default=0.15)
+
+    def _one(self, session, url: str, prompt: str, opts) -> tuple:
+        body = {"prompt": prompt}
+        if not opts["use_cache"]:
+            body["no_cache"] = True
+        t0 = time.perf_counter()
+        if not opts["stream"]:
+            r = session.post(url, json=body, timeout=120)
+            ok = r.status_code == 200 and bool(r.json().get("response"))
+            return ok, time.perf_counter() - t0, None
+        # http.client rather than requests: iter_lines() buffers 512 bytes, which would hide
+        # the first small NDJSON frames and inflate time to first token.
+        parts = urlsplit(url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=120)
+        first, ok = None, False
+        try:
+            conn.request("POST", parts.path, json.dumps(body), {"Content-Type": "application/json"})
+            r = conn.getresponse()
+            for line in iter(r.readline, b""):
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if "delta" in event and first is None:
+                    first = time.perf_counter() - t0
+                if "error" in event:
+                    break
+                if event.get("done"):
+                    ok = bool(event.get("response"))
+        finally:
+            conn.close()
+        return ok, time.perf_counter() - t0, first
+
+    def _drive(self, base_url: str, opts) -> dict:
+        import requests
+
+        url = base_url.rstrip("/") + ("/chatbot1/chat/stream/" if opts["stream"] else "/chatbot1/chat/")
+        n, conc = opts["requests"], opts["concurrency"]
+        sessions = [requests.Session() for _ in range(conc)]
+
+        def worker(i):
+            prompt = "I'm hungry, what should I eat?" if opts["same_prompt"] else f"I'm hungry, idea #{i}?"
+            try:
+                return self._one(sessions[i % conc], url, prompt, opts)
+            except Exception:
+                return False, 0.0, None
+
+        worker(0)  # warm up (model init, connections)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=conc) as pool:
+            results = list(pool.map(worker, range(n)))
+        wall = time.perf_counter() - t0
+
+        ok = [r for r in results if r[0]]
+        out = {
+            "requests": n,
+            "concurrency": conc,
+            "errors": n - len(ok),
+            "wall_s": round(wall, 3),
+            "req_per_s": round(len(ok) / wall, 2) if wall else 0.0,
+            **latency_summary([r[1] for r in ok]),
+        }
+        ttft = [r[2] for r in ok if r[2] is not None]
+        if ttft:
+            out.update(latency_summary(ttft, prefix="ttft_ms"))
+        return out
+
+    def _report(self, name: str, res: dict) -> None:
+        line = (f"{name:<8} {res['req_per_s']:>8.1f} req/s  p50 {res['latency_ms_p50']:>7.1f} ms  "
+                f"p95 {res['latency_ms_p95']:>7.1f} ms  p99 {res['latency_ms_p99']:>7.1f} ms  errors {res['errors']}")
+        if "ttft_ms_p50" in res:
+            line += f"  ttft p50 {res['ttft_ms_p50']:.1f} ms"
+        self.stdout.write(line)
+
+    def handle(self, *args, **opts):
+        if opts["url"]:
+            runs = [dict(name="remote", **self._drive(opts["url"], opts))]
+        else:
+            runs = self._local(opts)
+        for run in runs:
+            self._report(run["name"], run)
+
+        payload = {
+            "meta": run_meta(),
+            "params": {k: opts[k] for k in ("requests", "concurrency", "latency_ms", "tokens_per_s", "stream")},
+            "results": runs,
+        }
+        if opts["json_out"]:
+            write_json(opts["json_out"], payload)
+            self.stdout.write(f"Wrote {opts['json_out']}")
+        if opts["compare"]:
+            regressions = compare(read_json(opts["compare"]).get("results", []), runs, opts["tolerance"])
+            if regressions:
+                for key, old, new, change in regressions:
+                    self.stdout.write(self.style.ERROR(f"REGRESSION {key}: {old:g} -> {new:g} ({change:+.1%})"))
+                raise CommandError(f"{len(regressions)} regression(s) beyond {opts['tolerance']:.0%}")
+            self.stdout.write(self.style.SUCCESS(f"No regressions beyond {opts['tolerance']:.0%}."))
+
+    def _local(self, opts) -> list:
+        from bot_testing.wsgi import application
+
+        from chatbot1 import views
+        from chatbot1.models import ChatBackend, MyChatbot1
+
+        providers = ["openai", "ollama"] if opts["provider"] == "both" else [opts["provider"]]
+        runs = []
+        with StubServer(latency=opts["latency_ms"] / 1000, tokens_per_s=opts["tokens_per_s"]) as stub:
+            os.environ["OPENAI_BASE_URL"] = stub.url + "/v1"
+            os.environ["OPENAI_API_KEY"] = "stub"
+            os.environ["OLLAMA_BASE"] = stub.url
+            os.environ["CUSTOS_BACKEND_URL"] = stub.url
+            server, base_url = serve_wsgi(application)
+            try:
+                for provider in providers:
+                    views._bot = MyChatbot1(ChatBackend(provider=provider, model_name="stub"))
+                    runs.append(dict(name=provider, **self._drive(base_url, opts)))
+            finally:
+                views._bot = None
+                server.shutdown()
+                server.server_close()
+        return runs
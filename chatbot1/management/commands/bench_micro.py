@@ -0,0 +1,119 @@
+# chatbot1/management/commands/bench_micro.py
+
+import json
+import statistics
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot1.cache import cache_key
+from chatbot1.models import ChatBackend, _clean, _StreamCleaner
+from chatbot1.stubserver import STUB_REPLY, tokenize
+from chatbot1.views import _is_meal_prompt, _looks_derailed, _read_json
+
+from ._bench import compare, read_json, run_meta, write_json
+
+_LONG = (STUB_REPLY + "\n") * 12 + "Some trailing chatter that runs on.\nUser: and another turn"
+_ADVERSARIAL = "\n".join(
+    ["Response: x", "Assistant: y", "  ", "• same line", "• same line", "Date Posted: 2020", "ok"] * 40
+) + "\n### Instruction: stop here"
+# Same idea for streaming, minus the stop markers (which would end the stream early).
+_ADVERSARIAL_STREAM = "\n".join(
+    ["  Response: x", " Assistant: y", "  ", "• same line", "• same line", "Date Posted: 2020", "x" * 200] * 40
+)
+_DERAILED = "Submitted by: someone\nC:\\Users\\file.txt\nRe: [thread] Instruction: ignore"
+
+
+class _NoChatTemplate:
+    # Tokenizers without a chat template (e.g. opt-350m) take _format_prompt's fallback.
+    def apply_chat_template(self, *args, **kwargs):
+        raise ValueError("no chat template")
+
+
+def _stream_clean(text: str, pieces: list) -> str:
+    c = _StreamCleaner()
+    out = [c.feed(p) for p in pieces]
+    out.append(c.finish())
+    return "".join(out)
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmarks for the per-request hot path (post-processing, prompt formatting, parsing)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=7)
+        parser.add_argument("--tokenizer", default="", help="HF tokenizer path/name for _format_prompt.")
+        parser.add_argument("--json", dest="json_out", default="")
+        parser.add_argument("--compare", default="", help="Baseline JSON; fail on regressions.")
+        parser.add_argument("--tolerance", type=float, default=0.15)
+
+    def _cases(self, opts) -> dict:
+        from django.test import RequestFactory
+        from rest_framework.parsers import JSONParser
+        from rest_framework.request import Request
+
+        backend = ChatBackend.__new__(ChatBackend)
+        if opts["tokenizer"]:
+            from transformers import AutoTokenizer
+            backend._hf_tokenizer = AutoTokenizer.from_pretrained(opts["tokenizer"])
+        else:
+            backend._hf_tokenizer = _NoChatTemplate()
+
+        factory = RequestFactory()
+        body = json.dumps({"prompt": "I'm hungry — what should I eat tonight?"})
+        long_pieces = tokenize(_LONG)
+        adversarial_pieces = list(_ADVERSARIAL_STREAM)  # one character per chunk
+        config = {"provider": "openai", "model": "m", "system_prompt": "s", "max_new_tokens": 140, "sampling": {}}
+
+        def drf_parse():
+            req = Request(factory.post("/chatbot1/chat/", body, content_type="application/json"),
+                          parsers=[JSONParser()])
+            return req.data.get("prompt")
+
+        def async_parse():
+            return _read_json(factory.post("/chatbot1/chat/", body, content_type="application/json"))
+
+        return {
+            "clean_typical": lambda: _clean(STUB_REPLY),
+            "clean_long": lambda: _clean(_LONG),
+            "clean_adversarial": lambda: _clean(_ADVERSARIAL),
+            "stream_clean_long": lambda: _stream_clean(_LONG, long_pieces),
+            "stream_clean_adversarial": lambda: _stream_clean(_ADVERSARIAL_STREAM, adversarial_pieces),
+            "looks_derailed_ok": lambda: _looks_derailed(STUB_REPLY),
+            "looks_derailed_bad": lambda: _looks_derailed(_DERAILED),
+            "looks_derailed_long": lambda: _looks_derailed(_LONG),
+            "is_meal_prompt": lambda: _is_meal_prompt("Any ideas for something tasty tonight?"),
+            "format_prompt": lambda: backend._format_prompt("I'm hungry"),
+            "parse_request_drf": drf_parse,
+            "parse_request_async": async_parse,
+            "cache_key": lambda: cache_key("I'm hungry", config),
+        }
+
+    def handle(self, *args, **opts):
+        results = {}
+        for name, fn in self._cases(opts).items():
+            timer = timeit.Timer(fn)
+            number, _ = timer.autorange()
+            runs = [t / number * 1e6 for t in timer.repeat(repeat=opts["repeat"], number=number)]
+            results[name] = {
+                "mean_us": round(statistics.mean(runs), 3),
+                "best_us": round(min(runs), 3),
+                "ops_per_s": round(1e6 / statistics.median(runs)),
+            }
+            self.stdout.write(f"{name:<26} {results[name]['mean_us']:>10.3f} us   {results[name]['ops_per_s']:>10} ops/s")
+
+        payload = {"meta": run_meta(), "results": results}
+        if opts["json_out"]:
+            write_json(opts["json_out"], payload)
+            self.stdout.write(f"Wrote {opts['json_out']}")
+        if opts["compare"]:
+            self._check(read_json(opts["compare"]), payload, opts["tolerance"])
+
+    def _check(self, baseline, payload, tolerance: float) -> None:
+        regressions = compare(baseline.get("results", {}), payload["results"], tolerance)
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS(f"No regressions beyond {tolerance:.0%}."))
+            return
+        for key, old, new, change in regressions:
+            self.stdout.write(self.style.ERROR(f"REGRESSION {key}: {old:g} -> {new:g} ({change:+.1%})"))
+        raise CommandError(f"{len(regressions)} regression(s) beyond {tolerance:.0%}")
@@ -0,0 +1,86 @@
+# chatbot1/management/commands/bench_replay.py
+
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from chatbot1 import replay
+from chatbot1.stubserver import STUB_REPLY
+
+from ._bench import pct, run_meta, write_json
+
+
+def _lookups(fn, prompts) -> dict:
+    samples = []
+    for p in prompts:
+        t0 = time.perf_counter()
+        fn(p)
+        samples.append((time.perf_counter() - t0) * 1e6)
+    return {"lookup_us_p50": round(pct(samples, 50), 2), "lookup_us_p99": round(pct(samples, 99), 2)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay corpus scaling: time to open a corpus of N entries and serve the first reply, and "
+        "per-lookup cost, vs loading the same recordings from a JSONL dump into a dict."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entries", type=int, default=1_000_000)
+        parser.add_argument("--lookups", type=int, default=20000)
+        parser.add_argument("--path", default="", help="Existing synthetic corpus to reuse (built if missing).")
+        parser.add_argument("--skip-jsonl", action="store_true", help="Skip the load-everything baseline.")
+        parser.add_argument("--json", dest="json_out", default="")
+
+    def handle(self, *args, **opts):
+        n = opts["entries"]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = opts["path"] or os.path.join(tmp, "corpus.sqlite3")
+            if not os.path.exists(path):
+                t0 = time.perf_counter()
+                call_command("replay_corpus", path=path, synthetic=n, stdout=io.StringIO())
+                self.stdout.write(f"built {n} entries in {time.perf_counter() - t0:.1f}s")
+            rng = random.Random(0)
+            prompts = [f"synthetic prompt {rng.randrange(n)}" for _ in range(opts["lookups"])]
+            unknown = [f"unseen prompt {i}" for i in range(opts["lookups"])]
+
+            results = {}
+            t0 = time.perf_counter()
+            st = replay.ReplayStore(path, readonly=True)
+            cid, fp, _ = st.resolve()
+            first = st.get(cid, fp, prompts[0])
+            results["corpus"] = {"open_to_first_reply_ms": round((time.perf_counter() - t0) * 1000, 2),
+                                 "bytes_per_entry": round(os.path.getsize(path) / n, 1)}
+            assert first is not None and first.exact
+            results["corpus"].update(_lookups(lambda p: st.get(cid, fp, p), prompts))
+            results["corpus_miss_any"] = _lookups(lambda p: st.get(cid, fp, p), unknown)
+
+            if not opts["skip_jsonl"]:
+                # Baseline: a dump read fully into memory before the first reply can be served.
+                dump = os.path.join(tmp, "corpus.jsonl")
+                with open(dump, "w") as fh:
+                    for i in range(n):
+                        fh.write(json.dumps({"prompt": f"synthetic prompt {i}", "reply": f"#{i} {STUB_REPLY}",
+                                             "ttft_ms": 300.0, "total_ms": 1000.0}) + "\n")
+                t0 = time.perf_counter()
+                table = {}
+                with open(dump) as fh:
+                    for line in fh:
+                        row = json.loads(line)
+                        table[row["prompt"]] = row
+                table[prompts[0]]
+                results["jsonl_dict"] = {"open_to_first_reply_ms": round((time.perf_counter() - t0) * 1000, 2),
+                                         "bytes_per_entry": round(os.path.getsize(dump) / n, 1)}
+                results["jsonl_dict"].update(_lookups(table.get, prompts))
+
+        for name, r in results.items():
+            self.stdout.write(f"{name:<16} " + "  ".join(f"{k} {v}" for k, v in r.items()))
+        if opts["json_out"]:
+            write_json(opts["json_out"], {"meta": run_meta(), "entries": n, "results": results})
+            self.stdout.write(f"Wrote {opts['json_out']}")
@@ -0,0 +1,74 @@
+# chatbot1/management/commands/bench_semcache.py
+
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot1.semcache import SemanticCache
+
+from ._bench import pct, write_json
+
+_WORDS = (
+    "hungry dinner lunch breakfast snack vegan vegetarian keto spicy sweet quick cheap healthy "
+    "pasta rice beans eggs chicken tofu salad soup curry tacos pizza oats yogurt berries avocado "
+    "protein craving budget late night after gym kids family tonight tomorrow weekend easy"
+).split()
+
+
+def _prompt(rng: random.Random) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 9)))
+
+
+class Command(BaseCommand):
+    help = "Measure semantic-cache lookup latency at given cache sizes (fully offline)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--dim", type=int, default=256)
+        parser.add_argument("--threshold", type=float, default=0.9)
+        parser.add_argument("--json", dest="json_out", default="", help="Write results to this file.")
+
+    def handle(self, *args, **opts):
+        rng = random.Random(7)
+        results = []
+        for size in opts["sizes"]:
+            cache = SemanticCache(capacity=size, threshold=opts["threshold"], ttl=3600, dim=opts["dim"])
+            started = time.perf_counter()
+            for _ in range(size):
+                cache.insert(_prompt(rng), 1, "reply")
+            fill_s = time.perf_counter() - started
+
+            embed_us, lookup_us = [], []
+            for _ in range(opts["queries"]):
+                q = _prompt(rng)
+                t0 = time.perf_counter()
+                cache.vectorizer.embed(q)
+                t1 = time.perf_counter()
+                cache.lookup(q, 1)
+                t2 = time.perf_counter()
+                embed_us.append((t1 - t0) * 1e6)
+                lookup_us.append((t2 - t1) * 1e6)
+
+            row = {
+                "entries": size,
+                "dim": opts["dim"],
+                "matrix_mb": round(cache._vecs.nbytes / 2**20, 1),
+                "insert_us_avg": round(fill_s / size * 1e6, 1),
+                "embed_us_p50": round(pct(embed_us, 50), 1),
+                "lookup_us_p50": round(pct(lookup_us, 50), 1),
+                "lookup_us_p95": round(pct(lookup_us, 95), 1),
+                "lookup_us_p99": round(pct(lookup_us, 99), 1),
+                "hit_ratio": round(cache.stats()["semantic_hits"] / opts["queries"], 3),
+            }
+            results.append(row)
+            self.stdout.write(
+                f"{size:>8} entries  matrix {row['matrix_mb']:>6} MB  "
+                f"lookup p50 {row['lookup_us_p50']:>8} us  p95 {row['lookup_us_p95']:>8} us  "
+                f"p99 {row['lookup_us_p99']:>8} us  (embed {row['embed_us_p50']} us)"
+            )
+
+        if opts["json_out"]:
+            write_json(opts["json_out"], results)
+            self.stdout.write(f"Wrote {opts['json_out']}")
@@ -0,0 +1,98 @@
+# chatbot1/management/commands/bench_sessions.py
+
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot1 import sessions
+from chatbot1.stubserver import StubServer
+
+from ._bench import latency_summary, run_meta, write_json
+
+_TURNS = [
+    "I'm hungry, what should I eat?",
+    "I'm vegetarian and I only have eggs, spinach and some rice.",
+    "Something quicker, I have about ten minutes.",
+    "No microwave though, just a pan.",
+    "What could I add if I went to the shop on the way home?",
+    "And for tomorrow's lunch at work?",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Multi-turn sessions: per-turn latency and prompt size at the end of 1-, 10- and 50-turn conversations, "
+        "with the context bounded (CHAT_SESSION_MAX_TOKENS) vs resending the whole history, against a local stub "
+        "whose time to first token grows with the prompt."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--turns", default="1,10,50", help="Comma-separated conversation lengths.")
+        parser.add_argument("--conversations", type=int, default=3, help="Conversations per length and mode.")
+        parser.add_argument("--max-tokens", type=int, default=settings.CHAT_SESSION_MAX_TOKENS or 600,
+                            help="Context budget of the bounded run.")
+        parser.add_argument("--latency-ms", type=float, default=20.0, help="Stub time to first token, empty prompt.")
+        parser.add_argument("--prefill-tokens-per-s", type=float, default=5000.0,
+                            help="Stub prompt processing rate (the part of TTFT that grows with the context).")
+        parser.add_argument("--json", dest="json_out", default="")
+
+    def _conversation(self, bot, store, stub, turns: int, budget: int) -> dict:
+        took, overhead, sid = [], [], sessions.NEW
+        for i in range(turns):
+            prompt = _TURNS[i % len(_TURNS)]
+            t0 = time.perf_counter()
+            session = store.open(sid)
+            t1 = time.perf_counter()
+            reply = bot.generate(session.turn(prompt), use_cache=False)
+            t2 = time.perf_counter()
+            session.add(prompt, reply, budget=budget)
+            store.save(session)
+            t3 = time.perf_counter()
+            sid = session.id
+            took.append(t3 - t0)
+            overhead.append((t1 - t0) + (t3 - t2))
+        return {"took": took, "overhead": overhead, "last_prompt_tokens": stub.last_prompt_tokens,
+                "context_tokens": session.tokens}
+
+    def handle(self, *args, **opts):
+        from chatbot1.models import ChatBackend, MyChatbot1
+
+        lengths = [int(n) for n in opts["turns"].split(",") if n.strip()]
+        if not lengths or min(lengths) < 1:
+            raise CommandError("--turns must list conversation lengths >= 1")
+        store = sessions.store()
+        modes = [("bounded", opts["max_tokens"]), ("unbounded", 0)]
+        results = []
+        with StubServer(latency=opts["latency_ms"] / 1000,
+                        prefill_tokens_per_s=opts["prefill_tokens_per_s"]) as stub:
+            os.environ["OPENAI_BASE_URL"] = stub.url + "/v1"
+            os.environ["OPENAI_API_KEY"] = "stub"
+            bot = MyChatbot1(ChatBackend(provider="openai", model_name="stub"))
+            for name, budget in modes:
+                for n in lengths:
+                    runs = [self._conversation(bot, store, stub, n, budget) for _ in range(opts["conversations"])]
+                    row = {
+                        "name": f"{name}-{n}",
+                        "mode": name,
+                        "turns": n,
+                        **latency_summary([r["took"][-1] for r in runs], "last_turn_ms"),
+                        **latency_summary([t for r in runs for t in r["took"]], "turn_ms"),
+                        **latency_summary([t for r in runs for t in r["overhead"]], "session_overhead_ms"),
+                        "last_prompt_tokens": max(r["last_prompt_tokens"] for r in runs),
+                        "context_tokens_est": max(r["context_tokens"] for r in runs),
+                    }
+                    results.append(row)
+                    self.stdout.write(
+                        f"{name:<9} {n:>3} turns: last turn p50 {row['last_turn_ms_p50']:>7.1f} ms, "
+                        f"all turns p95 {row['turn_ms_p95']:>7.1f} ms, prompt at last turn "
+                        f"{row['last_prompt_tokens']:>5} tokens, session load+save p50 "
+                        f"{row['session_overhead_ms_p50']:.3f} ms"
+                    )
+
+        if opts["json_out"]:
+            params = {k: opts[k] for k in ("conversations", "max_tokens", "latency_ms", "prefill_tokens_per_s")}
+            write_json(opts["json_out"], {"meta": run_meta(), "params": params,
+                                          "store": store.stats()["store"], "results": results})
+            self.stdout.write(f"Wrote {opts['json_out']}")
@@ -0,0 +1,103 @@
+# chatbot1/management/commands/bench_telemetry.py
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from chatbot1 import transport
+from chatbot1.stubserver import StubServer
+from chatbot1.telemetry import TelemetryShipper
+
+from ._bench import pct, write_json
+
+
+class Command(BaseCommand):
+    help = (
+        "Custos beat delivery against a local stand-in backend: caller-side cost and delivery of "
+        "the batched shipper vs the custos client's thread-per-POST."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=2000)
+        parser.add_argument("--producers", type=int, default=8, help="Concurrent request threads emitting beats.")
+        parser.add_argument("--backend-latency-ms", type=float, default=50.0, help="Stand-in backend response time.")
+        parser.add_argument("--capacity", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--interval", type=float, default=0.2)
+        parser.add_argument("--json", dest="json_out", default="")
+
+    def _produce(self, emit, n: int, producers: int) -> list:
+        def work(k):
+            samples = []
+            for i in range(k, n, producers):
+                t0 = time.perf_counter()
+                emit({"kind": "response", "prompt": f"p{i}", "response": "r", "confidence": 1.0})
+                samples.append(time.perf_counter() - t0)
+            return samples
+
+        with ThreadPoolExecutor(max_workers=producers) as pool:
+            return [s for part in pool.map(work, range(producers)) for s in part]
+
+    def _summary(self, samples, wall: float, delivered: int, threads_peak: int) -> dict:
+        us = [s * 1e6 for s in samples]
+        return {
+            "submit_us_p50": round(pct(us, 50), 2),
+            "submit_us_p99": round(pct(us, 99), 2),
+            "delivered": delivered,
+            "wall_s": round(wall, 3),
+            "threads_peak": threads_peak,
+        }
+
+    def handle(self, *args, **opts):
+        n, producers = opts["events"], opts["producers"]
+        results = {}
+        with StubServer(latency=opts["backend_latency_ms"] / 1000) as stub:
+            url = stub.url + "/simulator/logs/"
+            headers = {"Authorization": "ApiKey stub", "Content-Type": "application/json"}
+
+            # Baseline: what custos.client.AutoLoggingGuardian._post_async does per beat.
+            peak = [threading.active_count()]
+            finished = threading.Semaphore(0)
+
+            def thread_per_post(payload):
+                def send():
+                    try:
+                        transport.session().post(url, data=json.dumps(payload), headers=headers, timeout=8)
+                    except Exception:
+                        pass
+                    finished.release()
+                threading.Thread(target=send, daemon=True).start()
+                peak[0] = max(peak[0], threading.active_count())
+
+            t0 = time.perf_counter()
+            samples = self._produce(thread_per_post, n, producers)
+            for _ in range(n):
+                finished.acquire(timeout=30)
+            wall = time.perf_counter() - t0
+            results["thread_per_post"] = self._summary(samples, wall, stub.beats, peak[0])
+
+            stub.beats = 0
+            shipper = TelemetryShipper(url, "stub", capacity=opts["capacity"],
+                                       batch_size=opts["batch_size"], interval=opts["interval"])
+            t0 = time.perf_counter()
+            samples = self._produce(shipper.submit, n, producers)
+            peak = threading.active_count()
+            shipper.flush(timeout=120)
+            wall = time.perf_counter() - t0
+            shipper.close()
+            results["shipper"] = self._summary(samples, wall, stub.beats, peak)
+            results["shipper"].update({k: v for k, v in shipper.stats().items()
+                                       if k in ("dropped", "failed", "batches", "flush_ms_avg", "flush_ms_max")})
+
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<16} submit p50 {r['submit_us_p50']:>8.1f} us  p99 {r['submit_us_p99']:>8.1f} us  "
+                f"delivered {r['delivered']}/{n}  threads {r['threads_peak']}  wall {r['wall_s']:.2f}s"
+                + (f"  dropped {r['dropped']}  flush avg {r['flush_ms_avg']} ms" if "dropped" in r else "")
+            )
+        if opts["json_out"]:
+            write_json(opts["json_out"], {"events": n, "producers": producers, "results": results})
+            self.stdout.write(f"Wrote {opts['json_out']}")
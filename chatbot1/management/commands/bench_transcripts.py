@@ -0,0 +1,106 @@
+# chatbot1/management/commands/bench_transcripts.py
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from chatbot1.models import Transcript
+from chatbot1.stubserver import STUB_REPLY
+from chatbot1.transcripts import TranscriptWriter
+
+from ._bench import pct, run_meta, write_json
+
+_SOURCE = "bench"  # rows written here are deleted again at the end
+
+
+def _row(i: int) -> dict:
+    return {
+        "created_at": timezone.now(),
+        "source": _SOURCE,
+        "prompt": f"What should I eat tonight? #{i}",
+        "response": STUB_REPLY,
+        "provider": "openai",
+        "model": "stub",
+        "latency_ms": 123.4,
+        "fallback_used": False,
+        "prompt_tokens": 40,
+        "completion_tokens": 38,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Transcript writes against the configured database: one INSERT per reply on the request "
+        "thread vs the buffered bulk_create writer (caller cost and rows/s)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=20000)
+        parser.add_argument("--producers", type=int, default=8, help="Concurrent request threads.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--inline-rows", type=int, default=2000, help="Rows for the per-INSERT baseline.")
+        parser.add_argument("--json", dest="json_out", default="")
+
+    def _produce(self, emit, n: int, producers: int) -> list:
+        def work(k):
+            samples = []
+            for i in range(k, n, producers):
+                row = _row(i)
+                t0 = time.perf_counter()
+                emit(row)
+                samples.append(time.perf_counter() - t0)
+            connection.close()
+            return samples
+
+        with ThreadPoolExecutor(max_workers=producers) as pool:
+            return [s for part in pool.map(work, range(producers)) for s in part]
+
+    def _summary(self, samples, rows: int, wall: float) -> dict:
+        us = [s * 1e6 for s in samples]
+        return {
+            "rows": rows,
+            "submit_us_p50": round(pct(us, 50), 2),
+            "submit_us_p99": round(pct(us, 99), 2),
+            "wall_s": round(wall, 3),
+            "rows_per_s": round(rows / wall, 1) if wall else 0.0,
+        }
+
+    def handle(self, *args, **opts):
+        if Transcript._meta.db_table not in connection.introspection.table_names():
+            raise CommandError("Transcript table missing; run `python manage.py migrate` first.")
+        producers = opts["producers"]
+        results = {}
+        try:
+            # Baseline: Transcript.objects.create() on the request thread.
+            n = opts["inline_rows"]
+            t0 = time.perf_counter()
+            samples = self._produce(lambda row: Transcript.objects.create(**row), n, producers)
+            results["inline_insert"] = self._summary(samples, n, time.perf_counter() - t0)
+
+            n = opts["rows"]
+            writer = TranscriptWriter(capacity=n, batch_size=opts["batch_size"], interval=0.2)
+            t0 = time.perf_counter()
+            samples = self._produce(writer.submit, n, producers)
+            writer.flush(timeout=300)
+            wall = time.perf_counter() - t0
+            writer.close()
+            results["bulk_writer"] = self._summary(samples, n, wall)
+            results["bulk_writer"].update({k: v for k, v in writer.stats().items()
+                                           if k in ("written", "dropped", "failed", "batches", "write_ms_avg")})
+        finally:
+            Transcript.objects.filter(source=_SOURCE).delete()
+
+        self.stdout.write(f"database: {connection.vendor}")
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<14} rows {r['rows']:>6}  submit p50 {r['submit_us_p50']:>8.1f} us  "
+                f"p99 {r['submit_us_p99']:>8.1f} us  {r['rows_per_s']:>9.1f} rows/s"
+                + (f"  batches {r['batches']}  write avg {r['write_ms_avg']} ms  failed {r['failed']}"
+                   if "batches" in r else "")
+            )
+        if opts["json_out"]:
+            write_json(opts["json_out"], {"meta": run_meta(), "database": connection.vendor, "results": results})
+            self.stdout.write(f"Wrote {opts['json_out']}")
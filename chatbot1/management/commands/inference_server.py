@@ -0,0 +1,37 @@
+# chatbot1/management/commands/inference_server.py
+
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot1 import inference
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the HF model(s) once for this host and serve generation to the web workers over a Unix socket "
+        "(set HF_SERVER to the same path in their environment)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", default=inference.HF_SERVER or "/tmp/chatbot1-hf.sock",
+                            help="Socket path (default: HF_SERVER).")
+
+    def handle(self, *args, **opts):
+        path = opts["socket"]
+        try:
+            server = inference.make_server(path)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        # serve_forever() returns once shutdown() runs, which must be called from another thread.
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+        self.stdout.write(f"Serving {', '.join(sorted(server.pool.allowed))} on {path} "
+                          f"(loaded: {server.pool.default})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        self.stdout.write("Inference server stopped")
@@ -0,0 +1,56 @@
+# chatbot1/management/commands/prune_transcripts.py
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from chatbot1.models import Transcript
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete transcripts older than the retention window (CHAT_TRANSCRIPT_RETENTION_DAYS), "
+        "oldest first, one day at a time in bounded chunks so each transaction stays small."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.CHAT_TRANSCRIPT_RETENTION_DAYS,
+                            help="Keep this many days (default: CHAT_TRANSCRIPT_RETENTION_DAYS).")
+        parser.add_argument("--chunk", type=int, default=5000, help="Rows per DELETE.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted.")
+        parser.add_argument("--vacuum", action="store_true", help="Reclaim space afterwards (VACUUM).")
+
+    def handle(self, *args, **opts):
+        cutoff = timezone.now() - timedelta(days=opts["days"])
+        old = Transcript.objects.filter(created_at__lt=cutoff)
+        oldest = old.order_by("created_at").values_list("created_at", flat=True).first()
+        if oldest is None:
+            self.stdout.write(f"Nothing older than {cutoff:%Y-%m-%d %H:%M}.")
+            return
+        if opts["dry_run"]:
+            self.stdout.write(f"Would delete {old.count()} transcripts from {oldest:%Y-%m-%d} to {cutoff:%Y-%m-%d %H:%M}.")
+            return
+
+        # Walk day-sized created_at ranges (index range scans), deleting by primary key in chunks.
+        deleted, day = 0, oldest
+        while day < cutoff:
+            end = min(day + timedelta(days=1), cutoff)
+            window = Transcript.objects.filter(created_at__gte=day, created_at__lt=end)
+            while True:
+                ids = list(window.values_list("id", flat=True)[:opts["chunk"]])
+                if not ids:
+                    break
+                deleted += Transcript.objects.filter(id__in=ids).delete()[0]
+            day = end
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} transcripts older than {cutoff:%Y-%m-%d %H:%M}."))
+
+        if opts["vacuum"]:
+            with connection.cursor() as cursor:
+                if connection.vendor == "postgresql":
+                    cursor.execute(f"VACUUM ANALYZE {Transcript._meta.db_table}")
+                elif connection.vendor == "sqlite":
+                    cursor.execute("VACUUM")
+            self.stdout.write("Vacuumed.")
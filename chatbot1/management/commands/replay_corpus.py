@@ -0,0 +1,99 @@
+# chatbot1/management/commands/replay_corpus.py
+
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot1 import answer, replay
+from chatbot1.models import HF_SAMPLING, MAX_NEW_TOKENS, OLLAMA_SAMPLING, OPENAI_SAMPLING, SYSTEM_PROMPT
+from chatbot1.stubserver import STUB_REPLY, tokenize
+
+_SAMPLING = {"openai": OPENAI_SAMPLING, "ollama": OLLAMA_SAMPLING, "hf": HF_SAMPLING}
+
+
+def _config(provider: str, model: str) -> dict:
+    """Same shape as ChatBackend.config() for a recording made with the current settings."""
+    return {
+        "provider": provider,
+        "model": model,
+        "system_prompt": SYSTEM_PROMPT,
+        "max_new_tokens": MAX_NEW_TOKENS,
+        "sampling": _SAMPLING.get(provider, {}),
+        "early_stop": answer.settings(),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Inspect or build the MODEL_PROVIDER=replay corpus (REPLAY_PATH): list recorded configs, "
+        "import stored transcripts, or generate a synthetic corpus for web-tier load tests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default=replay.REPLAY_PATH)
+        parser.add_argument("--from-transcripts", action="store_true",
+                            help="Add every stored Transcript, grouped by the provider/model that answered.")
+        parser.add_argument("--synthetic", type=int, default=0, help="Add N generated entries (provider 'synthetic').")
+        parser.add_argument("--latency-ms", type=float, default=300.0, help="Recorded TTFT for synthetic entries.")
+        parser.add_argument("--tokens-per-s", type=float, default=50.0, help="Recorded decode rate for synthetic entries.")
+        parser.add_argument("--chunk", type=int, default=50000, help="Rows per transaction.")
+
+    def _import_transcripts(self, store, chunk: int) -> int:
+        from chatbot1.models import Transcript
+        rows = Transcript.objects.exclude(response="").order_by("provider", "model", "id")
+        groups = rows.values_list("provider", "model").distinct()
+        total = 0
+        for provider, model in groups:
+            if provider == "replay":
+                continue  # already a replay
+            group = rows.filter(provider=provider, model=model).values_list(
+                "prompt", "response", "latency_ms", "prompt_tokens", "completion_tokens")
+            batch = []
+            for prompt, response, latency_ms, prompt_tokens, completion_tokens in group.iterator(chunk_size=chunk):
+                # Transcripts keep the total only, so the replay shows it as time to first token.
+                batch.append((prompt, response, latency_ms, latency_ms, prompt_tokens, completion_tokens))
+                if len(batch) >= chunk:
+                    total += store.put_many(_config(provider, model), batch)
+                    batch = []
+            if batch:
+                total += store.put_many(_config(provider, model), batch)
+        return total
+
+    def _synthetic(self, store, n: int, opts) -> int:
+        pieces = tokenize(STUB_REPLY)
+        decode_ms = 1000 * (len(pieces) - 1) / opts["tokens_per_s"] if opts["tokens_per_s"] > 0 else 0.0
+        ttft = opts["latency_ms"]
+        config = _config("synthetic", "stub")
+        total = 0
+        for start in range(0, n, opts["chunk"]):
+            end = min(n, start + opts["chunk"])
+            total += store.put_many(config, (
+                (f"synthetic prompt {i}", f"#{i} {STUB_REPLY}", ttft, ttft + decode_ms, 12, len(pieces) + 1)
+                for i in range(start, end)
+            ))
+        return total
+
+    def handle(self, *args, **opts):
+        path = opts["path"]
+        if opts["from_transcripts"] or opts["synthetic"]:
+            store = replay.ReplayStore(path, readonly=False)
+            if opts["from_transcripts"]:
+                self.stdout.write(f"Imported {self._import_transcripts(store, opts['chunk'])} transcripts.")
+            if opts["synthetic"]:
+                self.stdout.write(f"Added {self._synthetic(store, opts['synthetic'], opts)} synthetic entries.")
+            store.close()
+        if not os.path.exists(path):
+            raise CommandError(f"No replay corpus at {path}")
+
+        store = replay.ReplayStore(path, readonly=True)
+        conn = store._conn()
+        counts = dict(conn.execute("SELECT config, COUNT(*) FROM entries GROUP BY config"))
+        size = os.path.getsize(path)
+        entries = sum(counts.values())
+        self.stdout.write(f"{path}: {entries} entries, {size / 2**20:.1f} MB"
+                          + (f" ({size / entries:.0f} B/entry)" if entries else ""))
+        for i, c in enumerate(store.configs()):
+            cfg = c["config"]
+            marker = "*" if i == 0 else " "  # served by default
+            self.stdout.write(f"{marker} {c['fingerprint']}  {cfg.get('provider')}:{cfg.get('model')}  "
+                              f"{counts.get(c['id'], 0)} entries")
@@ -0,0 +1,153 @@
+# chatbot1/management/commands/startup_profile.py
+
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot1.stubserver import StubServer
+
+from ._bench import run_meta, write_json
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+# Child processes start like a server would (plain interpreter, not manage.py,
+# which sets Django up before any command runs). The SDK pre-import stands in
+# for gunicorn's on_starting hook, boot() for loading the app and
+# post_worker_init.
+_PHASES = """
+import json
+from chatbot1 import startup
+pre = startup.preimport()
+_, phases = startup.boot(warm=True)
+print(json.dumps({**{"preimport." + k: v for k, v in pre.items()}, **phases}))
+"""
+_SERVE = """
+import os, sys
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+from chatbot1 import startup
+warm = startup.warmup_enabled()
+if warm:
+    startup.preimport()
+app, _ = startup.boot(warm=warm)
+
+class Quiet(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+server = make_server("127.0.0.1", 0, app, handler_class=Quiet)
+with open(sys.argv[1] + ".tmp", "w") as fh:
+    fh.write("http://127.0.0.1:%d" % server.server_address[1])
+os.replace(sys.argv[1] + ".tmp", sys.argv[1])
+server.serve_forever()
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Startup cost: import-time breakdown by package, init phases (Django, app, URLconf, and each "
+        "warm-up step), and cold start to first successful chat with and without CHAT_WARMUP."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--provider", choices=["openai", "ollama", "env"], default="openai",
+                            help="Backend for the runs: openai/ollama against a local stub, or env = as configured.")
+        parser.add_argument("--top", type=int, default=12, help="Packages to list in the import breakdown.")
+        parser.add_argument("--repeat", type=int, default=3, help="Cold starts per mode (median is reported).")
+        parser.add_argument("--json", dest="json_out", default="")
+
+    def _env(self, stub, opts, **extra) -> dict:
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "bot_testing.settings"),
+               "CHAT_TRANSCRIPTS": "0", "CUSTOS_BACKEND_URL": stub.url, **extra}
+        if opts["provider"] != "env":
+            env.update(MODEL_PROVIDER=opts["provider"], MODEL_ROUTES="", MODEL_NAME="stub",
+                       OPENAI_BASE_URL=stub.url + "/v1", OPENAI_API_KEY="stub", OPENAI_MODEL="stub",
+                       OLLAMA_BASE=stub.url)
+        return env
+
+    def _python(self, code: str, *args, importtime: bool = False) -> list:
+        return [sys.executable, *(["-X", "importtime"] if importtime else []), "-c", code, *args]
+
+    def _imports(self, env, top: int) -> dict:
+        proc = subprocess.run(self._python(_PHASES, importtime=True), env=env, capture_output=True,
+                              text=True, cwd=str(settings.BASE_DIR))
+        by_package = defaultdict(float)
+        for line in proc.stderr.splitlines():
+            m = _IMPORT_LINE.match(line)
+            if m and not m.group(3):  # top-level imports: their cumulative time covers everything beneath
+                by_package[m.group(4).split(".")[0]] += int(m.group(2)) / 1000
+        ranked = sorted(by_package.items(), key=lambda kv: -kv[1])
+        return {"total_ms": round(sum(by_package.values()), 1),
+                "packages_ms": {k: round(v, 1) for k, v in ranked[:top]}}
+
+    def _phases(self, env) -> dict:
+        proc = subprocess.run(self._python(_PHASES), env=env, capture_output=True, text=True,
+                              cwd=str(settings.BASE_DIR))
+        if proc.returncode != 0:
+            raise CommandError(f"phase run failed:\n{proc.stderr[-2000:]}")
+        phases = json.loads(proc.stdout.strip().splitlines()[-1])
+        return {k: round(v * 1000, 1) for k, v in phases.items()}
+
+    def _cold_start(self, env) -> dict:
+        with tempfile.TemporaryDirectory() as tmp:
+            url_file, log = os.path.join(tmp, "url"), open(os.path.join(tmp, "log"), "w+")
+            t0 = time.perf_counter()
+            proc = subprocess.Popen(self._python(_SERVE, url_file), env=env, cwd=str(settings.BASE_DIR),
+                                    stdout=log, stderr=log)
+            try:
+                while not os.path.exists(url_file):
+                    if proc.poll() is not None:
+                        log.seek(0)
+                        raise CommandError(f"server failed to start:\n{log.read()[-2000:]}")
+                    time.sleep(0.005)
+                ready = time.perf_counter() - t0
+                with open(url_file) as fh:
+                    url = fh.read() + "/chatbot1/chat/"
+                chats = []
+                for i in range(2):
+                    t = time.perf_counter()
+                    r = requests.post(url, json={"prompt": f"cold start {i}", "no_cache": True}, timeout=600)
+                    if r.status_code != 200:
+                        raise CommandError(f"chat failed: {r.status_code} {r.text[:300]}")
+                    chats.append(time.perf_counter() - t)
+                first = time.perf_counter() - t0 - chats[1]
+            finally:
+                proc.kill()
+                proc.wait()
+                log.close()
+        return {"ready_ms": ready * 1000, "first_chat_ms": chats[0] * 1000,
+                "spawn_to_first_reply_ms": first * 1000, "second_chat_ms": chats[1] * 1000}
+
+    def handle(self, *args, **opts):
+        with StubServer(latency=0.02, tokens_per_s=0) as stub:
+            base = self._env(stub, opts)
+            imports = self._imports(base, opts["top"])
+            phases = self._phases(base)
+            cold = {}
+            for mode, flag in (("no_warmup", "0"), ("warmup", "1")):
+                runs = [self._cold_start(self._env(stub, opts, CHAT_WARMUP=flag)) for _ in range(opts["repeat"])]
+                cold[mode] = {k: round(sorted(r[k] for r in runs)[len(runs) // 2], 1) for k in runs[0]}
+
+        self.stdout.write(f"imports (top-level, -X importtime): {imports['total_ms']:.0f} ms")
+        for name, ms in imports["packages_ms"].items():
+            self.stdout.write(f"  {name:<24} {ms:>8.1f} ms")
+        self.stdout.write("init phases:")
+        for name, ms in phases.items():
+            self.stdout.write(f"  {name:<24} {ms:>8.1f} ms")
+        self.stdout.write(f"cold start (median of {opts['repeat']}):")
+        for mode, r in cold.items():
+            self.stdout.write(f"  {mode:<10} ready {r['ready_ms']:>7.0f} ms  first chat {r['first_chat_ms']:>7.0f} ms  "
+                              f"spawn->first reply {r['spawn_to_first_reply_ms']:>7.0f} ms  "
+                              f"second chat {r['second_chat_ms']:>5.0f} ms")
+        if opts["json_out"]:
+            write_json(opts["json_out"], {"meta": run_meta(), "provider": opts["provider"], "imports": imports,
+                                          "phases_ms": phases, "cold_start": cold})
+            self.stdout.write(f"Wrote {opts['json_out']}")
@@ -0,0 +1,261 @@
+# chatbot1/metrics.py
+
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+
+# Per-request stage log, set by ServerTimingMiddleware: [(stage, seconds), ...].
+# Outside a request (management commands, streamed bodies after the headers
+# went out) it is None and stages only feed the histograms.
+_timings: ContextVar[Optional[list]] = ContextVar("chat_stage_timings", default=None)
+# Per-chat usage for the transcript store (chatbot1.transcripts.record):
+# which provider/model answered and the token counts it reported.
+_usage: ContextVar[Optional[dict]] = ContextVar("chat_usage", default=None)
+
+_LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_TPS_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 400, 800, 1600)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    return "+Inf" if v == float("inf") else repr(float(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, value in series:
+            lines.append(f"{self.name}{_fmt_labels(self.labels, key)} {_fmt_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float) -> None:
+        with self._lock:
+            self._series[labels] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = _LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                # [per-bucket counts..., +Inf count, sum]
+                s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for key, s in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s[:-1]):
+                cumulative += n
+                le = 'le="' + _fmt_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {_fmt_value(s[-1])}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram(
+    "chat_stage_seconds", "Time spent per request stage.", ("stage", "provider", "model"),
+)
+TOKENS_PER_SECOND = Histogram(
+    "chat_tokens_per_second", "Decode rate where the provider reports token usage.", ("provider", "model"),
+    buckets=_TPS_BUCKETS,
+)
+COMPLETION_TOKENS = Counter(
+    "chat_completion_tokens_total", "Completion tokens reported by the provider.", ("provider", "model"),
+)
+PROVIDER_ERRORS = Counter("chat_provider_errors_total", "Failed provider calls.", ("provider", "model"))
+FALLBACKS = Counter("chat_fallback_total", "Replies replaced by the canned meal fallback.")
+RESPONSES = Counter("chat_http_responses_total", "HTTP responses by status code.", ("code",))
+SHED = Counter("chat_shed_total", "Chats rejected by admission control.", ("provider", "reason"))
+IN_FLIGHT = Gauge("chat_requests_in_flight", "HTTP requests currently being served (streams until closed).")
+PROVIDER_IN_FLIGHT = Gauge(
+    "chat_provider_in_flight", "Provider calls currently outstanding.", ("provider", "model"),
+)
+BREAKER_STATE = Gauge("chat_breaker_state", "Upstream circuit breaker: 0 closed, 1 half-open, 2 open.", ("upstream",))
+BREAKER_TRANSITIONS = Counter(
+    "chat_breaker_transitions_total", "Circuit breaker state changes.", ("upstream", "from_state", "to_state"),
+)
+BREAKER_REJECTED = Counter("chat_breaker_rejected_total", "Calls failed fast by an open breaker.", ("upstream",))
+UPSTREAM_UP = Gauge("chat_upstream_up", "Last health probe of the upstream: 1 up, 0 down.", ("upstream",))
+BUDGET_TOKENS = Gauge("chat_budget_tokens", "Adaptive per-request token cap.", ("upstream",))
+BUDGET_GREEDY = Gauge("chat_budget_greedy", "1 while the adaptive budget has switched decoding to greedy.", ("upstream",))
+BUDGET_ADJUSTMENTS = Counter(
+    "chat_budget_adjustments_total", "Token cap changes by direction and cause.", ("upstream", "direction", "reason"),
+)
+BUDGET_P95 = Gauge("chat_budget_latency_p95_seconds", "Provider p95 the token cap was last judged on.", ("upstream",))
+EARLY_STOPS = Counter(
+    "chat_early_stop_total", "Generations stopped before the model finished, by cause.", ("provider", "model", "reason"),
+)
+HF_POOL_BYTES = Gauge("chat_hf_pool_bytes", "Weight bytes of the HF models loaded in this process.")
+HF_POOL_MODELS = Gauge("chat_hf_pool_models", "HF models loaded in this process.")
+HF_POOL_EVENTS = Counter(
+    "chat_hf_pool_events_total", "HF model pool: hit, load, coalesced (waited for a load), eviction, load_failure.",
+    ("event",),
+)
+
+
+# ----- Stage timing -----
+def observe(stage_name: str, seconds: float, provider: str = "", model: str = "") -> None:
+    STAGE_SECONDS.observe(seconds, stage_name, provider, model)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage_name, seconds))
+
+
+class stage:
+    """`with stage("clean", provider, model): ...` — a plain class; @contextmanager costs ~2x more per use."""
+    __slots__ = ("name", "provider", "model", "t0")
+
+    def __init__(self, name: str, provider: str = "", model: str = ""):
+        self.name, self.provider, self.model = name, provider, model
+
+    def __enter__(self):
+        self.t0 = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, perf_counter() - self.t0, self.provider, self.model)
+        return False
+
+
+@contextmanager
+def provider_call(provider: str, model: str):
+    """Stage "provider" plus the in-flight gauge and error counter."""
+    serving(provider, model)
+    PROVIDER_IN_FLIGHT.inc(provider, model)
+    t0 = perf_counter()
+    try:
+        yield
+    except Exception:
+        PROVIDER_ERRORS.inc(provider, model)
+        raise
+    finally:
+        PROVIDER_IN_FLIGHT.dec(provider, model)
+        observe("provider", perf_counter() - t0, provider, model)
+
+
+def tokens(provider: str, model: str, count: int, seconds: float, prompt: int = 0) -> None:
+    usage = _usage.get()
+    if usage is not None:
+        usage["completion_tokens"] = count or None
+        usage["prompt_tokens"] = prompt or None
+    if not count:
+        return
+    COMPLETION_TOKENS.inc(provider, model, amount=count)
+    if seconds > 0:
+        TOKENS_PER_SECOND.observe(count / seconds, provider, model)
+
+
+def serving(provider: str, model: str) -> None:
+    usage = _usage.get()
+    if usage is not None:
+        usage["provider"], usage["model"] = provider, model
+
+
+def begin_usage() -> tuple:
+    """Start collecting provider usage for one chat; pass the token to `end_usage`."""
+    usage = {}
+    return usage, _usage.set(usage)
+
+
+def end_usage(token) -> None:
+    _usage.reset(token)
+
+
+def note_usage(**fields) -> None:
+    """Copy usage gathered under a nested `begin_usage` into the enclosing chat's record."""
+    usage = _usage.get()
+    if usage is not None:
+        usage.update(fields)
+
+
+def begin_request() -> tuple:
+    """Start collecting stages for this request; pass the result to `end_request`."""
+    timings = []
+    return timings, _timings.set(timings)
+
+
+def end_request(token) -> None:
+    _timings.reset(token)
+
+
+def note_timings(timings: list) -> None:
+    """Copy stages gathered under a nested `begin_request` into the enclosing request's Server-Timing."""
+    current = _timings.get()
+    if current is not None:
+        current.extend(timings)
+
+
+def server_timing(timings: list, total: float) -> str:
+    """`Server-Timing` header value; repeated stages are summed, durations in ms."""
+    merged = {}
+    for name, seconds in timings:
+        merged[name] = merged.get(name, 0.0) + seconds
+    merged["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in merged.items())
+
+
+def render(extra: list = ()) -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
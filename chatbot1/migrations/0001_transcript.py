@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Transcript',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('source', models.CharField(max_length=16)),
+                ('prompt', models.TextField()),
+                ('response', models.TextField()),
+                ('provider', models.CharField(max_length=32)),
+                ('model', models.CharField(max_length=200)),
+                ('latency_ms', models.FloatField()),
+                ('fallback_used', models.BooleanField(default=False)),
+                ('prompt_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('completion_tokens', models.PositiveIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='transcript_created_idx'), models.Index(fields=['model', 'created_at'], name='transcript_model_created_idx')],
+            },
+        ),
+    ]
@@ -1,8 +1,20 @@
 # custos-chatbot/bot_testing/chatbot1/models.py
 
 
+import asyncio
+import logging
 import os
+import re
+import time
+from time import perf_counter
+from typing import AsyncIterator, Iterator
 
+from django.db import models
+
+from . import answer, budget, health, metrics
+from .env import get_bool
+
+logger = logging.getLogger(__name__)
 
 os.environ.setdefault("TRANSFORMERS_NO_TF", "1")
 os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
@@ -12,6 +24,16 @@ PROVIDER = os.getenv("MODEL_PROVIDER", "openai").lower()
 MODEL_NAME = os.getenv("MODEL_NAME", "qwen2.5:3b-instruct")  
 FALLBACK_MODEL_NAME = os.getenv("FALLBACK_MODEL_NAME", "facebook/opt-350m")
 MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "140"))
+# Upper bound on concurrent upstream connections per process on the async (ASGI) path.
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", "500"))
+# Coalesce identical in-flight prompts into one upstream call.
+SINGLEFLIGHT = get_bool("SINGLEFLIGHT", True)
+SINGLEFLIGHT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_TIMEOUT", "130"))
+# HF micro-batching: requests arriving within the window share one generate() call (max 1 = off).
+HF_BATCH_MAX = int(os.getenv("HF_BATCH_MAX", "8"))
+HF_BATCH_WINDOW_MS = float(os.getenv("HF_BATCH_WINDOW_MS", "15"))
+# HF: prefill the constant system-prompt prefix once per model and reuse its KV cache.
+HF_PREFIX_CACHE = get_bool("HF_PREFIX_CACHE", True)
 
 SYSTEM_PROMPT = os.getenv(
     "SYSTEM_PROMPT",
@@ -22,166 +44,1117 @@ SYSTEM_PROMPT = os.getenv(
     "Do not roleplay, do not include dates, names, file paths, or metadata."
 )
 
+# Decoding settings per provider (also part of the response-cache key).
+OPENAI_SAMPLING = {"temperature": 0.5, "top_p": 0.9}
+OLLAMA_SAMPLING = {
+    "temperature": 0.25,
+    "top_p": 0.85,
+    "top_k": 40,
+    "repeat_penalty": 1.25,
+    "repeat_last_n": 128,
+    "presence_penalty": 0.2,
+    "frequency_penalty": 0.2,
+}
+HF_SAMPLING = {"do_sample": True, "temperature": 0.35, "top_p": 0.85, "repetition_penalty": 1.25}
+# Greedy variants for when the adaptive budget is at the bottom of its range (chatbot1/budget.py).
+OPENAI_GREEDY = {"temperature": 0.0}
+OLLAMA_GREEDY = {**OLLAMA_SAMPLING, "temperature": 0.0}
+HF_GREEDY = {"do_sample": False, "repetition_penalty": HF_SAMPLING["repetition_penalty"]}
+_FULL_BUDGET = budget.Budget(MAX_NEW_TOKENS)
+
 STOP_SEQS = ["\nUser:", "\nAssistant:", "\n###", "\nInstruction:", "\nResponse:", "Customer:", "Associate:"]
 
+_BAD_PREFIXES = (
+    "### Instruction:", "### Response:", "Instruction:", "Response:",
+    "User:", "Assistant:", "Customer:", "Associate:",
+    "Submitted by:", "Date Posted:"
+)
+# Placeholder user turn used to find where the chat template's constant prefix ends.
+_PREFIX_SLOT = "<<USER_TURN>>"
+# Shorter prefixes (e.g. the bare "User: " fallback format) are not worth a cache.
+_PREFIX_MIN_TOKENS = 8
+# Longest tail a streamed chunk must hold back so a stop marker split across chunks is still caught.
+_STOP_HOLD = max(len(s) for s in STOP_SEQS) - 1
+
+# Post-processing runs on every reply (and every streamed chunk), so the
+# marker lists are compiled once: one leftmost-match scan finds the earliest
+# stop marker, and one anchored match tests a line against all bad prefixes.
+_STOP_RE = re.compile("|".join(map(re.escape, STOP_SEQS)))
+_BAD_PREFIX_RE = re.compile("|".join(map(re.escape, _BAD_PREFIXES)))
+# Every non-empty prefix of a bad prefix: a partial streamed line equal to one
+# of these could still grow into a dropped line.
+_BAD_PREFIX_HEADS = frozenset(p[:i] for p in _BAD_PREFIXES for i in range(1, len(p) + 1))
+# Line terminators recognised by str.splitlines.
+_LINE_ENDS = frozenset("\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029")
+
+def _stop_at(text: str, start: int = 0) -> int:
+    """Index of the earliest STOP_SEQS marker starting at or after `start`, or -1."""
+    m = _STOP_RE.search(text, start)
+    return m.start() if m else -1
+
+def _cut_stop(text: str) -> str:
+    i = _stop_at(text)
+    return text if i == -1 else text[:i]
+
+def _keep_line(ln: str, prev: str) -> bool:
+    """`ln` survives cleaning after `prev` (the last kept line, or None)."""
+    s = ln.strip()
+    return bool(s) and ln != prev and _BAD_PREFIX_RE.match(s) is None
+
+def _kept_lines(text: str, prev: str = None) -> list:
+    kept = []
+    for ln in text.splitlines():
+        if _keep_line(ln, prev):
+            kept.append(ln)
+            prev = ln
+    return kept
+
+def _cut_answer(text: str) -> str:
+    i = answer.end(text)
+    return text if i == -1 else text[:i]
+
 def _clean(text: str) -> str:
     if not text:
         return text
-    cut = len(text)
-    for s in STOP_SEQS:
-        i = text.find(s)
+    return "\n".join(_kept_lines(_cut_answer(_cut_stop(text)))).strip()
+
+class _StreamCleaner:
+    """
+    Incremental `_clean`: feed raw provider chunks, get back only text that
+    `_clean` of the full output is guaranteed to contain. The concatenation of
+    everything returned equals `_clean(full_text)`. `done` flips as soon as a
+    STOP_SEQS marker is seen or the answer is complete (chatbot1/answer.py), so
+    the caller can close the upstream stream; `stopped` says which.
+
+    Work per chunk is proportional to the chunk: completed lines are filtered
+    once and kept in `_lines`, and the stop scan resumes just before new text.
+    """
+
+    def __init__(self):
+        self._raw = ""
+        self._sent = ""
+        self._lines = []   # kept lines from raw[:_pos]
+        self._pos = 0      # start of the first line not yet in _lines
+        self._answer = answer.detector()
+        self.done = False
+        self.stopped = None  # "marker" | "answer" | "words" when cut short
+
+    @property
+    def text(self) -> str:
+        return self._sent
+
+    def feed(self, chunk: str) -> str:
+        if self.done or not chunk:
+            return ""
+        scan_from = max(0, len(self._raw) - _STOP_HOLD)
+        self._raw += chunk
+        i = _stop_at(self._raw, scan_from)
+        if i != -1:
+            self.stopped = "marker"
+        elif self._answer is not None:
+            i = self._answer.scan(self._raw)
+            self.stopped = self._answer.reason
         if i != -1:
-            cut = min(cut, i)
-    text = text[:cut]
-    bad_prefixes = (
-        "### Instruction:", "### Response:", "Instruction:", "Response:",
-        "User:", "Assistant:", "Customer:", "Associate:",
-        "Submitted by:", "Date Posted:"
-    )
-    lines = [
-        ln for ln in text.splitlines()
-        if ln.strip() and not any(ln.strip().startswith(p) for p in bad_prefixes)
+            self._raw = self._raw[:i]
+            self.done = True
+            return self._emit(_clean(self._raw) or "")
+        return self._emit(self._stable(len(self._raw) - _STOP_HOLD))
+
+    def finish(self) -> str:
+        if self.done:
+            return ""
+        self.done = True
+        return self._emit(_clean(self._raw) or "")
+
+    def _stable(self, end: int) -> str:
+        """What `_clean` is certain to keep of raw[:end] (see `_emit`)."""
+        partial = ""
+        if end > self._pos:
+            region = self._raw[self._pos:end]
+            parts = region.splitlines(keepends=True)
+            if parts[-1][-1] not in _LINE_ENDS:
+                partial = parts.pop()
+            if parts:
+                done = len(region) - len(partial)
+                prev = self._lines[-1] if self._lines else None
+                self._lines += _kept_lines(region[:done], prev)
+                self._pos += done
+        lines = self._lines
+        # Emit a partial line only once no further input can drop it
+        # (bad prefix, whitespace-only, or a repeat of the previous line).
+        head = partial.lstrip()
+        if head and head not in _BAD_PREFIX_HEADS and _BAD_PREFIX_RE.match(head) is None:
+            if not lines or not lines[-1].startswith(partial):
+                lines = lines + [partial]
+        return "\n".join(lines).strip()
+
+    def _emit(self, candidate: str) -> str:
+        if len(candidate) <= len(self._sent) or not candidate.startswith(self._sent):
+            return ""
+        delta = candidate[len(self._sent):]
+        self._sent = candidate
+        return delta
+
+def _messages(prompt: str) -> list:
+    # A turn of a conversation (sessions.Turn) brings the messages before it.
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *getattr(prompt, "history", ()),
+        {"role": "user", "content": str(prompt)},
     ]
-    dedup = []
-    for ln in lines:
-        if not dedup or dedup[-1] != ln:
-            dedup.append(ln)
-    return "\n".join(dedup).strip()
+
+class _StreamTimer:
+    """Stages for one streamed reply: ttft, provider (whole stream) and clean (summed per chunk)."""
+
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        self._t0 = perf_counter()
+        self._first = True
+        self._clean = 0.0
+        metrics.serving(provider, model)
+        metrics.PROVIDER_IN_FLIGHT.inc(provider, model)
+
+    def feed(self, cleaner: _StreamCleaner, chunk: str) -> str:
+        t = perf_counter()
+        if self._first:
+            self._first = False
+            metrics.observe("ttft", t - self._t0, self.provider, self.model)
+        delta = cleaner.feed(chunk)
+        self._clean += perf_counter() - t
+        if cleaner.stopped:  # set once, by the chunk that ends the reply
+            metrics.EARLY_STOPS.inc(self.provider, self.model, cleaner.stopped)
+        return delta
+
+    def finish(self, cleaner: _StreamCleaner) -> str:
+        t = perf_counter()
+        delta = cleaner.finish()
+        self._clean += perf_counter() - t
+        return delta
+
+    def failed(self) -> None:
+        metrics.PROVIDER_ERRORS.inc(self.provider, self.model)
+
+    def close(self) -> None:
+        metrics.PROVIDER_IN_FLIGHT.dec(self.provider, self.model)
+        metrics.observe("provider", perf_counter() - self._t0 - self._clean, self.provider, self.model)
+        metrics.observe("clean", self._clean, self.provider, self.model)
+
 
 class ChatBackend:
-    def __init__(self):
+    def __init__(self, provider: str = None, model_name: str = None):
+        self.provider = (provider or PROVIDER).lower()
         self._hf_ready = False
         self._ollama_ready = False
         self._openai_ready = False
+        self._aclients = {}
+        self._hf_batcher = None
+        self._hf_remote = None
 
-        if PROVIDER == "openai":
-            self._init_openai()
-        elif PROVIDER == "ollama":
-            self._init_ollama()
-        elif PROVIDER == "hf":
-            self._init_hf(MODEL_NAME)
+        if self.provider == "openai":
+            self._init_openai(model_name)
+        elif self.provider == "ollama":
+            self._init_ollama(model_name)
+        elif self.provider == "hf":
+            from . import inference
+            if inference.enabled():
+                self._init_hf_remote(model_name or MODEL_NAME)
+            else:
+                self._init_hf(model_name or MODEL_NAME)
+        elif self.provider == "replay":
+            self._init_replay(model_name)
         else:
-            raise ValueError(f"Unknown MODEL_PROVIDER: {PROVIDER}")
+            raise ValueError(f"Unknown MODEL_PROVIDER: {self.provider}")
+        self.model_name = self.config()["model"]
+        # Remote upstreams get a circuit breaker (chatbot1/health.py); local ones fail on their own.
+        self.breaker = health.breaker(f"{self.provider}:{self.model_name}") if self.probe_target() else None
+        self.budget = None
+        # Replay has no decode to cap; the inference server runs its own controllers.
+        if budget.enabled() and self.provider != "replay" and self._hf_remote is None:
+            self.budget = budget.controller(f"{self.provider}:{self.model_name}", MAX_NEW_TOKENS)
+
+    def _limits(self) -> budget.Budget:
+        return self.budget.current() if self.budget is not None else _FULL_BUDGET
+
+    def _openai_params(self) -> dict:
+        lim = self._limits()
+        return {"max_tokens": lim.tokens, **(OPENAI_GREEDY if lim.greedy else OPENAI_SAMPLING)}
 
     # ----- OpenAI-compatible (Groq/OpenRouter) -----
-    def _init_openai(self):
+    def _init_openai(self, name: str = None):
         from openai import OpenAI 
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY not set")
         base_url = os.getenv("OPENAI_BASE_URL")  
         self._openai = OpenAI(api_key=api_key, base_url=base_url) if base_url else OpenAI(api_key=api_key)
-        self._openai_model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        self._openai_model = name or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        self._openai_kwargs = {"api_key": api_key, "base_url": base_url} if base_url else {"api_key": api_key}
         self._openai_ready = True
 
+    def _openai_usage(self, resp, elapsed: float) -> None:
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            # Groq reports pure decode time; other OpenAI-compatible hosts only give wall time.
+            seconds = getattr(usage, "completion_time", None) or elapsed
+            metrics.tokens(self.provider, self.model_name, usage.completion_tokens or 0, seconds,
+                           prompt=getattr(usage, "prompt_tokens", 0) or 0)
+
     def _gen_openai(self, prompt: str) -> str:
         try:
+            t0 = perf_counter()
             resp = self._openai.chat.completions.create(
                 model=self._openai_model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.5,
-                top_p=0.9,
-                max_tokens=MAX_NEW_TOKENS,
+                messages=_messages(prompt),
+                **self._openai_params(),
+            )
+            self._openai_usage(resp, perf_counter() - t0)
+            return resp.choices[0].message.content or ""
+        except Exception as e:
+            raise RuntimeError(f"openai_error: {e}")
+
+    def _stream_openai(self, prompt: str) -> Iterator[str]:
+        try:
+            stream = self._openai.chat.completions.create(
+                model=self._openai_model,
+                messages=_messages(prompt),
+                **self._openai_params(),
+                stream=True,
             )
-            return _clean(resp.choices[0].message.content or "")
         except Exception as e:
             raise RuntimeError(f"openai_error: {e}")
+        try:
+            for chunk in stream:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or ""
+        except Exception as e:
+            raise RuntimeError(f"openai_error: {e}")
+        finally:
+            stream.close()
+
+    async def _agen_openai(self, prompt: str) -> str:
+        try:
+            t0 = perf_counter()
+            resp = await self._async_openai().chat.completions.create(
+                model=self._openai_model,
+                messages=_messages(prompt),
+                **self._openai_params(),
+            )
+            self._openai_usage(resp, perf_counter() - t0)
+            return resp.choices[0].message.content or ""
+        except Exception as e:
+            raise RuntimeError(f"openai_error: {e}")
+
+    async def _astream_openai(self, prompt: str) -> AsyncIterator[str]:
+        try:
+            stream = await self._async_openai().chat.completions.create(
+                model=self._openai_model,
+                messages=_messages(prompt),
+                **self._openai_params(),
+                stream=True,
+            )
+        except Exception as e:
+            raise RuntimeError(f"openai_error: {e}")
+        try:
+            async for chunk in stream:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or ""
+        except Exception as e:
+            raise RuntimeError(f"openai_error: {e}")
+        finally:
+            await stream.close()
 
     # ----- Ollama (local dev) -----
-    def _init_ollama(self):
+    def _init_ollama(self, name: str = None):
         self._ollama_base = os.getenv("OLLAMA_BASE", "http://127.0.0.1:11434")
-        self._ollama_model = os.getenv("MODEL_NAME", MODEL_NAME)
+        self._ollama_model = name or os.getenv("MODEL_NAME", MODEL_NAME)
         self._ollama_ready = True
 
-    def _gen_ollama(self, prompt: str) -> str:
-        import requests
-        url = f"{self._ollama_base}/api/chat"
-        payload = {
+    def _ollama_payload(self, prompt: str, stream: bool) -> dict:
+        lim = self._limits()
+        return {
             "model": self._ollama_model,
-            "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": prompt},
-            ],
-            "stream": False,
+            "messages": _messages(prompt),
+            "stream": stream,
             "options": {
-                "temperature": 0.25,
-                "top_p": 0.85,
-                "top_k": 40,
-                "repeat_penalty": 1.25,
-                "repeat_last_n": 128,
-                "presence_penalty": 0.2,
-                "frequency_penalty": 0.2,
-                "num_predict": MAX_NEW_TOKENS,
+                **(OLLAMA_GREEDY if lim.greedy else OLLAMA_SAMPLING),
+                "num_predict": lim.tokens,
                 "stop": ["User:", "Assistant:", "###", "Customer:", "Associate:"],
             },
         }
-        r = requests.post(url, json=payload, timeout=120)
+
+    def _gen_ollama(self, prompt: str) -> str:
+        from . import transport
+        url = f"{self._ollama_base}/api/chat"
+        r = transport.session().post(url, json=self._ollama_payload(prompt, stream=False), timeout=transport.timeout())
+        r.raise_for_status()
+        data = transport.json_body(r)
+        self._ollama_usage(data)
+        return (data.get("message", {}) or {}).get("content", "") or ""
+
+    def _ollama_usage(self, data: dict) -> None:
+        # eval_duration is decode time in nanoseconds.
+        metrics.tokens(self.provider, self.model_name, data.get("eval_count") or 0,
+                       (data.get("eval_duration") or 0) / 1e9, prompt=data.get("prompt_eval_count") or 0)
+
+    def _stream_ollama(self, prompt: str) -> Iterator[str]:
+        from . import transport
+        url = f"{self._ollama_base}/api/chat"
+        r = transport.session().post(
+            url, json=self._ollama_payload(prompt, stream=True), timeout=transport.timeout(), stream=True
+        )
+        try:
+            r.raise_for_status()
+            # Ollama streams one JSON object per line until {"done": true}.
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                data = transport.loads(line)
+                yield (data.get("message", {}) or {}).get("content", "") or ""
+                if data.get("done"):
+                    self._ollama_usage(data)
+                    break
+        finally:
+            r.close()
+
+    async def _agen_ollama(self, prompt: str) -> str:
+        url = f"{self._ollama_base}/api/chat"
+        r = await self._async_http().post(url, json=self._ollama_payload(prompt, stream=False))
         r.raise_for_status()
         data = r.json()
-        text = (data.get("message", {}) or {}).get("content", "") or ""
-        return _clean(text)
+        self._ollama_usage(data)
+        return (data.get("message", {}) or {}).get("content", "") or ""
+
+    async def _astream_ollama(self, prompt: str) -> AsyncIterator[str]:
+        import json
+        url = f"{self._ollama_base}/api/chat"
+        async with self._async_http().stream("POST", url, json=self._ollama_payload(prompt, stream=True)) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                yield (data.get("message", {}) or {}).get("content", "") or ""
+                if data.get("done"):
+                    self._ollama_usage(data)
+                    break
 
     # ----- HF (local dev) -----
     def _init_hf(self, name: str):
-        from transformers import AutoModelForCausalLM, AutoTokenizer
+        import threading
+        from transformers import AutoModelForCausalLM
         import torch
+        from . import hf_cpu, hfpool
         self._hf_device = "cuda" if torch.cuda.is_available() else "cpu"
-        self._hf_tokenizer = AutoTokenizer.from_pretrained(name)
-        if self._hf_tokenizer.pad_token is None:
-            self._hf_tokenizer.pad_token = self._hf_tokenizer.eos_token
-        dtype = torch.float16 if self._hf_device == "cuda" else torch.float32
-        self._hf_model = AutoModelForCausalLM.from_pretrained(name, torch_dtype=dtype).to(self._hf_device)
+        self._hf_model_name = name
+        self._hf_tokenizer = hfpool.tokenizer(name)
+        if self._hf_device == "cuda":
+            self._hf_model = AutoModelForCausalLM.from_pretrained(name, torch_dtype=torch.float16).to("cuda")
+        else:
+            hf_cpu.configure_threads()
+            model = AutoModelForCausalLM.from_pretrained(name, torch_dtype=hf_cpu.load_dtype())
+            self._hf_model = hf_cpu.optimize(model)
+            logger.info("HF %s on CPU: %s", name, hf_cpu.describe(self._hf_model))
+        if HF_BATCH_MAX > 1:
+            from .batching import MicroBatcher
+            self._hf_batcher = MicroBatcher(self._gen_hf_batch, window=HF_BATCH_WINDOW_MS / 1000, max_batch=HF_BATCH_MAX)
+        self._hf_prefix = None  # ((model, system prompt), ids, past_key_values)
+        self._hf_prefix_lock = threading.Lock()
         self._hf_ready = True
+        if hf_cpu.HF_WARMUP:
+            # First calls pay for allocator growth, kernel selection and torch.compile; do it before traffic.
+            with metrics.stage("warmup", self.provider, name):
+                inputs = self._hf_tokenizer([self._format_prompt("Hi")], return_tensors="pt").to(self._hf_device)
+                self._hf_generate(**inputs, **self._hf_prefill(inputs), **{**self._hf_gen_kwargs(), "max_new_tokens": 8})
 
     def _format_prompt(self, prompt: str) -> str:
         tok = self._hf_tokenizer
         try:
             return tok.apply_chat_template(
-                [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt},
-                ],
+                _messages(prompt),
                 tokenize=False,
                 add_generation_prompt=True,
             )
         except Exception:
-            return f"User: {prompt}\nAssistant:"
+            turns = "".join(f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}\n"
+                            for m in getattr(prompt, "history", ()))
+            return f"{turns}User: {prompt}\nAssistant:"
+
+    def _hf_gen_kwargs(self) -> dict:
+        tok = self._hf_tokenizer
+        lim = self._limits()
+        return dict(
+            max_new_tokens=lim.tokens,
+            **(HF_GREEDY if lim.greedy else HF_SAMPLING),
+            eos_token_id=tok.eos_token_id,
+            pad_token_id=tok.eos_token_id,
+        )
+
+    def _hf_answer_stop(self, prompt_len: int):
+        """generate() kwargs that end each row once its answer is complete (chatbot1/answer.py); {} when off."""
+        if not answer.EARLY_STOP:
+            return {}
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList
+
+        tok = self._hf_tokenizer
+        provider, model = self.provider, self.model_name
+
+        class _AnswerComplete(StoppingCriteria):
+            def __init__(self):
+                self.detectors = None
+
+            def __call__(self, input_ids, scores, **kwargs):
+                if self.detectors is None:
+                    self.detectors = [answer.Detector() for _ in range(input_ids.shape[0])]
+                done = []
+                for row, det in zip(input_ids, self.detectors):
+                    if det.end == -1 and det.scan(tok.decode(row[prompt_len:], skip_special_tokens=True)) != -1:
+                        metrics.EARLY_STOPS.inc(provider, model, det.reason)
+                    done.append(det.end != -1)
+                return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+        return {"stopping_criteria": StoppingCriteriaList([_AnswerComplete()])}
+
+    def _hf_generate(self, **kwargs):
+        import torch
+        with torch.inference_mode():
+            return self._hf_model.generate(**kwargs)
+
+    def _build_hf_prefix(self) -> tuple:
+        import torch
+        text = self._format_prompt(_PREFIX_SLOT)
+        cut = text.find(_PREFIX_SLOT)
+        if cut < 0:
+            return None, None
+        # Drop the last prefix token: BPE may merge it with the start of the user text.
+        ids = self._hf_tokenizer(text[:cut], return_tensors="pt")["input_ids"][:, :-1]
+        if ids.shape[1] < _PREFIX_MIN_TOKENS:
+            return None, None
+        with torch.inference_mode():
+            out = self._hf_model(input_ids=ids.to(self._hf_model.device), use_cache=True)
+        return ids[0].tolist(), out.past_key_values
+
+    def _hf_prefix_cache(self):
+        """(ids, past_key_values) of the chat-template text before the user turn, or None."""
+        key = (self._hf_model_name, SYSTEM_PROMPT)
+        entry = self._hf_prefix
+        if entry is None or entry[0] != key:
+            with self._hf_prefix_lock:
+                entry = self._hf_prefix
+                if entry is None or entry[0] != key:
+                    entry = self._hf_prefix = (key, *self._build_hf_prefix())
+        return entry[1:] if entry[1] else None
+
+    def _hf_prefill(self, inputs) -> dict:
+        """generate() kwargs resuming from the cached system prefix when `inputs` (one row) starts with it."""
+        if not HF_PREFIX_CACHE:
+            return {}
+        prefix = self._hf_prefix_cache()
+        if prefix is None:
+            return {}
+        ids, cache = prefix
+        if inputs["input_ids"][0, :len(ids)].tolist() != ids:
+            return {}
+        import copy
+        # generate() appends to the cache in place; each call extends its own copy.
+        return {"past_key_values": copy.deepcopy(cache)}
 
     def _gen_hf(self, prompt: str) -> str:
-        from transformers import AutoTokenizer  
         tok = self._hf_tokenizer
         model = self._hf_model
         text = self._format_prompt(prompt)
         inputs = tok([text], return_tensors="pt").to(model.device)
-        output_ids = model.generate(
-            **inputs,
-            max_new_tokens=MAX_NEW_TOKENS,
-            do_sample=True,
-            temperature=0.35,
-            top_p=0.85,
-            repetition_penalty=1.25,
-            eos_token_id=tok.eos_token_id,
-            pad_token_id=tok.eos_token_id,
-        )
+        t0 = perf_counter()
+        output_ids = self._hf_generate(**inputs, **self._hf_prefill(inputs), **self._hf_gen_kwargs(),
+                                       **self._hf_answer_stop(inputs["input_ids"].shape[1]))
         gen_ids = output_ids[0][inputs["input_ids"].shape[1]:]
-        out = tok.decode(gen_ids, skip_special_tokens=True)
-        return _clean(out)
+        metrics.tokens(self.provider, self.model_name, int(gen_ids.shape[0]), perf_counter() - t0,
+                       prompt=int(inputs["input_ids"].shape[1]))
+        return tok.decode(gen_ids, skip_special_tokens=True)
+
+    def _gen_hf_batch(self, prompts: list, contexts: list = None) -> list:
+        """
+        One left-padded generate() over several prompts; returns raw texts in order.
+        `contexts` (the callers', from MicroBatcher) get each row's token usage.
+        """
+        if len(prompts) == 1:
+            # Lone request: the unpadded path can reuse the system-prefix cache.
+            return [contexts[0].run(self._gen_hf, prompts[0]) if contexts else self._gen_hf(prompts[0])]
+        tok = self._hf_tokenizer
+        model = self._hf_model
+        texts = [self._format_prompt(p) for p in prompts]
+        inputs = tok(texts, return_tensors="pt", padding=True).to(model.device)
+        t0 = perf_counter()
+        output_ids = self._hf_generate(**inputs, **self._hf_gen_kwargs(),
+                                       **self._hf_answer_stop(inputs["input_ids"].shape[1]))
+        gen_ids = output_ids[:, inputs["input_ids"].shape[1]:]
+        # Whole-batch decode rate (padding after EOS is not counted).
+        completion = (gen_ids != tok.pad_token_id).sum(dim=1).tolist()
+        metrics.tokens(self.provider, self.model_name, sum(completion), perf_counter() - t0)
+        for ctx, n_prompt, n_out in zip(contexts or (), inputs["attention_mask"].sum(dim=1).tolist(), completion):
+            ctx.run(metrics.note_usage, prompt_tokens=int(n_prompt) or None, completion_tokens=int(n_out) or None)
+        return tok.batch_decode(gen_ids, skip_special_tokens=True)
+
+    def _stream_hf(self, prompt: str) -> Iterator[str]:
+        import threading
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        class _Cancelled(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return cancel.is_set()
+
+        tok = self._hf_tokenizer
+        model = self._hf_model
+        cancel = threading.Event()
+        inputs = tok([self._format_prompt(prompt)], return_tensors="pt").to(model.device)
+        streamer = TextIteratorStreamer(tok, skip_prompt=True, skip_special_tokens=True, timeout=120)
+        worker = threading.Thread(
+            target=self._hf_generate,
+            kwargs=dict(
+                **inputs,
+                **self._hf_prefill(inputs),
+                **self._hf_gen_kwargs(),
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([_Cancelled()]),
+            ),
+            daemon=True,
+        )
+        worker.start()
+        try:
+            for piece in streamer:
+                yield piece
+        finally:
+            # Consumer stopped early (stop marker / client gone): let generate() return.
+            cancel.set()
+
+    # ----- HF through the inference server (chatbot1/inference.py) -----
+    def _init_hf_remote(self, name: str):
+        from . import inference
+        self._hf_remote = inference.client()
+        self._hf_model_name = name
+        # The server's settings (system prompt, sampling, ...) are what decide its replies.
+        self._hf_remote_config = self._hf_remote.config(name)["config"]
+
+    def _hf_remote_usage(self, usage: dict) -> None:
+        metrics.tokens(self.provider, self.model_name, usage.get("completion_tokens") or 0,
+                       usage.get("seconds") or 0, prompt=usage.get("prompt_tokens") or 0)
+
+    def _gen_hf_remote(self, prompt: str) -> str:
+        raw, usage = self._hf_remote.generate(prompt, self._hf_model_name)
+        self._hf_remote_usage(usage)
+        return raw
+
+    def _stream_hf_remote(self, prompt: str) -> Iterator[str]:
+        usage = {}
+        yield from self._hf_remote.stream(prompt, self._hf_model_name, usage)
+        self._hf_remote_usage(usage)
+
+    def _async_hf_remote(self):
+        from . import inference
+        return self._loop_client("hf_server", lambda: inference.AsyncClient(self._hf_remote.path))
+
+    async def _agen_hf_remote(self, prompt: str) -> str:
+        raw, usage = await self._async_hf_remote().generate(prompt, self._hf_model_name)
+        self._hf_remote_usage(usage)
+        return raw
+
+    async def _astream_hf_remote(self, prompt: str) -> AsyncIterator[str]:
+        usage = {}
+        raw = self._async_hf_remote().stream(prompt, self._hf_model_name, usage)
+        try:
+            async for piece in raw:
+                yield piece
+        finally:
+            await raw.aclose()
+        self._hf_remote_usage(usage)
+
+    # ----- Replay (offline load tests, see chatbot1/replay.py) -----
+    def _init_replay(self, name: str = None):
+        from . import replay
+        if replay.REPLAY_MODE == "record":
+            if replay.REPLAY_UPSTREAM == "replay":
+                raise ValueError("REPLAY_UPSTREAM must be a real provider")
+            self._replay_upstream = ChatBackend(replay.REPLAY_UPSTREAM, name)
+            self._replay_store = replay.store(readonly=False)
+            self._replay_config = self._replay_upstream.config()
+        elif replay.REPLAY_MODE == "replay":
+            self._replay_upstream = None
+            self._replay_store = replay.store(readonly=True)
+            self._replay_cid, self._replay_fp, self._replay_config = self._replay_store.resolve(replay.REPLAY_CONFIG)
+        else:
+            raise ValueError(f"Unknown REPLAY_MODE: {replay.REPLAY_MODE}")
+
+    def _replay_lookup(self, prompt: str) -> tuple:
+        """(recording, pieces, ttft, gap) for a replayed reply; reports its usage."""
+        from . import replay
+        from .stubserver import tokenize
+        rec = self._replay_store.get(self._replay_cid, self._replay_fp, prompt)
+        if rec is None:
+            raise RuntimeError("replay_miss: no recording for this prompt")
+        pieces = tokenize(rec.reply) or [""]
+        ttft, gap = replay.timing(rec, len(pieces))
+        metrics.tokens(self.provider, self.model_name, rec.completion_tokens or len(pieces),
+                       gap * (len(pieces) - 1), prompt=rec.prompt_tokens)
+        return rec, pieces, ttft, gap
+
+    def _replay_record(self, prompt: str, raw: str, ttft: float, total: float, usage: dict) -> None:
+        upstream_budget = self._replay_upstream.budget
+        if upstream_budget is not None and upstream_budget.reduced():
+            return  # shortened by the adaptive budget: not the recorded config's reply
+        try:
+            self._replay_store.put(self._replay_config, prompt, raw, ttft * 1000, total * 1000,
+                                   usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        except Exception:
+            logger.warning("Replay recording failed", exc_info=True)
+
+    def _replay_stream_done(self, prompt: str, parts: list, ttft, total: float, complete: bool) -> None:
+        # A stream cut short by the client is not a reply worth replaying; one
+        # stopped at a STOP_SEQS marker or a complete answer is (cleaning cuts
+        # the replay at the same place).
+        raw = "".join(parts)
+        if complete or _STOP_RE.search(raw) or answer.end(raw) != -1:
+            # Streams carry no usage block on every upstream: count non-empty chunks as tokens.
+            usage = {"completion_tokens": sum(1 for p in parts if p) or None}
+            self._replay_record(prompt, raw, total if ttft is None else ttft, total, usage)
+
+    def _gen_replay(self, prompt: str) -> str:
+        if self._replay_upstream is None:
+            rec, pieces, ttft, gap = self._replay_lookup(prompt)
+            time.sleep(ttft + gap * (len(pieces) - 1))
+            return rec.reply
+        usage, token = metrics.begin_usage()
+        t0 = perf_counter()
+        try:
+            raw = self._replay_upstream._generate_raw(prompt)
+        finally:
+            metrics.end_usage(token)
+        elapsed = perf_counter() - t0
+        metrics.note_usage(**usage)
+        metrics.serving(self._replay_upstream.provider, self._replay_upstream.model_name)
+        self._replay_record(prompt, raw, elapsed, elapsed, usage)
+        return raw
+
+    def _stream_replay(self, prompt: str) -> Iterator[str]:
+        if self._replay_upstream is None:
+            rec, pieces, ttft, gap = self._replay_lookup(prompt)
+            time.sleep(ttft)
+            for i, piece in enumerate(pieces):
+                if i and gap:
+                    time.sleep(gap)
+                yield piece
+            return
+        raw = self._replay_upstream._stream_raw(prompt)
+        metrics.serving(self._replay_upstream.provider, self._replay_upstream.model_name)
+        parts, ttft, complete = [], None, False
+        t0 = perf_counter()
+        try:
+            for chunk in raw:
+                if chunk and ttft is None:
+                    ttft = perf_counter() - t0
+                parts.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            raw.close()
+            self._replay_stream_done(prompt, parts, ttft, perf_counter() - t0, complete)
+
+    async def _agen_replay(self, prompt: str) -> str:
+        from asgiref.sync import sync_to_async
+        if self._replay_upstream is None:
+            # One indexed probe of a memory-mapped file; cheaper than a thread hop.
+            rec, pieces, ttft, gap = self._replay_lookup(prompt)
+            await asyncio.sleep(ttft + gap * (len(pieces) - 1))
+            return rec.reply
+        usage, token = metrics.begin_usage()
+        t0 = perf_counter()
+        try:
+            raw = await self._replay_upstream._agenerate_raw(prompt)
+        finally:
+            metrics.end_usage(token)
+        elapsed = perf_counter() - t0
+        metrics.note_usage(**usage)
+        metrics.serving(self._replay_upstream.provider, self._replay_upstream.model_name)
+        await sync_to_async(self._replay_record, thread_sensitive=False)(prompt, raw, elapsed, elapsed, usage)
+        return raw
+
+    async def _astream_replay(self, prompt: str) -> AsyncIterator[str]:
+        from asgiref.sync import sync_to_async
+        if self._replay_upstream is None:
+            rec, pieces, ttft, gap = self._replay_lookup(prompt)
+            await asyncio.sleep(ttft)
+            for i, piece in enumerate(pieces):
+                if i and gap:
+                    await asyncio.sleep(gap)
+                yield piece
+            return
+        raw = self._replay_upstream._astream_raw(prompt)
+        metrics.serving(self._replay_upstream.provider, self._replay_upstream.model_name)
+        parts, ttft, complete = [], None, False
+        t0 = perf_counter()
+        try:
+            async for chunk in raw:
+                if chunk and ttft is None:
+                    ttft = perf_counter() - t0
+                parts.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            await raw.aclose()
+            await sync_to_async(self._replay_stream_done, thread_sensitive=False)(
+                prompt, parts, ttft, perf_counter() - t0, complete)
+
+    # ----- Async clients (ASGI) -----
+    def _loop_client(self, name: str, factory):
+        # httpx-based clients are bound to the event loop that first used them.
+        loop = asyncio.get_running_loop()
+        client = self._aclients.get((name, loop))
+        if client is None:
+            for key in [k for k in self._aclients if k[1].is_closed()]:
+                self._aclients.pop(key)
+            client = self._aclients[(name, loop)] = factory()
+        return client
+
+    def _async_openai(self):
+        from openai import AsyncOpenAI
+        return self._loop_client("openai", lambda: AsyncOpenAI(**self._openai_kwargs))
+
+    def _async_http(self):
+        import httpx
+        return self._loop_client("http", lambda: httpx.AsyncClient(
+            timeout=120,
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS),
+        ))
+
+    def close(self) -> None:
+        """Drop the HF model, prefix cache and batcher thread so their memory can be freed (see hfpool)."""
+        if self._hf_batcher is not None:
+            self._hf_batcher.close()
+            self._hf_batcher = None
+        if self._hf_ready:
+            self._hf_ready = False
+            self._hf_model = self._hf_tokenizer = self._hf_prefix = None
+
+    # ----- Health -----
+    def probe_target(self):
+        """(url, headers) the health monitor GETs to check this upstream, or None for local providers."""
+        if self.provider == "openai":
+            headers = {"Authorization": f"Bearer {self._openai_kwargs['api_key']}"}
+            return f"{str(self._openai.base_url).rstrip('/')}/models", headers
+        if self.provider == "ollama":
+            return f"{self._ollama_base}/api/tags", {}
+        return None
 
     # ----- Public -----
-    def generate(self, prompt: str) -> str:
-        if PROVIDER == "openai":
-            return self._gen_openai(prompt)
-        if PROVIDER == "ollama":
-            return self._gen_ollama(prompt)
-        if PROVIDER == "hf":
+    def config(self) -> dict:
+        """Everything besides the prompt that determines a reply (cache key input)."""
+        if self.provider == "openai":
+            model, sampling = self._openai_model, OPENAI_SAMPLING
+        elif self.provider == "ollama":
+            model, sampling = self._ollama_model, OLLAMA_SAMPLING
+        elif self.provider == "replay":
+            return {**self._replay_config, "provider": "replay", "early_stop": answer.settings()}
+        elif self._hf_remote is not None:
+            return self._hf_remote_config
+        else:
+            model, sampling = self._hf_model_name, HF_SAMPLING
+        return {
+            "provider": self.provider,
+            "model": model,
+            "system_prompt": SYSTEM_PROMPT,
+            "max_new_tokens": MAX_NEW_TOKENS,
+            "sampling": sampling,
+            "early_stop": answer.settings(),
+        }
+
+    def _generate_raw(self, prompt: str) -> str:
+        if self.provider == "openai":
+            with health.guard(self.breaker):
+                return self._gen_openai(prompt)
+        if self.provider == "ollama":
+            with health.guard(self.breaker):
+                return self._gen_ollama(prompt)
+        if self.provider == "hf":
+            if self._hf_remote is not None:
+                return self._gen_hf_remote(prompt)
+            if self._hf_batcher is not None:
+                return self._hf_batcher.submit(prompt)
             return self._gen_hf(prompt)
+        if self.provider == "replay":
+            return self._gen_replay(prompt)
         raise RuntimeError("Unsupported provider")
 
-class MyChatbot1:
-    def __init__(self):
-        self.backend = ChatBackend()
     def generate(self, prompt: str) -> str:
-        return self.backend.generate(prompt)
+        with metrics.provider_call(self.provider, self.model_name), budget.track(self.budget):
+            raw = self._generate_raw(prompt)
+        with metrics.stage("clean", self.provider, self.model_name):
+            return _clean(raw)
+
+    def _stream_raw(self, prompt: str) -> Iterator[str]:
+        if self.provider == "openai":
+            return health.guard_stream(self.breaker, self._stream_openai(prompt))
+        if self.provider == "ollama":
+            return health.guard_stream(self.breaker, self._stream_ollama(prompt))
+        if self.provider == "hf":
+            if self._hf_remote is not None:
+                return self._stream_hf_remote(prompt)
+            return self._stream_hf(prompt)
+        if self.provider == "replay":
+            return self._stream_replay(prompt)
+        raise RuntimeError("Unsupported provider")
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yield cleaned text deltas; ends (closing the upstream) at a STOP_SEQS marker or once the answer is complete."""
+        raw = self._stream_raw(prompt)
+        cleaner = _StreamCleaner()
+        timer = _StreamTimer(self.provider, self.model_name)
+        with budget.track(self.budget):
+            try:
+                for chunk in raw:
+                    delta = timer.feed(cleaner, chunk)
+                    if delta:
+                        yield delta
+                    if cleaner.done:
+                        return
+                delta = timer.finish(cleaner)
+                if delta:
+                    yield delta
+            except Exception:
+                timer.failed()
+                raise
+            finally:
+                raw.close()
+                timer.close()
+
+    async def _agenerate_raw(self, prompt: str) -> str:
+        from asgiref.sync import sync_to_async
+        if self.provider == "openai":
+            with health.guard(self.breaker):
+                return await self._agen_openai(prompt)
+        if self.provider == "ollama":
+            with health.guard(self.breaker):
+                return await self._agen_ollama(prompt)
+        if self.provider == "hf":
+            if self._hf_remote is not None:
+                return await self._agen_hf_remote(prompt)
+            if self._hf_batcher is not None:
+                return await self._hf_batcher.asubmit(prompt)
+            # CPU/GPU bound; keep it off the event loop.
+            return await sync_to_async(self._gen_hf, thread_sensitive=False)(prompt)
+        if self.provider == "replay":
+            return await self._agen_replay(prompt)
+        raise RuntimeError("Unsupported provider")
+
+    async def agenerate(self, prompt: str) -> str:
+        with metrics.provider_call(self.provider, self.model_name), budget.track(self.budget):
+            raw = await self._agenerate_raw(prompt)
+        with metrics.stage("clean", self.provider, self.model_name):
+            return _clean(raw)
+
+    def _astream_raw(self, prompt: str) -> AsyncIterator[str]:
+        if self.provider == "openai":
+            return health.aguard_stream(self.breaker, self._astream_openai(prompt))
+        if self.provider == "ollama":
+            return health.aguard_stream(self.breaker, self._astream_ollama(prompt))
+        if self.provider == "hf":
+            if self._hf_remote is not None:
+                return self._astream_hf_remote(prompt)
+            return _aiter_sync(self._stream_hf(prompt))
+        if self.provider == "replay":
+            return self._astream_replay(prompt)
+        raise RuntimeError("Unsupported provider")
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """Async twin of `stream`."""
+        raw = self._astream_raw(prompt)
+        cleaner = _StreamCleaner()
+        timer = _StreamTimer(self.provider, self.model_name)
+        with budget.track(self.budget):
+            try:
+                async for chunk in raw:
+                    delta = timer.feed(cleaner, chunk)
+                    if delta:
+                        yield delta
+                    if cleaner.done:
+                        return
+                delta = timer.finish(cleaner)
+                if delta:
+                    yield delta
+            except Exception:
+                timer.failed()
+                raise
+            finally:
+                await raw.aclose()
+                timer.close()
+
+async def _aiter_sync(gen: Iterator[str]) -> AsyncIterator[str]:
+    from asgiref.sync import sync_to_async
+    step = sync_to_async(next, thread_sensitive=False)
+    done = object()
+    try:
+        while True:
+            item = await step(gen, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        await sync_to_async(gen.close, thread_sensitive=False)()
+
+class MyChatbot1:
+    def __init__(self, backend=None):
+        from .cache import ResponseCache
+        from .router import MODEL_ROUTES, Router
+        from .singleflight import SingleFlight
+        # MODEL_ROUTES switches from the single MODEL_PROVIDER backend to the
+        # latency-aware multi-backend router; hf runs behind a model pool that
+        # can serve other models per request (same interface), in this process
+        # or in the inference server.
+        if backend is None:
+            if MODEL_ROUTES:
+                backend = Router.from_spec(MODEL_ROUTES)
+            elif PROVIDER == "hf":
+                from . import inference
+                if inference.enabled():
+                    backend = inference.RemoteModels(MODEL_NAME)  # the pool is in the inference server
+                else:
+                    from .hfpool import HF_MODELS, ModelPool
+                    backend = ModelPool(MODEL_NAME, HF_MODELS)
+            else:
+                backend = ChatBackend()
+        self.backend = backend
+        self.cache = ResponseCache()
+        self.flights = SingleFlight(SINGLEFLIGHT_TIMEOUT) if SINGLEFLIGHT else None
+
+    # Lookup order: exact (local, then shared) -> semantic -> provider.
+    # use_cache=False skips the lookup but still refreshes the cached reply.
+    def _lookup(self, prompt: str, key: str, config: dict, use_cache: bool):
+        if not use_cache:
+            self.cache.bypass()
+            return None
+        with metrics.stage("cache"):
+            hit = self.cache.get(key)
+            if hit is None:
+                hit = self.cache.get_similar(prompt, config)
+        return hit
+
+    def _store(self, prompt: str, key: str, config: dict, text: str, full: bool) -> None:
+        if not full or budget.reduced():
+            return  # (possibly) cut short by the adaptive token budget; don't serve it once load is gone
+        self.cache.set(key, text)
+        self.cache.set_similar(prompt, config, text)
+
+    def check_model(self, model: str) -> None:
+        """Raise ValueError unless `model` can be asked for per request (only behind the HF model pool)."""
+        check = getattr(self.backend, "check", None)
+        if check is None:
+            raise ValueError("per-request model selection needs MODEL_PROVIDER=hf")
+        check(model)
+
+    def _cache_ctx(self, prompt: str, model: str = None):
+        from .cache import cache_key
+        config = self.backend.config(model) if model else self.backend.config()
+        history = getattr(prompt, "history", None)
+        if history:
+            config = {**config, "history": history}  # a reply in a conversation depends on what came before
+        return cache_key(prompt, config), config
+
+    def generate(self, prompt: str, use_cache: bool = True, model: str = None) -> str:
+        key, config = self._cache_ctx(prompt, model)
+        hit = self._lookup(prompt, key, config, use_cache)
+        if hit is not None:
+            return hit
+        full = not budget.reduced()
+        def call():
+            text = self.backend.generate(prompt, model=model) if model else self.backend.generate(prompt)
+            self._store(prompt, key, config, text, full)
+            return text
+
+        # Identical prompts already in flight share one upstream call.
+        if self.flights is None:
+            return call()
+        return self.flights.do(key, call)
+
+    def stream(self, prompt: str, use_cache: bool = True, model: str = None) -> Iterator[str]:
+        key, config = self._cache_ctx(prompt, model)
+        hit = self._lookup(prompt, key, config, use_cache)
+        if hit is not None:
+            yield hit
+            return
+        full = not budget.reduced()
+        parts = []
+        for delta in self.backend.stream(prompt, model=model) if model else self.backend.stream(prompt):
+            parts.append(delta)
+            yield delta
+        self._store(prompt, key, config, "".join(parts), full)
+
+    async def _alookup(self, prompt: str, key: str, config: dict, use_cache: bool):
+        if not use_cache:
+            self.cache.bypass()
+            return None
+        with metrics.stage("cache"):
+            hit = await self.cache.aget(key)
+            if hit is None and self.cache.semantic is not None:
+                # A NumPy scan over the whole matrix: keep it off the event loop.
+                from asgiref.sync import sync_to_async
+                hit = await sync_to_async(self.cache.get_similar, thread_sensitive=False)(prompt, config)
+        return hit
+
+    async def _astore(self, prompt: str, key: str, config: dict, text: str, full: bool) -> None:
+        if not full or budget.reduced():
+            return  # as in _store: possibly cut short by the adaptive token budget
+        await self.cache.aset(key, text)
+        if self.cache.semantic is not None:
+            from asgiref.sync import sync_to_async
+            await sync_to_async(self.cache.set_similar, thread_sensitive=False)(prompt, config, text)
+
+    async def agenerate(self, prompt: str, use_cache: bool = True, model: str = None) -> str:
+        key, config = self._cache_ctx(prompt, model)
+        hit = await self._alookup(prompt, key, config, use_cache)
+        if hit is not None:
+            return hit
+        full = not budget.reduced()
+        async def call():
+            text = await (self.backend.agenerate(prompt, model=model) if model else self.backend.agenerate(prompt))
+            await self._astore(prompt, key, config, text, full)
+            return text
+
+        if self.flights is None:
+            return await call()
+        return await self.flights.ado(key, call)
+
+    async def astream(self, prompt: str, use_cache: bool = True, model: str = None) -> AsyncIterator[str]:
+        key, config = self._cache_ctx(prompt, model)
+        hit = await self._alookup(prompt, key, config, use_cache)
+        if hit is not None:
+            yield hit
+            return
+        full = not budget.reduced()
+        parts = []
+        async for delta in self.backend.astream(prompt, model=model) if model else self.backend.astream(prompt):
+            parts.append(delta)
+            yield delta
+        await self._astore(prompt, key, config, "".join(parts), full)
+
+
+# ----- Transcript store -----
+class Transcript(models.Model):
+    """One chat reply. Written in batches by chatbot1.transcripts, never on the request path."""
+    created_at = models.DateTimeField()
+    source = models.CharField(max_length=16)  # chat / stream / batch
+    prompt = models.TextField()
+    response = models.TextField()
+    provider = models.CharField(max_length=32)
+    model = models.CharField(max_length=200)
+    latency_ms = models.FloatField()
+    fallback_used = models.BooleanField(default=False)
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="transcript_created_idx"),
+            models.Index(fields=["model", "created_at"], name="transcript_model_created_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.created_at:%Y-%m-%d %H:%M:%S} {self.provider}/{self.model}: {self.prompt[:40]}"
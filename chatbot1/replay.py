@@ -0,0 +1,268 @@
+# chatbot1/replay.py
+# On-disk corpus for MODEL_PROVIDER=replay. REPLAY_MODE=record passes chats to
+# a real provider (REPLAY_UPSTREAM) and stores the raw replies; REPLAY_MODE=replay
+# serves them back with synthetic or recorded timing, so the web tier can be
+# load-tested without a model.
+#
+# The corpus is a single SQLite file: entries are keyed by a 16-byte digest of
+# (upstream config, prompt) under a unique index, text is zlib-compressed, and
+# replay opens it read-only and memory-mapped. Opening costs the same for ten
+# entries or ten million; each lookup is one index probe.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+REPLAY_PATH = os.getenv("REPLAY_PATH", "replay.sqlite3")
+REPLAY_MODE = os.getenv("REPLAY_MODE", "replay").strip().lower()  # "replay" | "record"
+REPLAY_UPSTREAM = os.getenv("REPLAY_UPSTREAM", "openai").strip().lower()
+# Fingerprint (or prefix) of the recorded config to serve; default = the most recently recorded one.
+REPLAY_CONFIG = os.getenv("REPLAY_CONFIG", "").strip()
+# "any" = serve a deterministic pick from the corpus for unknown prompts; "error" = fail the chat.
+REPLAY_MISS = os.getenv("REPLAY_MISS", "any").strip().lower()
+# Timing. Empty = use what was recorded (scaled by REPLAY_SPEED); a number overrides it.
+REPLAY_LATENCY_MS = os.getenv("REPLAY_LATENCY_MS", "").strip()
+REPLAY_TOKENS_PER_S = os.getenv("REPLAY_TOKENS_PER_S", "").strip()
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "1.0"))
+REPLAY_MMAP_MB = int(os.getenv("REPLAY_MMAP_MB", "1024"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL UNIQUE,
+    config TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    key BLOB NOT NULL UNIQUE,
+    config INTEGER NOT NULL,
+    prompt BLOB NOT NULL,
+    reply BLOB NOT NULL,
+    ttft_ms REAL,
+    total_ms REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER
+);
+"""
+
+
+def fingerprint(config: dict) -> str:
+    blob = json.dumps(config, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def entry_key(fp: str, prompt: str) -> bytes:
+    history = getattr(prompt, "history", None)  # a turn of a conversation: keyed with the turns before it
+    if history:
+        prompt = json.dumps(history, ensure_ascii=False, separators=(",", ":")) + "\0" + prompt
+    return hashlib.blake2b(f"{fp}\0{prompt}".encode("utf-8"), digest_size=16).digest()
+
+
+def _pack(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), 6)
+
+
+def _unpack(blob: bytes) -> str:
+    return zlib.decompress(blob).decode("utf-8")
+
+
+class Recording:
+    __slots__ = ("reply", "ttft_ms", "total_ms", "prompt_tokens", "completion_tokens", "exact")
+
+    def __init__(self, reply, ttft_ms, total_ms, prompt_tokens, completion_tokens, exact=True):
+        self.reply = reply
+        self.ttft_ms = ttft_ms or 0.0
+        self.total_ms = total_ms or self.ttft_ms
+        self.prompt_tokens = prompt_tokens or 0
+        self.completion_tokens = completion_tokens or 0
+        self.exact = exact
+
+
+class ReplayStore:
+    """
+    The corpus file. Connections are per thread (sqlite3 objects are not
+    shareable) and per process, so it is safe under gunicorn and from the
+    event loop. Read-only stores never take a write lock.
+    """
+
+    def __init__(self, path: str, readonly: bool = True):
+        self.path = path
+        self.readonly = readonly
+        if readonly and not os.path.exists(path):
+            raise ValueError(f"Replay corpus not found: {path} (record one with REPLAY_MODE=record)")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._configs = {}  # fingerprint -> configs.id (record mode)
+        self._counts = {"hits": 0, "misses": 0, "substituted": 0, "recorded": 0}
+        if not readonly:
+            with self._conn() as conn:
+                conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != pid:
+            if self.readonly:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+                conn.execute("PRAGMA query_only = ON")
+            else:
+                conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(f"PRAGMA mmap_size = {REPLAY_MMAP_MB * 2**20}")
+            self._local.conn, self._local.pid = conn, pid
+        return conn
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    # ----- Configs -----
+    def configs(self) -> list:
+        rows = self._conn().execute("SELECT id, fingerprint, config, updated FROM configs ORDER BY updated DESC")
+        return [{"id": i, "fingerprint": fp, "config": json.loads(cfg), "updated": updated}
+                for i, fp, cfg, updated in rows]
+
+    def resolve(self, wanted: str = "") -> tuple:
+        """(configs.id, fingerprint, config) to serve: `wanted` prefix, else the latest recorded."""
+        for c in self.configs():
+            if c["fingerprint"].startswith(wanted):
+                return c["id"], c["fingerprint"], c["config"]
+        if wanted:
+            raise ValueError(f"REPLAY_CONFIG={wanted} matches no recorded config in {self.path}")
+        raise ValueError(f"Replay corpus {self.path} is empty")
+
+    def _config_id(self, conn, config: dict) -> tuple:
+        fp = fingerprint(config)
+        cid = self._configs.get(fp)
+        now = time.time()
+        if cid is None:
+            conn.execute(
+                "INSERT INTO configs (fingerprint, config, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(fingerprint) DO UPDATE SET updated = excluded.updated",
+                (fp, json.dumps(config, sort_keys=True, default=str), now),
+            )
+            cid = conn.execute("SELECT id FROM configs WHERE fingerprint = ?", (fp,)).fetchone()[0]
+            self._configs[fp] = cid
+        else:
+            conn.execute("UPDATE configs SET updated = ? WHERE id = ?", (now, cid))
+        return cid, fp
+
+    # ----- Read / write -----
+    def get(self, cid: int, fp: str, prompt: str):
+        """The recording for `prompt`, a stand-in under REPLAY_MISS=any, or None."""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT reply, ttft_ms, total_ms, prompt_tokens, completion_tokens FROM entries WHERE key = ?",
+            (entry_key(fp, prompt),),
+        ).fetchone()
+        if row is not None:
+            self._count("hits")
+            return Recording(_unpack(row[0]), *row[1:])
+        self._count("misses")
+        if REPLAY_MISS != "any":
+            return None
+        # Same prompt -> same stand-in: hash into the id range and take the next row of this config.
+        top = conn.execute("SELECT MAX(id) FROM entries").fetchone()[0]
+        if not top:
+            return None
+        start = int.from_bytes(entry_key(fp, prompt)[:8], "big") % top + 1
+        sql = ("SELECT reply, ttft_ms, total_ms, prompt_tokens, completion_tokens FROM entries "
+               "WHERE config = ? AND id {} ? ORDER BY id {} LIMIT 1")
+        row = (conn.execute(sql.format(">=", "ASC"), (cid, start)).fetchone()
+               or conn.execute(sql.format("<", "DESC"), (cid, start)).fetchone())
+        if row is None:
+            return None
+        self._count("substituted")
+        return Recording(_unpack(row[0]), *row[1:], exact=False)
+
+    def entries(self, cid: int):
+        """(prompt, Recording) for every entry of config `cid`, in recording order."""
+        rows = self._conn().execute(
+            "SELECT prompt, reply, ttft_ms, total_ms, prompt_tokens, completion_tokens FROM entries "
+            "WHERE config = ? ORDER BY id", (cid,),
+        )
+        for prompt, reply, *rest in rows:
+            yield _unpack(prompt), Recording(_unpack(reply), *rest)
+
+    def put(self, config: dict, prompt: str, reply: str, ttft_ms: float, total_ms: float,
+            prompt_tokens: int = None, completion_tokens: int = None) -> None:
+        conn = self._conn()
+        with conn:
+            cid, fp = self._config_id(conn, config)
+            conn.execute(
+                "INSERT INTO entries (key, config, prompt, reply, ttft_ms, total_ms, prompt_tokens, completion_tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET reply = excluded.reply, "
+                "ttft_ms = excluded.ttft_ms, total_ms = excluded.total_ms, "
+                "prompt_tokens = excluded.prompt_tokens, completion_tokens = excluded.completion_tokens",
+                (entry_key(fp, prompt), cid, _pack(prompt), _pack(reply), ttft_ms, total_ms,
+                 prompt_tokens, completion_tokens),
+            )
+        self._count("recorded")
+
+    def put_many(self, config: dict, rows) -> int:
+        """Bulk load (prompt, reply, ttft_ms, total_ms, prompt_tokens, completion_tokens) tuples."""
+        conn = self._conn()
+        n = 0
+        with conn:
+            cid, fp = self._config_id(conn, config)
+
+            def packed():
+                nonlocal n
+                for prompt, reply, *rest in rows:
+                    n += 1
+                    yield (entry_key(fp, prompt), cid, _pack(prompt), _pack(reply), *rest)
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, config, prompt, reply, ttft_ms, total_ms, prompt_tokens, "
+                "completion_tokens) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", packed(),
+            )
+        return n
+
+    def close(self) -> None:
+        """Close this thread's connection (a writer's close also checkpoints the WAL into the file)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {"path": self.path, "readonly": self.readonly, **counts}
+
+
+# ----- Timing -----
+def timing(rec: Recording, pieces: int) -> tuple:
+    """(seconds before the first piece, seconds between pieces) for a replayed reply."""
+    if REPLAY_LATENCY_MS:
+        ttft = float(REPLAY_LATENCY_MS) / 1000
+    else:
+        ttft = rec.ttft_ms / 1000 * REPLAY_SPEED
+    if REPLAY_TOKENS_PER_S:
+        rate = float(REPLAY_TOKENS_PER_S)
+        gap = 1.0 / rate if rate > 0 else 0.0
+    else:
+        decode = max(0.0, rec.total_ms - rec.ttft_ms) / 1000 * REPLAY_SPEED
+        gap = decode / max(1, pieces - 1)
+    return ttft, gap
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store(readonly: bool) -> ReplayStore:
+    """Shared ReplayStore for REPLAY_PATH (one per mode)."""
+    st = _stores.get(readonly)
+    if st is None:
+        with _stores_lock:
+            st = _stores.get(readonly)
+            if st is None:
+                st = _stores[readonly] = ReplayStore(REPLAY_PATH, readonly=readonly)
+    return st
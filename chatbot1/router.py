@@ -0,0 +1,382 @@
+# chatbot1/router.py
+
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Iterator, List
+
+from . import health, metrics
+from .models import FALLBACK_MODEL_NAME, ChatBackend
+
+logger = logging.getLogger(__name__)
+
+# e.g. "openai,ollama:qwen2.5:3b-instruct,hf" — provider[:model], best-first tie order.
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "200"))
+ROUTER_HEDGE_MIN_MS = float(os.getenv("ROUTER_HEDGE_MIN_MS", "250"))
+ROUTER_HEDGE_DEFAULT_MS = float(os.getenv("ROUTER_HEDGE_DEFAULT_MS", "4000"))
+# Hedges may add at most this fraction of extra upstream calls.
+ROUTER_HEDGE_BUDGET = float(os.getenv("ROUTER_HEDGE_BUDGET", "0.1"))
+ROUTER_THREADS = int(os.getenv("ROUTER_THREADS", "16"))
+# Chance of sending a request to a route with too few samples to rank it.
+ROUTER_EXPLORE = float(os.getenv("ROUTER_EXPLORE", "0.05"))
+ROUTER_MIN_SAMPLES = 5
+
+
+def parse_routes(spec: str) -> list:
+    routes = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        provider, _, model = item.partition(":")
+        provider = provider.strip().lower()
+        if provider == "hf" and not model:
+            model = FALLBACK_MODEL_NAME
+        routes.append((provider, model.strip() or None))
+    return routes
+
+
+def _exhausted(errors: list) -> Exception:
+    """What to raise once every route failed; Unavailable if each was refused by its breaker."""
+    if errors and all(isinstance(e, health.Unavailable) for _, e in errors):
+        return health.Unavailable("every route", min(e.retry_after for _, e in errors))
+    return RuntimeError("all backends failed: " + "; ".join(f"{route.name}: {e}" for route, e in errors))
+
+
+def _call(route: "Route", prompt: str) -> tuple:
+    """`route.call` with its own usage / Server-Timing records: (text, usage, timings)."""
+    usage, usage_token = metrics.begin_usage()
+    timings, timings_token = metrics.begin_request()
+    try:
+        return route.call(prompt), usage, timings
+    finally:
+        metrics.end_request(timings_token)
+        metrics.end_usage(usage_token)
+
+
+async def _acall(route: "Route", prompt: str) -> tuple:
+    usage, usage_token = metrics.begin_usage()
+    timings, timings_token = metrics.begin_request()
+    try:
+        return await route.acall(prompt), usage, timings
+    finally:
+        metrics.end_request(timings_token)
+        metrics.end_usage(usage_token)
+
+
+class Route:
+    """One backend plus its rolling latency / error window."""
+
+    def __init__(self, name: str, backend, order: int):
+        self.name = name
+        self.backend = backend
+        self.order = order
+        self._lat = deque(maxlen=ROUTER_WINDOW)
+        self._ok = deque(maxlen=ROUTER_WINDOW)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.wins = 0
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self._ok.append(ok)
+            if ok:
+                self._lat.append(seconds)
+
+    def quantile(self, q: float):
+        with self._lock:
+            lat = sorted(self._lat)
+        if not lat:
+            return None
+        return lat[min(len(lat) - 1, int(q * len(lat)))]
+
+    def circuit_open(self) -> bool:
+        breaker = getattr(self.backend, "breaker", None)
+        return breaker is not None and breaker.state == health.OPEN
+
+    def samples(self) -> int:
+        return len(self._ok)
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return 1.0 - sum(self._ok) / len(self._ok) if self._ok else 0.0
+
+    def score(self) -> float:
+        # Expected cost: median latency inflated by recent failures; unseen
+        # routes keep their configured order.
+        p50 = self.quantile(0.5)
+        if p50 is None:
+            p50 = ROUTER_HEDGE_DEFAULT_MS / 1000 * (1 + self.order * 0.01)
+        return p50 / max(0.05, 1.0 - self.error_rate())
+
+    def hedge_delay(self) -> float:
+        p95 = self.quantile(0.95)
+        if p95 is None:
+            return ROUTER_HEDGE_DEFAULT_MS / 1000
+        return max(ROUTER_HEDGE_MIN_MS / 1000, p95)
+
+    def call(self, prompt: str) -> str:
+        started = time.perf_counter()
+        try:
+            text = self.backend.generate(prompt)
+        except health.Unavailable:
+            raise  # refused without a call; the breaker already knows
+        except Exception:
+            self.record(time.perf_counter() - started, False)
+            raise
+        self.record(time.perf_counter() - started, True)
+        return text
+
+    async def acall(self, prompt: str) -> str:
+        started = time.perf_counter()
+        try:
+            text = await self.backend.agenerate(prompt)
+        except (asyncio.CancelledError, health.Unavailable):
+            raise  # lost a hedge race / refused by the breaker; not a new failure
+        except Exception:
+            self.record(time.perf_counter() - started, False)
+            raise
+        self.record(time.perf_counter() - started, True)
+        return text
+
+    def stats(self) -> dict:
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "wins": self.wins,
+            "error_rate": round(self.error_rate(), 4),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "score": round(self.score(), 4),
+            "circuit_open": self.circuit_open(),
+        }
+
+
+class Router:
+    """
+    Multi-backend ChatBackend stand-in.
+
+    Each request goes to the route with the best score. If it has not answered
+    by that route's rolling p95, one hedge is fired at the next-best route
+    (within ROUTER_HEDGE_BUDGET) and the first success wins; failures fail over
+    down the ranking. On the async path the losing call is cancelled; on the
+    sync path a loser that has already started can't be stopped: it keeps its
+    upstream call and router thread until it returns, and its latency still
+    feeds its route's window (a real sample of that upstream).
+
+    Every call runs in a copy of the caller's context but records usage and
+    Server-Timing stages of its own; only the winner's are copied back into
+    the chat's, so a loser finishing late can't overwrite them.
+    """
+
+    def __init__(self, routes: List[Route]):
+        if not routes:
+            raise ValueError("Router needs at least one backend")
+        self.routes = routes
+        self._pool = ThreadPoolExecutor(max_workers=ROUTER_THREADS, thread_name_prefix="router")
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._hedges = 0
+        self._failovers = 0
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "Router":
+        routes = []
+        for provider, model in parse_routes(spec):
+            name = f"{provider}:{model}" if model else provider
+            try:
+                backend = ChatBackend(provider, model)
+            except Exception:
+                logger.exception("Route %s failed to initialise; skipping", name)
+                continue
+            routes.append(Route(name, backend, len(routes)))
+        return cls(routes)
+
+    # ----- ranking / budget -----
+    def _ranked(self) -> List[Route]:
+        # Routes behind an open breaker go last (they fail fast if reached).
+        ranked = sorted(self.routes, key=lambda r: (r.circuit_open(), r.score()))
+        cold = [r for r in ranked[1:] if r.samples() < ROUTER_MIN_SAMPLES]
+        if cold and random.random() < ROUTER_EXPLORE:
+            probe = random.choice(cold)
+            ranked.remove(probe)
+            ranked.insert(0, probe)
+        return ranked
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            if self._hedges >= ROUTER_HEDGE_BUDGET * self._requests + 1:
+                return False
+            self._hedges += 1
+            return True
+
+    def _start(self) -> None:
+        with self._lock:
+            self._requests += 1
+
+    def _won(self, route: Route) -> None:
+        with self._lock:
+            route.wins += 1
+
+    def _failover(self) -> None:
+        with self._lock:
+            self._failovers += 1
+
+    # ----- public (ChatBackend interface) -----
+    def config(self) -> dict:
+        return {"routes": [r.backend.config() for r in self.routes]}
+
+    def generate(self, prompt: str) -> str:
+        self._start()
+        ranked = self._ranked()
+        pending = {}
+        errors = []
+        nxt = 0
+
+        def launch():
+            nonlocal nxt
+            route = ranked[nxt]
+            nxt += 1
+            pending[self._pool.submit(contextvars.copy_context().run, _call, route, prompt)] = route
+            return route
+
+        deadline = time.monotonic() + launch().hedge_delay()
+        hedge_open = True
+        while pending:
+            timeout = None
+            if hedge_open and nxt < len(ranked):
+                timeout = max(0.0, deadline - time.monotonic())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedge_open = False
+                if self._take_hedge():
+                    launch()
+                continue
+            for fut in done:
+                route = pending.pop(fut)
+                try:
+                    text, usage, timings = fut.result()
+                except Exception as e:
+                    errors.append((route, e))
+                    continue
+                for other in pending:
+                    other.cancel()  # only drops a hedge that hasn't started
+                self._won(route)
+                metrics.note_usage(**usage)
+                metrics.note_timings(timings)
+                return text
+            if not pending and nxt < len(ranked):
+                self._failover()
+                deadline = time.monotonic() + launch().hedge_delay()
+                hedge_open = True
+        raise _exhausted(errors)
+
+    async def agenerate(self, prompt: str) -> str:
+        self._start()
+        ranked = self._ranked()
+        pending = {}
+        errors = []
+        nxt = 0
+
+        def launch():
+            nonlocal nxt
+            route = ranked[nxt]
+            nxt += 1
+            pending[asyncio.ensure_future(_acall(route, prompt))] = route
+            return route
+
+        deadline = time.monotonic() + launch().hedge_delay()
+        hedge_open = True
+        try:
+            while pending:
+                timeout = None
+                if hedge_open and nxt < len(ranked):
+                    timeout = max(0.0, deadline - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_open = False
+                    if self._take_hedge():
+                        launch()
+                    continue
+                for task in done:
+                    route = pending.pop(task)
+                    if task.exception() is not None:
+                        errors.append((route, task.exception()))
+                        continue
+                    text, usage, timings = task.result()
+                    self._won(route)
+                    metrics.note_usage(**usage)
+                    metrics.note_timings(timings)
+                    return text
+                if not pending and nxt < len(ranked):
+                    self._failover()
+                    deadline = time.monotonic() + launch().hedge_delay()
+                    hedge_open = True
+        finally:
+            for task in pending:
+                task.cancel()
+        raise _exhausted(errors)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        # Streams can't be hedged without double-sending text; fail over only
+        # while nothing has been yielded yet.
+        self._start()
+        errors = []
+        for i, route in enumerate(self._ranked()):
+            if i:
+                self._failover()
+            started = time.perf_counter()
+            sent = False
+            try:
+                for delta in route.backend.stream(prompt):
+                    sent = True
+                    yield delta
+            except Exception as e:
+                if not isinstance(e, health.Unavailable):
+                    route.record(time.perf_counter() - started, False)
+                if sent:
+                    raise
+                errors.append((route, e))
+                continue
+            route.record(time.perf_counter() - started, True)
+            self._won(route)
+            return
+        raise _exhausted(errors)
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        self._start()
+        errors = []
+        for i, route in enumerate(self._ranked()):
+            if i:
+                self._failover()
+            started = time.perf_counter()
+            sent = False
+            try:
+                async for delta in route.backend.astream(prompt):
+                    sent = True
+                    yield delta
+            except Exception as e:
+                if not isinstance(e, health.Unavailable):
+                    route.record(time.perf_counter() - started, False)
+                if sent:
+                    raise
+                errors.append((route, e))
+                continue
+            route.record(time.perf_counter() - started, True)
+            self._won(route)
+            return
+        raise _exhausted(errors)
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = {"requests": self._requests, "hedges": self._hedges, "failovers": self._failovers}
+        return {**totals, "routes": [r.stats() for r in sorted(self.routes, key=lambda r: r.score())]}
@@ -0,0 +1,141 @@
+# chatbot1/semcache.py
+
+import re
+import threading
+import time
+import zlib
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .cache import normalize_prompt
+
+
+_PUNCT = re.compile(r"[^\w\s]+")
+_STOPWORDS = frozenset(
+    "a an and any are can could do for give have i im i'm is it me my of on please "
+    "should so some the to what whats what's with would you".split()
+)
+
+
+class HashingVectorizer:
+    """
+    Offline prompt embedder: word unigrams/bigrams plus character n-grams,
+    signed-hashed into `dim` buckets, sublinear TF, L2-normalised.
+    """
+
+    def __init__(self, dim: int = 256, char_ngrams: Tuple[int, int] = (3, 4)):
+        if dim & (dim - 1):
+            raise ValueError("dim must be a power of two")
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+
+    def _features(self, text: str):
+        words = [w for w in _PUNCT.sub("", text).split() if w not in _STOPWORDS]
+        text = " ".join(words)
+        feats = ["w:" + w for w in words]
+        feats += ["b:" + a + " " + b for a, b in zip(words, words[1:])]
+        padded = f" {text} "
+        lo, hi = self.char_ngrams
+        for n in range(lo, hi + 1):
+            feats += [padded[i:i + n] for i in range(len(padded) - n + 1)]
+        return feats
+
+    def embed(self, text: str) -> np.ndarray:
+        feats = self._features(normalize_prompt(text))
+        vec = np.zeros(self.dim, dtype=np.float32)
+        if not feats:
+            return vec
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in feats), dtype=np.uint32, count=len(feats))
+        idx = (hashes & (self.dim - 1)).astype(np.intp)
+        signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+        np.add.at(vec, idx, signs)
+        vec = np.sign(vec) * np.log1p(np.abs(vec))
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
+
+
+class SemanticCache:
+    """
+    Near-duplicate reply cache: cosine nearest neighbour over a preallocated
+    (capacity x dim) float32 matrix. Rows are tagged with the generation-config
+    digest so a hit never crosses providers/models. When full, the least
+    recently used row is overwritten; expired rows are ignored and reused.
+    """
+
+    def __init__(self, capacity: int, threshold: float, ttl: float, dim: int = 256):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.vectorizer = HashingVectorizer(dim)
+        self._vecs = np.zeros((capacity, dim), dtype=np.float32)
+        self._cfg = np.zeros(capacity, dtype=np.int64)
+        self._expires = np.zeros(capacity, dtype=np.float64)
+        self._used = np.zeros(capacity, dtype=np.int64)
+        self._values = [None] * capacity
+        self._size = 0
+        self._tick = 0
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0}
+        self._lookup_ns = 0
+
+    def lookup(self, prompt: str, config_id: int) -> Optional[str]:
+        started = time.perf_counter_ns()
+        vec = self.vectorizer.embed(prompt)
+        with self._lock:
+            value = self._nearest(vec, config_id)
+            self._counts["hits" if value is not None else "misses"] += 1
+            self._lookup_ns += time.perf_counter_ns() - started
+        return value
+
+    def _nearest(self, vec: np.ndarray, config_id: int) -> Optional[str]:
+        n = self._size
+        if not n:
+            return None
+        sims = self._vecs[:n] @ vec
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        now = time.monotonic()
+        if self._cfg[best] != config_id or self._expires[best] <= now:
+            # Rare: the nearest row is stale or from another config; mask and retry.
+            sims[(self._cfg[:n] != config_id) | (self._expires[:n] <= now)] = -1.0
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+        self._tick += 1
+        self._used[best] = self._tick
+        return self._values[best]
+
+    def insert(self, prompt: str, config_id: int, value: str) -> None:
+        if not value:
+            return
+        vec = self.vectorizer.embed(prompt)
+        with self._lock:
+            if self._size < self.capacity:
+                row = self._size
+                self._size += 1
+            else:
+                expired = np.flatnonzero(self._expires <= time.monotonic())
+                row = int(expired[0]) if expired.size else int(np.argmin(self._used))
+            self._tick += 1
+            self._vecs[row] = vec
+            self._cfg[row] = config_id
+            self._expires[row] = time.monotonic() + self.ttl
+            self._used[row] = self._tick
+            self._values[row] = value
+
+    def __len__(self) -> int:
+        return self._size
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counts["hits"] + self._counts["misses"]
+            return {
+                "semantic_hits": self._counts["hits"],
+                "semantic_misses": self._counts["misses"],
+                "semantic_entries": self._size,
+                "semantic_capacity": self.capacity,
+                "semantic_threshold": self.threshold,
+                "semantic_lookup_avg_us": round(self._lookup_ns / lookups / 1000, 1) if lookups else 0.0,
+            }
@@ -0,0 +1,248 @@
+# chatbot1/sessions.py
+# Multi-turn conversations. A chat that names a session ("session": "new" to
+# start one, then the id the reply carries) is sent to the model together with
+# the turns before it, so the user can answer the bot's clarifying question.
+#
+# The context is kept under CHAT_SESSION_MAX_TOKENS as turns are added, never
+# rebuilt: each turn is stored with its token estimate, and once the total is
+# over budget the oldest turns are folded into a short summary (the user's own
+# words from them: diet, what is in the fridge; the bot's old ideas are
+# dropped), itself capped at CHAT_SESSION_SUMMARY_TOKENS. Prompt size, and with
+# it provider cost and prefill time, stays bounded however long a
+# conversation runs.
+#
+# Sessions live in the shared chat cache (CHAT_CACHE_SHARED; redis is the
+# fast choice) so any worker can serve the next turn, else in a per-process
+# LRU (one worker only). Either way they expire CHAT_SESSION_TTL seconds after
+# their last turn. Two turns of one session at once: the later save wins.
+
+import json
+import logging
+import re
+import secrets
+import threading
+from typing import Optional
+
+from django.conf import settings
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+NEW = "new"
+_ID_RE = re.compile(r"[A-Za-z0-9_-]{16,64}")
+_EARLIER = "(Earlier I said: {})\n"
+
+
+def tokens(text: str) -> int:
+    """Token estimate without a tokenizer (~4 characters per token for English BPE vocabularies)."""
+    return len(text) // 4 + 1
+
+
+class Turn(str):
+    """
+    A user message that carries the conversation before it: `history` is a tuple
+    of chat messages ({"role", "content"}). Everywhere else (cache keys, replay,
+    transcripts, logs) it is the plain message text.
+    """
+
+    def __new__(cls, text: str, history=()):
+        turn = super().__new__(cls, text)
+        turn.history = tuple(history)
+        return turn
+
+
+class Unknown(LookupError):
+    """The chat names a session that expired or never existed."""
+
+
+class Session:
+    __slots__ = ("id", "turns", "summary", "tokens", "count")
+
+    def __init__(self, sid: str, turns=None, summary: str = "", count: int = 0):
+        self.id = sid
+        self.turns = turns or []  # [user, reply, estimated tokens], oldest first
+        self.summary = summary
+        self.tokens = sum(t[2] for t in self.turns) + (tokens(summary) if summary else 0)
+        self.count = count        # turns ever added, including summarized ones
+
+    def messages(self) -> list:
+        out = []
+        for i, (user, reply, _) in enumerate(self.turns):
+            if i == 0 and self.summary:
+                user = _EARLIER.format(self.summary) + user
+            out.append({"role": "user", "content": user})
+            out.append({"role": "assistant", "content": reply})
+        return out
+
+    def turn(self, prompt: str) -> str:
+        """`prompt` with this conversation attached (or plain, for the first turn)."""
+        history = self.messages()
+        return Turn(prompt, history) if history else prompt
+
+    def add(self, user: str, reply: str, budget: int = None, summary_budget: int = None) -> None:
+        budget = settings.CHAT_SESSION_MAX_TOKENS if budget is None else budget
+        summary_budget = settings.CHAT_SESSION_SUMMARY_TOKENS if summary_budget is None else summary_budget
+        n = tokens(user) + tokens(reply)
+        self.turns.append([user, reply, n])
+        self.tokens += n
+        self.count += 1
+        if not budget:
+            return
+        while self.tokens > budget and len(self.turns) > 1:
+            old_user, _, old_n = self.turns.pop(0)
+            self.tokens -= old_n
+            self._fold(old_user, summary_budget)
+        if self.tokens > budget:
+            # One turn over the whole budget: keep the user's message, clip the reply.
+            user, reply, n = self.turns[0]
+            room = max(0, budget - (self.tokens - n) - tokens(user))
+            reply = reply[:room * 4].rstrip() + "…"
+            self.turns[0] = [user, reply, tokens(user) + tokens(reply)]
+            self.tokens += self.turns[0][2] - n
+
+    def _fold(self, user: str, budget: int) -> None:
+        if self.summary:
+            self.tokens -= tokens(self.summary)
+        summary = f"{self.summary} / {user}" if self.summary else user
+        if budget and tokens(summary) > budget:
+            # Oldest words go first; cut at a word boundary.
+            summary = summary[-budget * 4:]
+            summary = "…" + summary[summary.find(" ") + 1:] if " " in summary else summary
+        self.summary = summary if budget else ""
+        if self.summary:
+            self.tokens += tokens(self.summary)
+
+    def dumps(self) -> str:
+        return json.dumps([self.count, self.summary, self.turns], ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, sid: str, raw: str) -> "Session":
+        count, summary, turns = json.loads(raw)
+        return cls(sid, turns, summary, count)
+
+
+class SessionStore:
+    """Get/save sessions; a shared-store outage loses context (logged), it never fails a chat."""
+
+    def __init__(self):
+        self.ttl = settings.CHAT_SESSION_TTL
+        self.alias = settings.CHAT_CACHE_ALIAS
+        self.local = LRUCache(settings.CHAT_SESSION_MAX_ENTRIES, self.ttl) if not self.alias else None
+        self._lock = threading.Lock()
+        self._counts = {"created": 0, "resumed": 0, "unknown": 0, "saved": 0, "store_errors": 0}
+
+    def _shared(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    @staticmethod
+    def _key(sid: str) -> str:
+        return "chat-session:" + sid
+
+    def _parse(self, value) -> Optional[str]:
+        """The session id a chat asks for, NEW, or None (no session); ValueError if malformed."""
+        if value is None or value == "":
+            return None
+        if not isinstance(value, str) or (value != NEW and not _ID_RE.fullmatch(value)):
+            raise ValueError(f"'session' must be \"{NEW}\" or an id returned by an earlier reply")
+        return value
+
+    def _new(self) -> Session:
+        self._count("created")
+        return Session(secrets.token_urlsafe(16))
+
+    def _loaded(self, sid: str, raw) -> Session:
+        if raw is None:
+            self._count("unknown")
+            raise Unknown(f"session {sid} expired or never existed; send \"session\": \"{NEW}\" to start one")
+        self._count("resumed")
+        return Session.loads(sid, raw)
+
+    def open(self, value) -> Optional[Session]:
+        """The chat's session (new or resumed), or None when it names none; raises ValueError / Unknown."""
+        sid = self._parse(value)
+        if sid is None:
+            return None
+        if sid == NEW:
+            return self._new()
+        if self.local is not None:
+            return self._loaded(sid, self.local.get(sid))
+        try:
+            raw = self._shared().get(self._key(sid))
+        except Exception:
+            logger.warning("Session store get failed; continuing without context", exc_info=True)
+            self._count("store_errors")
+            return Session(sid)
+        return self._loaded(sid, raw)
+
+    async def aopen(self, value) -> Optional[Session]:
+        sid = self._parse(value)
+        if sid is None:
+            return None
+        if sid == NEW:
+            return self._new()
+        if self.local is not None:
+            return self._loaded(sid, self.local.get(sid))
+        try:
+            raw = await self._shared().aget(self._key(sid))
+        except Exception:
+            logger.warning("Session store get failed; continuing without context", exc_info=True)
+            self._count("store_errors")
+            return Session(sid)
+        return self._loaded(sid, raw)
+
+    def save(self, session: Session) -> None:
+        raw = session.dumps()
+        if self.local is not None:
+            self.local.set(session.id, raw)
+        else:
+            try:
+                self._shared().set(self._key(session.id), raw, timeout=self.ttl)
+            except Exception:
+                logger.warning("Session store set failed", exc_info=True)
+                self._count("store_errors")
+                return
+        self._count("saved")
+
+    async def asave(self, session: Session) -> None:
+        raw = session.dumps()
+        if self.local is not None:
+            self.local.set(session.id, raw)
+        else:
+            try:
+                await self._shared().aset(self._key(session.id), raw, timeout=self.ttl)
+            except Exception:
+                logger.warning("Session store set failed", exc_info=True)
+                self._count("store_errors")
+                return
+        self._count("saved")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            "store": self.alias or "local",
+            "ttl_s": self.ttl,
+            "max_tokens": settings.CHAT_SESSION_MAX_TOKENS,
+            "summary_tokens": settings.CHAT_SESSION_SUMMARY_TOKENS,
+            "local_sessions": len(self.local) if self.local is not None else None,
+            **counts,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def store() -> SessionStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore()
+    return _store
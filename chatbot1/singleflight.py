@@ -0,0 +1,102 @@
+# chatbot1/singleflight.py
+
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Awaitable, Callable
+
+
+class SingleFlight:
+    """
+    In-flight request coalescing.
+
+    The first caller for a key (the leader) runs the upstream call; callers
+    arriving while it is in flight wait on the same future and receive the
+    same result or exception. Flights are keyed by a concurrent.futures.Future,
+    so threaded (WSGI) and async (ASGI) callers can share one flight. A
+    follower that gives up after `timeout` gets TimeoutError; the flight itself
+    keeps running for everyone else.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counts = {"calls": 0, "leaders": 0, "coalesced": 0, "errors": 0, "timeouts": 0}
+
+    def _join(self, key: str):
+        with self._lock:
+            self._counts["calls"] += 1
+            fut = self._flights.get(key)
+            if fut is not None:
+                self._counts["coalesced"] += 1
+                return fut, False
+            fut = self._flights[key] = Future()
+            fut.set_running_or_notify_cancel()
+            self._counts["leaders"] += 1
+            return fut, True
+
+    def _land(self, key: str, fut: Future, result=None, error: BaseException = None) -> None:
+        with self._lock:
+            self._flights.pop(key, None)
+            if error is not None:
+                self._counts["errors"] += 1
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+
+    def _timed_out(self) -> TimeoutError:
+        with self._lock:
+            self._counts["timeouts"] += 1
+        return TimeoutError(f"coalesced request timed out after {self.timeout:g}s")
+
+    def do(self, key: str, fn: Callable[[], str]) -> str:
+        fut, leader = self._join(key)
+        if leader:
+            try:
+                result = fn()
+            except Exception as e:
+                self._land(key, fut, error=e)
+                raise
+            except BaseException as e:
+                # SystemExit (gunicorn worker timeout), KeyboardInterrupt: the flight must
+                # still land, but followers get an error rather than the leader's exit.
+                self._land(key, fut, error=RuntimeError(f"upstream call aborted ({type(e).__name__})"))
+                raise
+            self._land(key, fut, result=result)
+            return result
+        try:
+            return fut.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise self._timed_out() from None
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        fut, leader = self._join(key)
+        if leader:
+            # Run the upstream call as its own task so followers still get an
+            # answer if the leader's client disconnects.
+            task = asyncio.ensure_future(fn())
+
+            def _done(t: asyncio.Task) -> None:
+                if t.cancelled():
+                    self._land(key, fut, error=RuntimeError("upstream call cancelled"))
+                elif t.exception() is not None:
+                    self._land(key, fut, error=t.exception())
+                else:
+                    self._land(key, fut, result=t.result())
+
+            task.add_done_callback(_done)
+            return await asyncio.shield(task)
+        try:
+            # shield: one follower's cancellation must not cancel the shared future.
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), self.timeout)
+        except asyncio.TimeoutError:
+            raise self._timed_out() from None
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            counts["in_flight"] = len(self._flights)
+        counts["coalesce_ratio"] = round(counts["coalesced"] / counts["calls"], 4) if counts["calls"] else 0.0
+        return counts
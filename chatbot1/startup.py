@@ -0,0 +1,143 @@
+# chatbot1/startup.py
+# Per-process warm-up. Without it the first chat in each worker imports the
+# provider SDK, builds its client (or loads the HF model), the HTTP pool, the
+# Custos guardian and the admission/transcript singletons on the request path.
+# With CHAT_WARMUP on, gunicorn.conf.py splits this around the fork:
+#   - on_starting (master): `preimport` the provider SDKs only. Importing
+#     starts no threads and opens no sockets, so every worker inherits it for
+#     free (and shares the pages).
+#   - post_worker_init (each worker, app loaded, not yet accepting): `warm_up`
+#     builds the clients, pools and model, which must not cross a fork.
+
+import importlib
+import logging
+import os
+from time import perf_counter
+
+from .env import get_bool
+
+logger = logging.getLogger(__name__)
+
+
+# Import-heavy code each provider runs on its first chat. The OpenAI SDK imports
+# its HTTP transport when a client is built and its resource modules on first
+# use, so a throwaway client (never sent anything) is built and touched here.
+def _preimport_openai() -> None:
+    import openai
+    client = openai.OpenAI(api_key="preimport", base_url="http://127.0.0.1:9")
+    client.chat.completions
+    client.close()
+
+
+def _preimport_ollama() -> None:
+    import requests  # noqa: F401
+    import urllib3.util.retry  # noqa: F401
+
+
+def _preimport_hf() -> None:
+    import torch  # noqa: F401
+    from transformers import AutoModelForCausalLM, AutoTokenizer  # noqa: F401 -- lazy until touched
+
+
+def _preimport_async() -> None:
+    import httpx
+    httpx.AsyncClient()  # builds (and so imports) the async transport; no sockets until a request
+
+
+_PREIMPORTS = {"openai": _preimport_openai, "ollama": _preimport_ollama, "hf": _preimport_hf}
+
+
+def _providers() -> set:
+    # Read from the environment: the master runs this before Django is set up.
+    providers = {os.getenv("MODEL_PROVIDER", "openai").strip().lower()}
+    for item in os.getenv("MODEL_ROUTES", "").split(","):
+        if item.strip():
+            providers.add(item.split(":", 1)[0].strip().lower())
+    if "replay" in providers and os.getenv("REPLAY_MODE", "replay").strip().lower() == "record":
+        providers.add(os.getenv("REPLAY_UPSTREAM", "openai").strip().lower())
+    return providers
+
+
+def preimport() -> dict:
+    """Import what the configured providers need, leaving no threads or sockets behind; returns {name: seconds}."""
+    providers = _providers()
+    if os.getenv("HF_SERVER", "").strip():
+        providers.discard("hf")  # torch lives in the inference server; workers only talk to it
+    steps = {p: _PREIMPORTS[p] for p in sorted(providers) if p in _PREIMPORTS}
+    if get_bool("CHAT_ASYNC_VIEWS"):
+        steps["async"] = _preimport_async
+    timings = {}
+    for name, step in steps.items():
+        t0 = perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.warning("Pre-import for %s failed", name, exc_info=True)
+        timings[name] = perf_counter() - t0
+    return timings
+
+
+def _steps() -> tuple:
+    from . import admission, health, telemetry, transcripts, transport, views
+    return (
+        ("imports", preimport),  # no-op when the gunicorn master already did it
+        ("backend", views.get_bot),
+        ("http_pool", transport.session),
+        ("custos", telemetry.guardian),
+        ("health", health.monitor),
+        ("admission", admission.controller),
+        ("transcripts", transcripts.writer),
+    )
+
+
+def warm_up() -> dict:
+    """Build this process's chat singletons now; returns {step: seconds}. Failures are logged, not raised."""
+    timings = {}
+    for name, step in _steps():
+        t0 = perf_counter()
+        try:
+            step()
+        except Exception:
+            # The first chat retries the step and reports the error to its caller.
+            logger.warning("Warm-up step %s failed", name, exc_info=True)
+        timings[name] = perf_counter() - t0
+    logger.info("Warm-up done in %.2fs (%s)", sum(timings.values()),
+                ", ".join(f"{k} {v * 1000:.0f}ms" for k, v in timings.items()))
+    return timings
+
+
+def boot(warm: bool) -> tuple:
+    """
+    Set up Django, build the WSGI app (middleware chain) and import the URLconf,
+    then optionally warm up; returns (application, {phase: seconds}). Used by
+    `manage.py startup_profile` to time a server process's start.
+    """
+    phases = {}
+    t0 = perf_counter()
+    import django
+    django.setup()
+    phases["django_setup"] = perf_counter() - t0
+
+    from django.conf import settings
+    from django.urls import get_resolver
+    from django.utils.module_loading import import_string
+    t0 = perf_counter()
+    app = import_string(settings.WSGI_APPLICATION)
+    phases["application"] = perf_counter() - t0
+    t0 = perf_counter()
+    get_resolver().url_patterns  # imports the URLconf and every view module
+    phases["urlconf"] = perf_counter() - t0
+
+    if warm:
+        phases.update({f"warm_up.{k}": v for k, v in warm_up().items()})
+    return app, phases
+
+
+def warmup_enabled() -> bool:
+    return get_bool("CHAT_WARMUP")
+
+
+def warm_up_if_enabled() -> None:
+    from django.conf import settings
+    if getattr(settings, "CHAT_WARMUP", False):
+        warm_up()
@@ -0,0 +1,209 @@
+# chatbot1/stubserver.py
+# Local stand-in for upstream services (no network): an OpenAI-compatible
+# /v1/chat/completions, an Ollama-compatible /api/chat and the Custos
+# /simulator/ endpoints. Used by the bench_* commands.
+#
+# Timing model: every chat call waits `latency` seconds plus its prompt's
+# word pieces at `prefill_tokens_per_s` (0 = free) before the first token,
+# then emits the reply word by word at `tokens_per_s` (0 = all at once).
+# Custos beats (/simulator/logs/) wait `latency` too and are counted in `beats`.
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_REPLY = (
+    "Quick question: any dietary restrictions or cravings?\n"
+    "• ⚡ Quick: Scrambled eggs on toast with avocado.\n"
+    "• 💸 Budget: Beans and rice with frozen veggies.\n"
+    "• 🥗 Healthy: Greek yogurt with berries and nuts."
+)
+
+_TOKEN = re.compile(r"\S+\s*|\s+")
+
+
+def tokenize(text: str) -> list:
+    """Word-ish pieces that concatenate back to `text`."""
+    return _TOKEN.findall(text)
+
+
+def _prompt_tokens(body: dict) -> int:
+    return sum(len(tokenize(m.get("content") or "")) for m in body.get("messages", []))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real upstreams
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _send_json(self, obj, status: int = 200) -> None:
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _send_chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _pieces(self, max_tokens):
+        pieces = tokenize(self.server.reply)
+        if max_tokens:
+            pieces = pieces[:int(max_tokens)]
+        return pieces
+
+    def _pace(self) -> None:
+        if self.server.tokens_per_s > 0:
+            time.sleep(1.0 / self.server.tokens_per_s)
+
+    def _decode_time(self, n: int) -> float:
+        return n / self.server.tokens_per_s if self.server.tokens_per_s > 0 else 0.0
+
+    def _prefill_time(self, n: int) -> float:
+        return n / self.server.prefill_tokens_per_s if self.server.prefill_tokens_per_s > 0 else 0.0
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/simulator/ping":
+            return self._send_json({"ok": True})
+        if self.path.rstrip("/") == "/v1/models":
+            return self._send_json({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        if self.path.rstrip("/") == "/api/tags":
+            return self._send_json({"models": [{"name": "stub", "model": "stub"}]})
+        self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        body = self._read_json()
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        path = self.path.rstrip("/")
+        if path == "/simulator/logs":
+            time.sleep(server.latency)
+            with server.lock:
+                server.beats += 1
+            return self._send_json({"ok": True})
+        if path == "/api/chat" or path.endswith("/chat/completions"):
+            n = _prompt_tokens(body)
+            with server.lock:
+                server.last_prompt_tokens = n
+            time.sleep(server.latency + self._prefill_time(n))
+            return self._ollama(body) if path == "/api/chat" else self._openai(body)
+        self._send_json({"error": "not found"}, status=404)
+
+    # ----- Ollama -----
+    def _ollama(self, body: dict) -> None:
+        pieces = self._pieces((body.get("options") or {}).get("num_predict"))
+        if not body.get("stream"):
+            time.sleep(self._decode_time(len(pieces)))
+            return self._send_json({
+                "model": body.get("model", "stub"),
+                "message": {"role": "assistant", "content": "".join(pieces)},
+                "done": True,
+                "eval_count": len(pieces),
+            })
+        self._start_chunked("application/x-ndjson")
+        try:
+            for piece in pieces:
+                self._pace()
+                line = {"message": {"role": "assistant", "content": piece}, "done": False}
+                self._send_chunk(json.dumps(line).encode("utf-8") + b"\n")
+            done = {"message": {"role": "assistant", "content": ""}, "done": True, "eval_count": len(pieces)}
+            self._send_chunk(json.dumps(done).encode("utf-8") + b"\n")
+            self._end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client closed early (stop marker) — expected
+
+    # ----- OpenAI-compatible -----
+    def _openai(self, body: dict) -> None:
+        pieces = self._pieces(body.get("max_tokens"))
+        model = body.get("model", "stub")
+        prompt_tokens = _prompt_tokens(body)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces),
+                 "total_tokens": prompt_tokens + len(pieces)}
+        if not body.get("stream"):
+            time.sleep(self._decode_time(len(pieces)))
+            return self._send_json({
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        self._start_chunked("text/event-stream")
+        try:
+            for piece in pieces:
+                self._pace()
+                chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                self._send_chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+            final = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            self._send_chunk(b"data: " + json.dumps(final).encode("utf-8") + b"\n\n")
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """`with StubServer(latency=0.05, tokens_per_s=200) as s: ... s.url ...` — serves on a free local port."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 tokens_per_s: float = 0.0, reply: str = STUB_REPLY, prefill_tokens_per_s: float = 0.0):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.tokens_per_s = tokens_per_s
+        self.prefill_tokens_per_s = prefill_tokens_per_s
+        self.reply = reply
+        self.requests = 0
+        self.beats = 0
+        self.last_prompt_tokens = 0  # word pieces in the latest chat's messages
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
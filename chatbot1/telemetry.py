@@ -0,0 +1,285 @@
+# chatbot1/telemetry.py
+# Background shipper for Custos beats. The custos client starts a thread and
+# a blocking POST per beat; here beats go into a bounded per-process ring and
+# one daemon thread posts them in batches over the pooled keep-alive session.
+#
+# `guardian()` stands in for the SDK's guardian with the same public surface
+# (evaluate, start/stop_heartbeats), so nothing here depends on SDK internals;
+# only its public config, bootstrap and stop_heartbeats are used.
+
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CUSTOS_QUEUE_SIZE = int(os.getenv("CUSTOS_QUEUE_SIZE", "1000"))
+CUSTOS_BATCH_SIZE = int(os.getenv("CUSTOS_BATCH_SIZE", "50"))
+CUSTOS_FLUSH_INTERVAL = float(os.getenv("CUSTOS_FLUSH_INTERVAL", "1.0"))
+CUSTOS_SHIP_CONCURRENCY = int(os.getenv("CUSTOS_SHIP_CONCURRENCY", "4"))
+CUSTOS_SHUTDOWN_TIMEOUT = float(os.getenv("CUSTOS_SHUTDOWN_TIMEOUT", "5"))
+
+
+class TelemetryShipper:
+    """
+    Bounded, batched, fire-and-forget poster for `/simulator/logs/` beats.
+
+    `submit` never blocks: when the ring is full the oldest queued beat is
+    dropped (and counted). The worker wakes when `batch_size` beats are queued
+    or `interval` seconds have passed, whichever is first, and posts the batch
+    over at most `concurrency` keep-alive connections (the backend takes one
+    beat per POST). `close` drains what is left, bounded by `timeout`.
+    """
+
+    def __init__(self, url: str, api_key: str, capacity: int = CUSTOS_QUEUE_SIZE,
+                 batch_size: int = CUSTOS_BATCH_SIZE, interval: float = CUSTOS_FLUSH_INTERVAL,
+                 concurrency: int = CUSTOS_SHIP_CONCURRENCY, read_timeout: float = 8.0):
+        from concurrent.futures import ThreadPoolExecutor
+        self.url = url
+        self.capacity = max(1, capacity)
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.read_timeout = read_timeout
+        self._headers = {"Authorization": f"ApiKey {api_key}", "Content-Type": "application/json"}
+        self._ring = deque(maxlen=self.capacity)
+        self._cond = threading.Condition()
+        self._closing = False
+        self._urgent = False   # flush() asked for the ring to be drained now
+        self._busy = False     # a batch is being posted
+        self._counts = {"enqueued": 0, "sent": 0, "dropped": 0, "failed": 0, "short_circuited": 0, "batches": 0}
+        self._flush_ms = {"last": 0.0, "max": 0.0, "total": 0.0}
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="custos-post")
+        self._thread = threading.Thread(target=self._run, name="custos-shipper", daemon=True)
+        self._thread.start()
+
+    # ----- Producer side -----
+    def submit(self, payload: dict) -> None:
+        with self._cond:
+            if self._closing:
+                self._counts["dropped"] += 1
+                return
+            if len(self._ring) == self.capacity:
+                self._counts["dropped"] += 1  # deque(maxlen) evicts the oldest
+            self._ring.append(payload)
+            self._counts["enqueued"] += 1
+            if len(self._ring) >= self.batch_size:
+                self._cond.notify_all()
+
+    def evaluate(self, prompt: str, response: str, confidence: float = 1.0) -> dict:
+        """Drop-in for AutoLoggingGuardian.evaluate."""
+        self.submit({
+            "kind": "response",
+            "prompt": prompt or "",
+            "response": response or "",
+            "confidence": float(confidence),
+        })
+        return {"alignment_status": "queued"}
+
+    def flush(self, timeout: float = None) -> bool:
+        """Ship everything queued now; True once the ring is empty and no batch is in flight."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._urgent = True
+            self._cond.notify_all()
+            while self._ring or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = CUSTOS_SHUTDOWN_TIMEOUT) -> None:
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            left = len(self._ring)
+            self._ring.clear()
+            self._counts["dropped"] += left
+        if left:
+            logger.warning("Custos shipper closed with %d beats unsent", left)
+
+    def stats(self) -> dict:
+        with self._cond:
+            counts = dict(self._counts)
+            depth = len(self._ring)
+            flush = dict(self._flush_ms)
+        return {
+            **counts,
+            "queue_depth": depth,
+            "queue_capacity": self.capacity,
+            "batch_size": self.batch_size,
+            "flush_interval_s": self.interval,
+            "flush_ms_last": round(flush["last"], 2),
+            "flush_ms_max": round(flush["max"], 2),
+            "flush_ms_avg": round(flush["total"] / counts["batches"], 2) if counts["batches"] else 0.0,
+        }
+
+    # ----- Worker -----
+    def _take(self) -> list:
+        with self._cond:
+            deadline = time.monotonic() + self.interval
+            while len(self._ring) < self.batch_size and not (self._closing or self._urgent):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            n = min(len(self._ring), self.batch_size)
+            batch = [self._ring.popleft() for _ in range(n)]
+            if not self._ring:
+                self._urgent = False
+            self._busy = bool(batch)
+            if not batch:
+                self._cond.notify_all()
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take()
+            if batch:
+                self._ship(batch)
+            elif self._closing:
+                self._pool.shutdown(wait=False)
+                return
+
+    def _post(self, payload: dict) -> bool:
+        from . import transport
+        try:
+            r = transport.session().post(self.url, data=json.dumps(payload), headers=self._headers,
+                                         timeout=transport.timeout(read=self.read_timeout))
+            r.close()
+            return r.status_code < 400
+        except Exception:
+            return False
+
+    def _ship(self, batch: list) -> None:
+        from . import health
+        breaker = health.breaker("custos")
+        if not breaker.allow():
+            # Backend known to be down: drop the batch now instead of timing out on every beat.
+            with self._cond:
+                self._counts["failed"] += len(batch)
+                self._counts["short_circuited"] += len(batch)
+                self._busy = False
+                self._cond.notify_all()
+            return
+        t0 = time.perf_counter()
+        sent = sum(self._pool.map(self._post, batch))
+        failed = len(batch) - sent
+        if sent:
+            breaker.success()
+        else:
+            breaker.failure()
+        ms = (time.perf_counter() - t0) * 1000
+        with self._cond:
+            self._counts["sent"] += sent
+            self._counts["failed"] += failed
+            self._counts["batches"] += 1
+            self._flush_ms["last"] = ms
+            self._flush_ms["max"] = max(self._flush_ms["max"], ms)
+            self._flush_ms["total"] += ms
+            self._busy = False
+            self._cond.notify_all()
+        if failed:
+            logger.debug("Custos shipper: %d of %d beats failed", failed, len(batch))
+
+
+_lock = threading.Lock()
+_shipper = None
+_shipper_pid = None
+
+
+def shipper():
+    """This process's shipper, or None when CUSTOS_API_KEY is unset. Started lazily (fork-safe)."""
+    global _shipper, _shipper_pid
+    pid = os.getpid()
+    if _shipper is None or _shipper_pid != pid:
+        from custos.config import CustosConfig
+        cfg = CustosConfig()
+        if not cfg.api_key:
+            return None
+        with _lock:
+            if _shipper is None or _shipper_pid != pid:
+                _shipper = TelemetryShipper(
+                    f"{cfg.backend_url}/simulator/logs/", cfg.api_key, read_timeout=cfg.timeout_sec,
+                )
+                _shipper_pid = pid
+                atexit.register(_shipper.close)
+    return _shipper
+
+
+class Guardian:
+    """
+    The custos AutoLoggingGuardian's public interface (what views, diag and
+    CustosCaptureMiddleware call) with its beats queued on `ship` instead of
+    a thread and POST each. Heartbeats follow CUSTOS_HEARTBEATS and
+    CUSTOS_HEARTBEAT_INTERVAL like the SDK's.
+    """
+
+    def __init__(self, ship: TelemetryShipper, heartbeats: bool = True, interval: float = 2.0):
+        self.ship = ship
+        self.interval = interval if interval > 0 else 2.0
+        self._stop = threading.Event()
+        self._hb_thread = None
+        if heartbeats:
+            self.start_heartbeats()
+
+    def evaluate(self, prompt: str, response: str, confidence: float = 1.0) -> dict:
+        return self.ship.evaluate(prompt, response, confidence)
+
+    def start_heartbeats(self) -> None:
+        if self._hb_thread is None:
+            self._stop.clear()
+            self._hb_thread = threading.Thread(target=self._heartbeats, name="custos-heartbeats", daemon=True)
+            self._hb_thread.start()
+
+    def stop_heartbeats(self) -> None:
+        if self._hb_thread is not None:
+            self._stop.set()
+            self._hb_thread.join(timeout=2.0)
+            self._hb_thread = None
+
+    def _heartbeats(self) -> None:
+        # Slight jitter, as the SDK does, so the simulator's HRV line moves.
+        while not self._stop.is_set():
+            confidence = max(0.90, min(1.0, 0.98 + random.uniform(-0.02, 0.02)))
+            self.ship.submit({"kind": "heartbeat", "confidence": confidence})
+            self._stop.wait(self.interval)
+
+
+_guardian = None
+_guardian_pid = None
+
+
+def guardian():
+    """
+    This process's Guardian, or None when CUSTOS_API_KEY is unset. The SDK's
+    own singleton (created by its app config and middleware) has its
+    heartbeats stopped so they are not posted twice.
+    """
+    global _guardian, _guardian_pid
+    ship = shipper()
+    if ship is None:
+        return None
+    pid = os.getpid()
+    if _guardian is None or _guardian_pid != pid:
+        from custos.bootstrap import custos_bootstrap
+        from custos.config import CustosConfig
+        with _lock:
+            if _guardian is None or _guardian_pid != pid:
+                sdk = custos_bootstrap()
+                if sdk is not None:
+                    sdk.stop_heartbeats()
+                cfg = CustosConfig()
+                _guardian = Guardian(ship, cfg.heartbeat_enabled, cfg.heartbeat_interval_sec)
+                _guardian_pid = pid
+                atexit.register(_guardian.stop_heartbeats)
+    return _guardian
@@ -1,3 +1,1393 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import re
+import runpy
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import numpy
+from django.conf import settings
+from django.core.management import call_command
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from . import (admission, answer, budget, health, hf_cpu, hfpool, inference, metrics, replay, router, sessions,
+               telemetry, transcripts, views)
+from .batching import MicroBatcher
+from .management.commands import _bench
+from .models import ChatBackend, MyChatbot1, Transcript, _StreamCleaner, _clean
+from .singleflight import SingleFlight
+from .stubserver import STUB_REPLY, StubServer, tokenize
+
+MEAL = (
+    "Any diet I should know about?\n"
+    "• ⚡ Quick: Scrambled eggs on toast with avocado.\n"
+    "• 💸 Budget: Beans and rice with frozen veggies.\n"
+    "• 🥗 Healthy: Greek yogurt bowl with berries and oats.\n"
+    "Enjoy! Want a recipe for any of these?"
+)
+RECIPE = "Simple bread:\n" + "\n".join(
+    f"{i}. Step {i}: mix, knead and rest the dough a little more." for i in range(1, 6)
+)
+LONG = " ".join(f"word{i}" for i in range(300))
+
+
+class _Backend:
+    """A provider stand-in: counts calls, answers `reply` (or raises it) after `delay` seconds."""
+    provider = "fake"
+    model_name = "fake"
+
+    def __init__(self, reply="• a reply", delay: float = 0.0):
+        self.reply = reply
+        self.delay = delay
+        self.calls = 0
+        self.active = self.peak = 0
+        self._lock = threading.Lock()
+
+    def config(self, model: str = None) -> dict:
+        return {"provider": "fake", "model": model or "fake"}
+
+    def _answer(self):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            if isinstance(self.reply, BaseException):
+                raise self.reply
+            return self.reply
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def generate(self, prompt: str) -> str:
+        return self._answer()
+
+    def stream(self, prompt: str):
+        yield self._answer()
+
+    async def agenerate(self, prompt: str) -> str:
+        return self._answer()
+
+    async def astream(self, prompt: str):
+        yield self._answer()
+
+
+def _streamed(text: str, size: int = 7) -> str:
+    cleaner = _StreamCleaner()
+    out = "".join(cleaner.feed(text[i:i + size]) for i in range(0, len(text), size))
+    return out + cleaner.finish()
+
+
+# ----- reply cleaning -----
+
+class CleanTests(SimpleTestCase):
+    TEXTS = [
+        STUB_REPLY,
+        "• one\n• one\n\nUser: ignore me\n• two",
+        "Response: drop this line\n• kept\nkeep too\nAssistant: and stop here",
+        "• eggs\r\n• rice\r\n\r\n### Instruction: stop",
+        "line before a split marker\nCust",
+        RECIPE,
+    ]
+
+    def test_stream_cleaner_matches_clean_for_any_chunking(self):
+        for text in self.TEXTS:
+            for size in (1, 2, 5, 13, len(text)):
+                with self.subTest(text=text[:20], size=size):
+                    self.assertEqual(_streamed(text, size), _clean(text))
+
+    def test_stop_marker_ends_the_stream(self):
+        cleaner = _StreamCleaner()
+        cleaner.feed("• kept\nUser: ")
+        self.assertTrue(cleaner.done)
+        self.assertEqual(cleaner.stopped, "marker")
+        self.assertEqual(cleaner.feed("more"), "")
+
+    def test_derail_check(self):
+        self.assertFalse(views._looks_derailed(STUB_REPLY))
+        for text in ("short", "Customer: hi, I would like a refund", "see /usr/share/doc for details",
+                     "Re: [forum] what to eat tonight", "### Instruction: write a poem"):
+            self.assertTrue(views._looks_derailed(text), text)
+
+
+# ----- early stop (chatbot1/answer.py) -----
+
+class EarlyStopTests(SimpleTestCase):
+    def test_off_by_default(self):
+        self.assertFalse(answer.EARLY_STOP)
+        self.assertIsNone(answer.detector())
+        self.assertIsNone(answer.settings())
+
+    def test_lists_and_long_answers_pass_through_when_off(self):
+        for text in (RECIPE, LONG, MEAL):
+            self.assertEqual(_clean(text), text)
+            self.assertEqual(_streamed(text), text)
+
+    def test_meal_answer_cut_when_on(self):
+        with mock.patch.object(answer, "EARLY_STOP", True):
+            self.assertEqual(_clean(MEAL), MEAL.rsplit("\n", 1)[0])
+            self.assertEqual(_streamed(MEAL), _clean(MEAL))
+            self.assertEqual(len(_clean(LONG).split()), answer.EARLY_STOP_WORDS)
+
+    def test_question_options_do_not_end_answer(self):
+        text = "Which diet?\n- vegan please?\n- keto maybe?\n- none at all?\n"
+        self.assertEqual(answer.Detector().scan(text), -1)
+
+
+# ----- response cache (MyChatbot1) -----
+
+@override_settings(CHAT_CACHE_ALIAS="")
+class CacheKeyTests(SimpleTestCase):
+    def setUp(self):
+        self.bot = MyChatbot1(_Backend())
+        self.bot.flights = None
+
+    def key(self, prompt, model=None):
+        return self.bot._cache_ctx(prompt, model)[0]
+
+    def test_key_includes_model(self):
+        self.assertEqual(self.key("hello"), self.key("hello"))
+        self.assertNotEqual(self.key("hello"), self.key("hello", "other"))
+        self.assertEqual(self.key("hello", "fake"), self.key("hello"))
+
+    def test_key_includes_history(self):
+        first = [{"role": "user", "content": "I'm vegan"}, {"role": "assistant", "content": "Noted."}]
+        other = [{"role": "user", "content": "I eat meat"}, {"role": "assistant", "content": "Noted."}]
+        plain = self.key("what's for dinner?")
+        self.assertNotEqual(plain, self.key(sessions.Turn("what's for dinner?", first)))
+        self.assertNotEqual(self.key(sessions.Turn("what's for dinner?", first)),
+                            self.key(sessions.Turn("what's for dinner?", other)))
+        self.assertEqual(self.key(sessions.Turn("what's for dinner?", first)),
+                         self.key(sessions.Turn("what's for dinner?", list(first))))
+        self.assertEqual(plain, self.key(sessions.Turn("what's for dinner?")))
+
+    def test_repeat_prompt_is_served_from_cache(self):
+        self.assertEqual(self.bot.generate("hello"), self.bot.generate("hello"))
+        self.assertEqual(self.bot.backend.calls, 1)
+        self.bot.generate("hello", use_cache=False)
+        self.assertEqual(self.bot.backend.calls, 2)
+
+
+class _ModelBackend(_Backend):
+    """A model pool stand-in: any model can be asked for per request."""
+
+    def check(self, model: str) -> None:
+        pass
+
+    def generate(self, prompt: str, model: str = None) -> str:
+        return self._answer()
+
+
+@override_settings(CHAT_CACHE_ALIAS="")
+class PerModelCacheTests(SimpleTestCase):
+    def test_per_model_replies_are_cached_apart(self):
+        bot = MyChatbot1(_ModelBackend())
+        bot.flights = None
+        bot.generate("hello")
+        bot.generate("hello")
+        bot.generate("hello", model="other")
+        bot.generate("hello", model="other")
+        self.assertEqual(bot.backend.calls, 2)
+        bot.check_model("other")
+        with self.assertRaises(ValueError):
+            MyChatbot1(_Backend()).check_model("other")
+
+
+_MB = 2**20
+
+
+class _Loaded:
+    """A loaded HF model stand-in for ModelPool: `_hf_model` is its name, sized by `_PoolTests.sizes`."""
+    _hf_batcher = None
+
+    def __init__(self, provider: str, name: str):
+        self.model_name = self._hf_model = name
+        self.closed = False
+
+    def config(self) -> dict:
+        return {"provider": "hf", "model": self.model_name}
+
+    def generate(self, prompt: str) -> str:
+        return self.model_name
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class ModelPoolTests(SimpleTestCase):
+    sizes = {"a": 40 * _MB, "b": 40 * _MB, "c": 40 * _MB}
+
+    def setUp(self):
+        for target, attr, value in (
+            ("chatbot1.models.ChatBackend", None, _Loaded),
+            ("chatbot1.hfpool._estimate_bytes", None, lambda name: self.sizes[name]),
+            ("chatbot1.hf_cpu.weight_bytes", None, lambda model: self.sizes[model]),
+            ("chatbot1.hfpool._give_back", None, lambda: None),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def pool(self, **kwargs) -> hfpool.ModelPool:
+        return hfpool.ModelPool("a", ("b", "c"), **{"budget_mb": 0, "max_models": 0, **kwargs})
+
+    def loaded(self, pool) -> list:
+        return [m["model"] for m in pool.stats()["models"]]  # most recently used first
+
+    def test_max_models_evicts_the_least_recently_used(self):
+        pool = self.pool(max_models=2)
+        self.assertEqual(pool.generate("hi", model="b"), "b")
+        pool.generate("hi", model="a")  # b is now the LRU
+        first_b = pool._entries["b"].backend
+        self.assertEqual(pool.generate("hi", model="c"), "c")
+        self.assertEqual(self.loaded(pool), ["c", "a"])
+        self.assertTrue(first_b.closed)
+        self.assertEqual(pool.stats()["evictions"], 1)
+        with self.assertRaises(ValueError):
+            pool.generate("hi", model="d")
+
+    def test_leased_models_are_never_evicted(self):
+        pool = self.pool(max_models=2)
+        with pool.lease("a"):  # the LRU, but in use
+            pool.generate("hi", model="b")
+            pool.generate("hi", model="c")
+            self.assertEqual(self.loaded(pool), ["c", "a"])
+            with pool.lease("b"):  # c is the idle one: it makes room
+                self.assertEqual(sorted(self.loaded(pool)), ["a", "b"])
+                with pool.lease("c"):  # nothing idle: runs over the cap while all three are in use
+                    self.assertEqual(sorted(self.loaded(pool)), ["a", "b", "c"])
+                    self.assertEqual(pool.stats()["over_budget"], 1)
+                self.assertEqual(sorted(self.loaded(pool)), ["a", "b"])  # back under once c is released
+
+    def test_byte_budget(self):
+        pool = self.pool(budget_mb=100)
+        pool.generate("hi", model="b")
+        self.assertEqual(pool.stats()["resident_mb"], 80)
+        pool.generate("hi", model="c")  # 120 MB would not fit: a (the LRU) goes
+        self.assertEqual(self.loaded(pool), ["c", "b"])
+        self.assertEqual(pool.stats()["resident_mb"], 80)
+        self.assertEqual(pool.stats()["peak_mb"], 80)
+
+
+@override_settings(CHAT_CACHE_ALIAS="")
+class AsyncSemanticCacheTests(SimpleTestCase):
+    def test_semantic_tier_runs_off_the_event_loop(self):
+        bot = MyChatbot1(_Backend())
+        bot.flights = None
+        bot.cache.semantic = object()  # only checked for None; the calls below are patched
+        threads = []
+
+        def record(*args):
+            threads.append(threading.get_ident())
+
+        async def chat():
+            with mock.patch.object(bot.cache, "get_similar", side_effect=lambda *a: record() or None), \
+                    mock.patch.object(bot.cache, "set_similar", side_effect=record):
+                await bot.agenerate("hello")
+            return threading.get_ident()
+
+        loop_thread = asyncio.run(chat())
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(loop_thread, threads)
+
+    def test_reply_cut_by_budget_mid_call_is_not_cached(self):
+        for sync in (True, False):
+            bot = MyChatbot1(_Backend())
+            bot.flights = None
+            # Full cap when the call starts, reduced by the time it returns.
+            with mock.patch.object(budget, "reduced", side_effect=[False, True, False, False]):
+                if sync:
+                    bot.generate("hello")
+                    bot.generate("hello")
+                else:
+                    asyncio.run(bot.agenerate("hello"))
+                    asyncio.run(bot.agenerate("hello"))
+            self.assertEqual(bot.backend.calls, 2)
+
+
+# ----- admission control -----
+
+class AdmissionTests(SimpleTestCase):
+    def test_widen_takes_only_free_slots(self):
+        ctl = admission.AdmissionController("fake", limit=3, queue_size=4, max_wait=1)
+        other = ctl.admit()
+        with mock.patch.object(admission, "controller", return_value=ctl):
+            slots = admission.widen(ctl.admit(), 8)
+        self.assertEqual(len(slots), 2)
+        self.assertEqual(ctl.stats()["active"], 3)
+        slots.release()
+        other.release()
+        self.assertEqual(ctl.stats()["active"], 0)
+
+    def test_no_wait_admit_sheds_busy(self):
+        ctl = admission.AdmissionController("fake", limit=1, queue_size=4, max_wait=1)
+        slot = ctl.admit()
+        with self.assertRaises(admission.Rejected) as cm:
+            ctl.admit(wait=False)
+        self.assertEqual((cm.exception.status, cm.exception.reason), (429, "busy"))
+        slot.release()
+        ctl.admit(wait=False).release()
+    def test_queued_chat_times_out_with_503(self):
+        ctl = admission.AdmissionController("fake", limit=1, queue_size=1, max_wait=0.05)
+        slot = ctl.admit()
+        with self.assertRaises(admission.Rejected) as cm:
+            ctl.admit()
+        self.assertEqual((cm.exception.status, cm.exception.reason), (503, "timeout"))
+        self.assertEqual(ctl.stats()["shed_timeout"], 1)
+        slot.release()
+
+    def test_full_queue_sheds_429(self):
+        ctl = admission.AdmissionController("fake", limit=1, queue_size=0, max_wait=1)
+        slot = ctl.admit()
+        with self.assertRaises(admission.Rejected) as cm:
+            ctl.admit()
+        self.assertEqual((cm.exception.status, cm.exception.reason), (429, "queue_full"))
+        slot.release()
+
+    def test_released_slot_goes_to_the_oldest_waiter(self):
+        ctl = admission.AdmissionController("fake", limit=1, queue_size=4, max_wait=5)
+        slot = ctl.admit()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(ctl.admit()))
+        waiter.start()
+        time.sleep(0.05)
+        slot.release()
+        waiter.join(5)
+        self.assertEqual(len(got), 1)
+        self.assertEqual(ctl.stats()["active"], 1)
+        got[0].release()
+
+    def test_chat_view_returns_503_when_admission_times_out(self):
+        ctl = admission.AdmissionController("fake", limit=1, queue_size=1, max_wait=0.01)
+        slot = ctl.admit()
+        with mock.patch.object(admission, "controller", return_value=ctl):
+            r = self.client.post("/chatbot1/chat/", {"prompt": "hi"}, content_type="application/json")
+        slot.release()
+        self.assertEqual(r.status_code, 503)
+        self.assertEqual(r.json()["detail"], "timeout")
+        self.assertIn("Retry-After", r)
+
+
+
+@override_settings(CHAT_TRANSCRIPTS=False, CHAT_CACHE_ALIAS="")
+class BatchAdmissionTests(SimpleTestCase):
+    def setUp(self):
+        self.backend = _Backend(delay=0.05)
+        bot = MyChatbot1(self.backend)
+        bot.flights = None
+        patcher = mock.patch.object(views, "_bot", bot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ctl = admission.AdmissionController("fake", limit=2, queue_size=4, max_wait=1)
+        patcher = mock.patch.object(admission, "controller", return_value=self.ctl)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _batch(self, n: int):
+        body = {"prompts": [f"prompt {i}" for i in range(n)], "concurrency": 8, "use_cache": False}
+        return self.client.post("/chatbot1/chat/batch/", json.dumps(body), content_type="application/json")
+
+    def test_batch_holds_a_slot_per_prompt_in_flight(self):
+        r = self._batch(6)
+        lines = [json.loads(ln) for ln in b"".join(r.streaming_content).splitlines()]
+        self.assertEqual(lines[-1], {"done": True, "count": 6, "errors": 0})
+        self.assertEqual(self.backend.peak, 2)
+        self.assertEqual(self.ctl.stats()["active"], 0)
+
+    def test_running_prompts_keep_their_slots_after_a_disconnect(self):
+        self.backend.delay = 0.2
+        r = self._batch(6)
+        next(iter(r.streaming_content))
+        r.close()
+        self.assertGreater(self.backend.active, 0)
+        self.assertEqual(self.ctl.stats()["active"], self.backend.active)
+        deadline = time.monotonic() + 5
+        while self.ctl.stats()["active"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.ctl.stats()["active"], 0)
+        self.assertLess(self.backend.calls, 6)  # the prompts not yet started were dropped
+
+    def test_sync_batch_does_not_queue(self):
+        slots = [self.ctl.admit(), self.ctl.admit()]
+        r = self._batch(2)
+        self.assertEqual(r.status_code, 429)
+        self.assertIn("Retry-After", r)
+        for slot in slots:
+            slot.release()
+
+
+# ----- singleflight -----
+
+class SingleFlightTests(SimpleTestCase):
+    def test_leader_error_reaches_followers(self):
+        flights = SingleFlight(timeout=5)
+        started, release = threading.Event(), threading.Event()
+        errors = []
+
+        def leader():
+            started.set()
+            release.wait(5)
+            raise ValueError("upstream 500")
+
+        def follow():
+            try:
+                flights.do("k", lambda: "unused")
+            except ValueError as e:
+                errors.append(e)
+
+        t = threading.Thread(target=lambda: self.assertRaises(ValueError, flights.do, "k", leader))
+        t.start()
+        started.wait(5)
+        follower = threading.Thread(target=follow)
+        follower.start()
+        time.sleep(0.05)
+        release.set()
+        t.join(5)
+        follower.join(5)
+        self.assertEqual([str(e) for e in errors], ["upstream 500"])
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+    def test_base_exception_still_lands_the_flight(self):
+        flights = SingleFlight(timeout=5)
+
+        def killed():
+            raise SystemExit(1)
+
+        with self.assertRaises(SystemExit):
+            flights.do("k", killed)
+        self.assertEqual(flights.stats()["in_flight"], 0)
+        self.assertEqual(flights.do("k", lambda: "fresh"), "fresh")
+
+    def test_async_followers_share_the_leader_result(self):
+        flights = SingleFlight(timeout=5)
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return "shared"
+
+        async def run():
+            return await asyncio.gather(*(flights.ado("k", call) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(run()), ["shared"] * 5)
+        self.assertEqual(len(calls), 1)
+
+
+# ----- multi-provider router -----
+
+class _Upstream:
+    """A routed backend: answers its name after `delay` seconds (or raises `error`), recording usage like a provider."""
+    breaker = None
+
+    def __init__(self, name: str, delay: float = 0.0, error: Exception = None):
+        self.name, self.delay, self.error = name, delay, error
+        self.calls = 0
+
+    def config(self) -> dict:
+        return {"provider": self.name}
+
+    def _usage(self, seconds: float) -> None:
+        metrics.serving(self.name, self.name)
+        metrics.tokens(self.name, self.name, len(self.name), seconds, prompt=3)
+        metrics.observe("provider", seconds, self.name, self.name)
+
+    def generate(self, prompt: str) -> str:
+        self.calls += 1
+        metrics.serving(self.name, self.name)  # before the call, like metrics.provider_call
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        self._usage(self.delay)
+        return self.name
+
+    async def agenerate(self, prompt: str) -> str:
+        self.calls += 1
+        metrics.serving(self.name, self.name)
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        self._usage(self.delay)
+        return self.name
+
+
+@mock.patch.multiple(router, ROUTER_EXPLORE=0.0, ROUTER_HEDGE_MIN_MS=10.0, ROUTER_HEDGE_DEFAULT_MS=5000.0)
+class RouterTests(SimpleTestCase):
+    def routed(self, *backends) -> router.Router:
+        return router.Router([router.Route(b.name, b, i) for i, b in enumerate(backends)])
+
+    def test_ranking(self):
+        r = self.routed(_Upstream("a"), _Upstream("b"), _Upstream("c"))
+        self.assertEqual([x.name for x in r._ranked()], ["a", "b", "c"])  # unseen: configured order
+        a, b, c = r.routes
+        for _ in range(10):
+            a.record(0.5, True)
+            b.record(0.1, True)
+            c.record(0.1, True)
+        c.record(0.1, False)
+        self.assertEqual([x.name for x in r._ranked()], ["b", "c", "a"])
+        b.backend.breaker = mock.Mock(state=health.OPEN)
+        self.assertEqual([x.name for x in r._ranked()], ["c", "a", "b"])
+
+    def test_hedge_deadline_is_the_rolling_p95(self):
+        route = router.Route("a", _Upstream("a"), 0)
+        self.assertEqual(route.hedge_delay(), 5.0)
+        for ms in range(1, 101):
+            route.record(ms / 1000, True)
+        self.assertAlmostEqual(route.hedge_delay(), 0.096)
+        route = router.Route("b", _Upstream("b"), 0)
+        route.record(0.001, True)
+        self.assertEqual(route.hedge_delay(), 0.01)  # ROUTER_HEDGE_MIN_MS floor
+
+    def test_slow_route_is_hedged(self):
+        r = self.routed(_Upstream("slow", delay=0.3), _Upstream("fast"))
+        r.routes[0].record(0.02, True)
+        self.assertEqual(r.generate("hi"), "fast")
+        self.assertEqual((r.stats()["hedges"], r.routes[1].wins), (1, 1))
+
+    def test_hedge_budget(self):
+        r = self.routed(_Upstream("a"))
+        with mock.patch.object(router, "ROUTER_HEDGE_BUDGET", 0.1):
+            self.assertTrue(r._take_hedge())  # one hedge is always allowed
+            self.assertFalse(r._take_hedge())
+            for _ in range(10):
+                r._start()
+            self.assertTrue(r._take_hedge())
+            self.assertFalse(r._take_hedge())
+
+    def test_failover_down_the_ranking(self):
+        for sync in (True, False):
+            r = self.routed(_Upstream("a", error=RuntimeError("boom")), _Upstream("b"))
+            self.assertEqual(r.generate("hi") if sync else asyncio.run(r.agenerate("hi")), "b")
+            self.assertEqual(r.stats()["failovers"], 1)
+            # The failing route now ranks last.
+            self.assertEqual(r.routes[0].error_rate(), 1.0)
+            self.assertEqual([x.name for x in r._ranked()], ["b", "a"])
+
+    def test_every_route_failing(self):
+        r = self.routed(_Upstream("a", error=RuntimeError("boom")), _Upstream("b", error=ValueError("bad")))
+        with self.assertRaisesRegex(RuntimeError, "all backends failed: a: boom; b: bad"):
+            r.generate("hi")
+        r = self.routed(_Upstream("a", error=health.Unavailable("a", 7)), _Upstream("b", error=health.Unavailable("b", 3)))
+        with self.assertRaises(health.Unavailable) as cm:
+            r.generate("hi")
+        self.assertEqual(cm.exception.retry_after, 3)
+
+    def test_winner_usage_and_timings_reach_the_caller(self):
+        for sync in (True, False):
+            r = self.routed(_Upstream("slow", delay=0.15), _Upstream("fast", delay=0.01))
+            r.routes[0].record(0.02, True)
+            usage, usage_token = metrics.begin_usage()
+            timings, timings_token = metrics.begin_request()
+            try:
+                text = r.generate("hi") if sync else asyncio.run(r.agenerate("hi"))
+                time.sleep(0.2)  # the sync loser finishes after the race
+            finally:
+                metrics.end_request(timings_token)
+                metrics.end_usage(usage_token)
+            self.assertEqual(text, "fast")
+            self.assertEqual(usage, {"provider": "fast", "model": "fast", "prompt_tokens": 3, "completion_tokens": 4})
+            self.assertEqual([name for name, _ in timings], ["provider"])
+
+
+# ----- circuit breakers -----
+
+def _http_error(status: int):
+    import requests
+    resp = requests.Response()
+    resp.status_code = status
+    return requests.HTTPError(f"{status} error", response=resp)
+
+
+def _wrapped(error: Exception) -> RuntimeError:
+    """What the OpenAI-compatible backend raises: the SDK error re-raised as RuntimeError."""
+    try:
+        try:
+            raise error
+        except Exception as e:
+            raise RuntimeError(f"openai_error: {e}")
+    except RuntimeError as wrapped:
+        return wrapped
+
+
+class BreakerTests(SimpleTestCase):
+    def _fail(self, b, error: Exception) -> None:
+        with self.assertRaises(type(error)):
+            with health.guard(b):
+                raise error
+
+    def test_opens_half_opens_and_closes(self):
+        b = health.CircuitBreaker("test-upstream", failures=2, cooldown=0.05)
+        self._fail(b, ConnectionError("refused"))
+        self.assertEqual(b.state, health.CLOSED)
+        self._fail(b, _wrapped(_http_error(503)))
+        self.assertEqual(b.state, health.OPEN)
+        with self.assertRaises(health.Unavailable):
+            with health.guard(b):
+                pass
+        time.sleep(0.06)
+        self.assertTrue(b.allow())          # the one trial call
+        self.assertEqual(b.state, health.HALF_OPEN)
+        self.assertFalse(b.allow())         # others still refused
+        b.success()
+        self.assertEqual(b.state, health.CLOSED)
+
+    def test_failed_trial_reopens(self):
+        b = health.CircuitBreaker("test-upstream", failures=1, cooldown=0.05)
+        self._fail(b, TimeoutError("read timed out"))
+        time.sleep(0.06)
+        self._fail(b, _http_error(429))
+        self.assertEqual(b.state, health.OPEN)
+
+    def test_client_errors_do_not_count(self):
+        b = health.CircuitBreaker("test-upstream", failures=2, cooldown=30)
+        for status in (400, 401, 404, 413, 422):
+            self._fail(b, _http_error(status))
+            self._fail(b, _wrapped(_http_error(status)))
+        self.assertEqual(b.state, health.CLOSED)
+
+        def chunks():
+            yield "a"
+            raise _http_error(400)
+
+        for _ in range(3):
+            with self.assertRaises(Exception):
+                list(health.guard_stream(b, chunks()))
+        self.assertEqual(b.state, health.CLOSED)
+
+
+# ----- Custos beats -----
+
+class _Ship:
+    def __init__(self):
+        self.beats = []
+
+    evaluate = telemetry.TelemetryShipper.evaluate  # builds the payload, then calls submit below
+
+    def submit(self, payload: dict) -> None:
+        self.beats.append(payload)
+
+
+class CustosTests(SimpleTestCase):
+    def test_sdk_surface_we_rely_on(self):
+        # telemetry.Guardian uses only these; a custos-labs upgrade that drops one must fail here.
+        from custos.bootstrap import custos_bootstrap
+        from custos.client import AutoLoggingGuardian
+        from custos.config import CustosConfig
+        self.assertTrue(callable(custos_bootstrap))
+        self.assertTrue(callable(AutoLoggingGuardian.stop_heartbeats))
+        cfg = CustosConfig()
+        for name in ("api_key", "backend_url", "timeout_sec", "heartbeat_enabled", "heartbeat_interval_sec"):
+            self.assertTrue(hasattr(cfg, name), name)
+
+    def test_capture_middleware_posts_through_the_shipper(self):
+        from bot_testing.middleware import TimedCustosCaptureMiddleware
+        ship = _Ship()
+        with mock.patch.object(telemetry, "guardian", return_value=telemetry.Guardian(ship, heartbeats=False)):
+            mw = TimedCustosCaptureMiddleware(lambda r: JsonResponse({"response": "eggs"}))
+        request = RequestFactory().post("/chatbot1/chat/", {"prompt": "hungry"}, content_type="application/json")
+        mw(request)
+        self.assertEqual(ship.beats, [{"kind": "response", "prompt": "hungry", "response": "eggs", "confidence": 1.0}])
+
+    def test_guardian_and_shipper_evaluate_alike(self):
+        ship = _Ship()
+        guardian = telemetry.Guardian(ship, heartbeats=False)
+        self.assertEqual(guardian.evaluate("p", "r", 0.5), ship.evaluate("p", "r", 0.5))
+        self.assertEqual(guardian.evaluate("p", "r", 0.5), {"alignment_status": "queued"})
+        self.assertEqual(ship.beats[0], ship.beats[1])
+
+    def test_guardian_replaces_sdk_heartbeats(self):
+        ship, sdk = _Ship(), mock.Mock()
+        with mock.patch.object(telemetry, "shipper", return_value=ship), \
+                mock.patch("custos.bootstrap.custos_bootstrap", return_value=sdk), \
+                mock.patch.object(telemetry, "_guardian", None), \
+                mock.patch("custos.config.CustosConfig", return_value=mock.Mock(
+                    heartbeat_enabled=True, heartbeat_interval_sec=0.01)):
+            g = telemetry.guardian()
+            try:
+                sdk.stop_heartbeats.assert_called_once_with()
+                time.sleep(0.05)
+            finally:
+                g.stop_heartbeats()
+        self.assertGreater(len(ship.beats), 1)
+        self.assertEqual({b["kind"] for b in ship.beats}, {"heartbeat"})
+
+
+# ----- HF CPU tuning -----
+
+class ThreadSizingTests(SimpleTestCase):
+    def threads(self, env: dict, cores=8, pinned=0) -> int:
+        with mock.patch.dict(os.environ, env), mock.patch.object(hf_cpu.os, "cpu_count", return_value=cores), \
+                mock.patch.object(hf_cpu, "HF_THREADS", pinned):
+            for name in ("GUNICORN_WORKERS", "WEB_CONCURRENCY"):
+                if name not in env:
+                    os.environ.pop(name, None)
+            return hf_cpu.intra_op_threads()
+
+    def test_cores_are_split_between_workers(self):
+        self.assertEqual(self.threads({}), 8)
+        self.assertEqual(self.threads({"WEB_CONCURRENCY": "2"}), 4)
+        self.assertEqual(self.threads({"GUNICORN_WORKERS": "3", "WEB_CONCURRENCY": "2"}), 2)  # gunicorn's count wins
+        self.assertEqual(self.threads({"GUNICORN_WORKERS": "16"}), 1)
+        self.assertEqual(self.threads({"GUNICORN_WORKERS": "0"}, cores=None), 1)
+        self.assertEqual(self.threads({"GUNICORN_WORKERS": "4"}, pinned=6), 6)
+
+    def test_gunicorn_exports_its_worker_count(self):
+        conf = runpy.run_path(os.path.join(settings.BASE_DIR, "gunicorn.conf.py"))
+        server = mock.Mock()
+        server.cfg.workers = 4
+        with mock.patch.dict(os.environ, {"WEB_CONCURRENCY": "2"}), mock.patch("dotenv.load_dotenv"), \
+                mock.patch("chatbot1.startup.warmup_enabled", return_value=False):
+            conf["on_starting"](server)
+            self.assertEqual(os.environ["GUNICORN_WORKERS"], "4")
+            self.assertEqual(hf_cpu.workers(), 4)
+
+
+# ----- HF system-prompt prefix cache -----
+
+class PrefixCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.bot = ChatBackend.__new__(ChatBackend)  # no model: the prefix build itself is faked
+        self.bot._hf_model_name = "tiny"
+        self.bot._hf_prefix = None
+        self.bot._hf_prefix_lock = threading.Lock()
+        self.kv = [["k", "v"]]
+        self.bot._build_hf_prefix = mock.Mock(return_value=([5, 6, 7], self.kv))
+
+    def prefill(self, ids: list) -> dict:
+        return self.bot._hf_prefill({"input_ids": numpy.array([ids])})
+
+    def test_prefix_is_built_once_per_model_and_system_prompt(self):
+        build = self.bot._build_hf_prefix
+        self.assertEqual(self.bot._hf_prefix_cache(), ([5, 6, 7], self.kv))
+        self.bot._hf_prefix_cache()
+        self.assertEqual(build.call_count, 1)
+        with mock.patch("chatbot1.models.SYSTEM_PROMPT", "Be terse."):
+            self.bot._hf_prefix_cache()
+            self.bot._hf_prefix_cache()
+        self.assertEqual(build.call_count, 2)
+        self.bot._hf_prefix_cache()  # back to the original prompt: rebuilt, only the latest key is kept
+        self.bot._hf_model_name = "other"
+        self.bot._hf_prefix_cache()
+        self.assertEqual(build.call_count, 4)
+
+    def test_prefix_too_short_is_remembered_as_none(self):
+        self.bot._build_hf_prefix.return_value = (None, None)
+        self.assertIsNone(self.bot._hf_prefix_cache())
+        self.assertEqual(self.prefill([5, 6, 7, 8]), {})
+        self.assertEqual(self.bot._build_hf_prefix.call_count, 1)
+
+    def test_prefill_only_when_the_prompt_starts_with_the_prefix(self):
+        kwargs = self.prefill([5, 6, 7, 8, 9])
+        self.assertEqual(kwargs["past_key_values"], self.kv)
+        self.assertIsNot(kwargs["past_key_values"], self.kv)  # generate() extends its own copy
+        self.assertIsNot(kwargs["past_key_values"][0], self.kv[0])
+        self.assertEqual(self.prefill([5, 6, 8, 9]), {})
+        self.assertEqual(self.prefill([5, 6]), {})
+        with mock.patch("chatbot1.models.HF_PREFIX_CACHE", False):
+            self.assertEqual(self.prefill([5, 6, 7, 8, 9]), {})
+
+
+# ----- HF micro-batching -----
+
+class MicroBatcherTests(SimpleTestCase):
+    def test_usage_is_recorded_in_each_callers_context(self):
+        def run_batch(prompts, contexts):
+            for prompt, ctx in zip(prompts, contexts):
+                ctx.run(metrics.note_usage, prompt_tokens=len(prompt), completion_tokens=1)
+            return [p.upper() for p in prompts]
+
+        batcher = MicroBatcher(run_batch, window=0.05, max_batch=8)
+        self.addCleanup(batcher.close)
+        usages = {}
+
+        def chat(prompt: str) -> None:
+            usage, token = metrics.begin_usage()
+            try:
+                self.assertEqual(batcher.submit(prompt), prompt.upper())
+            finally:
+                metrics.end_usage(token)
+            usages[prompt] = usage
+
+        threads = [threading.Thread(target=chat, args=("x" * n,)) for n in (1, 2, 3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        self.assertEqual({p: u["prompt_tokens"] for p, u in usages.items()}, {"x": 1, "xx": 2, "xxx": 3})
+        self.assertGreaterEqual(batcher.stats()["max_seen"], 2)
+
+    def test_failed_batch_fails_every_caller(self):
+        def run_batch(prompts, contexts):
+            raise ValueError("oom")
+
+        batcher = MicroBatcher(run_batch, window=0.0, max_batch=4)
+        self.addCleanup(batcher.close)
+        with self.assertRaises(ValueError):
+            batcher.submit("a")
+
+    def test_closed_batcher_refuses_new_prompts(self):
+        batcher = MicroBatcher(lambda prompts, contexts: prompts, window=0.0, max_batch=4)
+        self.assertEqual(batcher.submit("a"), "a")
+        batcher.close()
+        batcher.close()
+        with self.assertRaises(RuntimeError):
+            batcher.submit_future("b")
+
+    def test_dying_worker_fails_running_and_queued_callers(self):
+        started, release = threading.Event(), threading.Event()
+
+        def run_batch(prompts, contexts):
+            started.set()
+            release.wait(5)
+            raise SystemExit(1)  # e.g. a gunicorn worker timeout landing in this thread
+
+        batcher = MicroBatcher(run_batch, window=0.0, max_batch=1)
+        running = batcher.submit_future("a")
+        self.assertTrue(started.wait(5))
+        queued = batcher.submit_future("b")
+        release.set()
+        for fut in (running, queued):
+            with self.assertRaisesRegex(RuntimeError, "SystemExit"):
+                fut.result(timeout=5)
+        batcher._worker.join(5)
+        self.assertFalse(batcher._worker.is_alive())
+        with self.assertRaises(RuntimeError):
+            batcher.submit("c")
+
+
+# ----- chat views against the local stub upstream -----
+
+def _ndjson(content) -> list:
+    return [json.loads(ln) for ln in b"".join(content).splitlines()]
+
+
+@override_settings(CHAT_TRANSCRIPTS=False, CHAT_CACHE_ALIAS="")
+class ChatViewTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubServer().start()
+        cls.addClassCleanup(cls.stub.stop)
+
+    def setUp(self):
+        env = {"OPENAI_BASE_URL": self.stub.url + "/v1", "OPENAI_API_KEY": "stub"}
+        with mock.patch.dict(os.environ, env):
+            self.bot = MyChatbot1(ChatBackend(provider="openai", model_name="stub"))
+        for target, attr, value in ((views, "_bot", self.bot), (sessions, "_store", sessions.SessionStore()),
+                                    (telemetry, "guardian", lambda: None)):
+            patcher = mock.patch.object(target, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(admission, "controller", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.expected = _clean(STUB_REPLY)
+
+    def post(self, path: str, body: dict, **headers):
+        return self.client.post(f"/chatbot1/{path}", json.dumps(body), content_type="application/json", **headers)
+
+    def test_chat(self):
+        r = self.post("chat/", {"prompt": "hello there"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json(), {"prompt": "hello there", "response": self.expected})
+        self.assertEqual(self.post("chat/", {"prompt": " "}).status_code, 400)
+
+    def test_stream_ndjson_and_sse(self):
+        events = _ndjson(self.post("chat/stream/", {"prompt": "hello there"}).streaming_content)
+        self.assertEqual("".join(e.get("delta", "") for e in events[:-1]), self.expected)
+        self.assertEqual(events[-1], {"done": True, "response": self.expected})
+
+        r = self.post("chat/stream/", {"prompt": "hello there"}, HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(r["Content-Type"], "text/event-stream")
+        frames = b"".join(r.streaming_content).decode().split("\n\n")
+        self.assertEqual(json.loads(frames[-2].removeprefix("data: ")), {"done": True, "response": self.expected})
+
+    def test_repeat_chat_is_served_from_cache(self):
+        before = self.stub.requests
+        self.post("chat/", {"prompt": "hello there"})
+        self.post("chat/", {"prompt": "hello there"})
+        self.assertEqual(self.stub.requests - before, 1)
+        self.post("chat/", {"prompt": "hello there", "no_cache": True})
+        self.assertEqual(self.stub.requests - before, 2)
+
+    def test_batch(self):
+        r = self.post("chat/batch/", {"prompts": ["hello there", "", "and again"], "use_cache": False})
+        lines = _ndjson(r.streaming_content)
+        self.assertEqual(lines[-1], {"done": True, "count": 3, "errors": 1})
+        by_index = {line["index"]: line for line in lines[:-1]}
+        self.assertEqual(by_index[0]["response"], self.expected)
+        self.assertEqual(by_index[1]["error"], "Prompt required")
+        self.assertEqual(self.post("chat/batch/", {"prompts": []}).status_code, 400)
+
+    def test_open_circuit_fails_fast_except_for_meal_prompts(self):
+        with mock.patch.object(self.bot, "generate", side_effect=health.Unavailable("openai:stub", 5)):
+            r = self.post("chat/", {"prompt": "hello there"})
+            self.assertEqual((r.status_code, r["Retry-After"]), (503, "5"))
+            r = self.post("chat/", {"prompt": "I'm hungry"})
+            self.assertEqual(r.status_code, 200)
+            self.assertTrue(r.json()["degraded"])
+
+    def test_session_sends_history_upstream(self):
+        first = self.post("chat/", {"prompt": "I'm vegan", "session": "new"}).json()
+        self.assertEqual(first["turn"], 1)
+        alone = self.stub.last_prompt_tokens
+        second = self.post("chat/", {"prompt": "I'm vegan", "session": first["session"]}).json()
+        self.assertEqual((second["session"], second["turn"]), (first["session"], 2))
+        self.assertGreater(self.stub.last_prompt_tokens, alone)  # a cache miss: the key includes the history
+
+        r = self.post("chat/", {"prompt": "hi", "session": "x" * 22})
+        self.assertEqual((r.status_code, r.json()["error"]), (404, "Unknown session"))
+        self.assertEqual(self.post("chat/", {"prompt": "hi", "session": "bad id"}).status_code, 400)
+
+    def test_server_timing_header(self):
+        r = self.post("chat/", {"prompt": "hello there", "no_cache": True})
+        stages = dict(part.split(";dur=") for part in r["Server-Timing"].split(", "))
+        self.assertIn("clean", stages)
+        self.assertEqual(list(stages)[-1], "total")
+        self.assertGreaterEqual(float(stages["total"]), float(stages["clean"]))
+
+    def test_metrics_exposition(self):
+        self.post("chat/", {"prompt": "hello there"})
+        r = self.client.get("/metrics")
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r["Content-Type"].startswith("text/plain; version=0.0.4"))
+        declared = {}
+        sample = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)'
+                            r'(\{[a-zA-Z_][a-zA-Z0-9_]*="[^"]*"(,[a-zA-Z_][a-zA-Z0-9_]*="[^"]*")*\})? (\S+)$')
+        for line in r.content.decode().splitlines():
+            if line.startswith("# HELP "):
+                continue
+            if line.startswith("# TYPE "):
+                _, _, name, kind = line.split(" ")
+                self.assertIn(kind, ("counter", "gauge", "histogram", "summary"))
+                declared[name] = kind
+                continue
+            self.assertRegex(line, sample)
+            name, _, _, value = sample.match(line).groups()
+            float(value)  # "+Inf" and "NaN" parse too
+            base = re.sub(r"_(bucket|sum|count)$", "", name)
+            self.assertTrue(name in declared or declared.get(base) == "histogram", line)
+        self.assertIn("chat_cache_events_total", declared)
+
+        with override_settings(METRICS_TOKEN="s3cret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            r = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret")
+            self.assertEqual(r.status_code, 200)
+
+    # Async (ASGI) variants, called directly: the URLconf picks one set at import.
+    def _apost(self, view, body: dict, consume: bool = False):
+        request = RequestFactory().post("/", json.dumps(body), content_type="application/json")
+
+        async def run():
+            resp = await view.as_view()(request)
+            if consume:
+                return resp, [chunk async for chunk in resp.streaming_content]
+            return resp, None
+
+        return asyncio.run(run())
+
+    def test_async_views(self):
+        r, _ = self._apost(views.AsyncChatbotView, {"prompt": "hello there"})
+        self.assertEqual(json.loads(r.content), {"prompt": "hello there", "response": self.expected})
+
+        _, chunks = self._apost(views.AsyncChatStreamView, {"prompt": "hello there", "no_cache": True}, True)
+        events = _ndjson(chunks)
+        self.assertEqual("".join(e.get("delta", "") for e in events[:-1]), self.expected)
+        self.assertEqual(events[-1], {"done": True, "response": self.expected})
+
+        _, chunks = self._apost(views.AsyncChatBatchView, {"prompts": ["hello there", "again"]}, True)
+        lines = _ndjson(chunks)
+        self.assertEqual(lines[-1], {"done": True, "count": 2, "errors": 0})
+        self.assertEqual({line["response"] for line in lines[:-1]}, {self.expected})
+
+
+# ----- sessions -----
+
+@override_settings(CHAT_CACHE_ALIAS="")
+class SessionTests(SimpleTestCase):
+    def test_history_is_kept_under_budget(self):
+        session = sessions.Session("s")
+        session.add("I'm vegan", "Noted!", budget=1000)
+        session.add("and dinner?", "Lentil curry.", budget=1000)
+        self.assertEqual([m["content"] for m in session.messages()],
+                         ["I'm vegan", "Noted!", "and dinner?", "Lentil curry."])
+        turn = session.turn("and lunch?")
+        self.assertEqual((turn, len(turn.history)), ("and lunch?", 4))
+        self.assertEqual(sessions.Session("s").turn("first"), "first")
+
+    def test_oldest_turns_fold_into_the_summary(self):
+        session = sessions.Session("s")
+        for i in range(20):
+            session.add(f"user message {i} " * 5, f"a long reply number {i} " * 10, budget=200, summary_budget=30)
+            self.assertLessEqual(session.tokens, 200)
+        self.assertEqual(session.count, 20)
+        self.assertLess(len(session.turns), 20)
+        self.assertLessEqual(sessions.tokens(session.summary), 30)
+        self.assertIn("user message 19", session.turns[-1][0])
+        self.assertNotIn("a long reply", session.summary)  # the bot's old ideas are dropped
+        self.assertTrue(session.messages()[0]["content"].startswith("(Earlier I said: "))
+
+    def test_one_oversized_turn_clips_the_reply(self):
+        session = sessions.Session("s")
+        session.add("short question", "x " * 1000, budget=50)
+        self.assertLessEqual(session.tokens, 51)  # the estimate rounds the clipped reply up by one
+        self.assertEqual(session.turns[0][0], "short question")
+        self.assertTrue(session.turns[0][1].endswith("…"))
+
+    def test_dumps_loads_round_trip(self):
+        session = sessions.Session("s")
+        for i in range(6):
+            session.add(f"question {i} " * 10, f"answer {i} " * 10, budget=100, summary_budget=20)
+        copy = sessions.Session.loads("s", session.dumps())
+        self.assertEqual((copy.turns, copy.summary, copy.count, copy.tokens),
+                         (session.turns, session.summary, session.count, session.tokens))
+
+    def test_store_open_and_save(self):
+        store = sessions.SessionStore()
+        self.assertIsNone(store.open(None))
+        self.assertIsNone(store.open(""))
+        for bad in ("short", 42, "not/an/id" * 3):
+            with self.assertRaises(ValueError):
+                store.open(bad)
+        with self.assertRaises(sessions.Unknown):
+            store.open("y" * 22)
+        session = store.open(sessions.NEW)
+        session.add("hi", "hello")
+        store.save(session)
+        resumed = store.open(session.id)
+        self.assertEqual((resumed.turns, resumed.count), (session.turns, 1))
+        self.assertEqual(asyncio.run(store.aopen(session.id)).count, 1)
+        stats = store.stats()
+        self.assertEqual((stats["created"], stats["saved"], stats["unknown"]), (1, 1, 1))
+
+
+# ----- transcripts -----
+
+def _row(prompt: str) -> dict:
+    from django.utils import timezone
+    return {"created_at": timezone.now(), "source": "chat", "prompt": prompt, "response": "ok",
+            "provider": "fake", "model": "fake", "latency_ms": 1.0}
+
+
+class TranscriptWriterTests(TransactionTestCase):
+    def writer(self, **kwargs) -> transcripts.TranscriptWriter:
+        w = transcripts.TranscriptWriter(**{"capacity": 100, "batch_size": 10, "interval": 60, **kwargs})
+        self.addCleanup(w.close)
+        return w
+
+    def test_rows_are_bulk_written(self):
+        w = self.writer(batch_size=2)
+        for i in range(5):
+            w.submit(_row(f"p{i}"))
+        self.assertTrue(w.flush(5))
+        self.assertEqual(sorted(Transcript.objects.values_list("prompt", flat=True)), [f"p{i}" for i in range(5)])
+        stats = w.stats()
+        self.assertEqual((stats["written"], stats["queue_depth"], stats["failed"]), (5, 0, 0))
+        self.assertGreaterEqual(stats["batches"], 3)
+
+    def test_full_ring_drops_the_oldest(self):
+        w = self.writer(capacity=2)
+        for i in range(3):
+            w.submit(_row(f"p{i}"))
+        self.assertTrue(w.flush(5))
+        self.assertEqual(sorted(Transcript.objects.values_list("prompt", flat=True)), ["p1", "p2"])
+        self.assertEqual(w.stats()["dropped"], 1)
+
+    def test_failed_write_is_counted_not_raised(self):
+        w = self.writer()
+        w.submit({"no_such_field": 1})
+        self.assertTrue(w.flush(5))
+        self.assertEqual((w.stats()["failed"], Transcript.objects.count()), (1, 0))
+
+    def test_record_carries_provider_usage(self):
+        w = self.writer()
+        with mock.patch.object(transcripts, "writer", return_value=w):
+            with transcripts.record("hi", "chat", _Backend()) as rec:
+                metrics.tokens("fake", "fake-model", 12, 0.5, prompt=30)
+                rec.done("hello", False)
+            with transcripts.record("skipped", "chat", _Backend()):
+                pass  # no done(): nothing is written
+        self.assertTrue(w.flush(5))
+        row = Transcript.objects.get()
+        self.assertEqual((row.prompt, row.response, row.prompt_tokens, row.completion_tokens),
+                         ("hi", "hello", 30, 12))
+
+
+# ----- record / replay provider -----
+
+class ReplayTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "corpus.sqlite3")
+
+    def corpus(self, rows, config=None) -> replay.ReplayStore:
+        writer = replay.ReplayStore(self.path, readonly=False)
+        writer.put_many(config or {"model": "m"}, rows)
+        writer.close()
+        return replay.ReplayStore(self.path)
+
+    def test_store_round_trip(self):
+        reader = self.corpus([("hello", "hi there", 100.0, 300.0, 5, 2)])
+        cid, fp, config = reader.resolve()
+        self.assertEqual(config, {"model": "m"})
+        rec = reader.get(cid, fp, "hello")
+        self.assertEqual((rec.reply, rec.ttft_ms, rec.total_ms, rec.prompt_tokens, rec.exact),
+                         ("hi there", 100.0, 300.0, 5, True))
+        history = [{"role": "user", "content": "earlier"}]
+        self.assertNotEqual(replay.entry_key(fp, "hello"), replay.entry_key(fp, sessions.Turn("hello", history)))
+        with mock.patch.multiple(replay, REPLAY_LATENCY_MS="", REPLAY_TOKENS_PER_S="", REPLAY_SPEED=1.0):
+            self.assertEqual(replay.timing(rec, 3), (0.1, 0.1))
+        with self.assertRaises(ValueError):
+            replay.ReplayStore(self.path + ".missing")
+
+    def test_miss_any_serves_the_same_stand_in(self):
+        reader = self.corpus([(f"prompt {i}", f"reply {i}", 1.0, 2.0, 1, 1) for i in range(20)])
+        cid, fp, _ = reader.resolve()
+        with mock.patch.object(replay, "REPLAY_MISS", "any"):
+            first = reader.get(cid, fp, "never recorded")
+            self.assertFalse(first.exact)
+            self.assertEqual(reader.get(cid, fp, "never recorded").reply, first.reply)
+            replies = {reader.get(cid, fp, f"unknown {i}").reply for i in range(20)}
+            self.assertGreater(len(replies), 1)
+        with mock.patch.object(replay, "REPLAY_MISS", "error"):
+            self.assertIsNone(reader.get(cid, fp, "never recorded"))
+        self.assertEqual(reader.stats()["substituted"], 22)
+
+    def test_resolve_by_fingerprint_prefix(self):
+        writer = replay.ReplayStore(self.path, readonly=False)
+        writer.put({"model": "old"}, "p", "old reply", 1.0, 1.0)
+        time.sleep(0.01)
+        writer.put({"model": "new"}, "p", "new reply", 1.0, 1.0)
+        writer.close()
+        reader = replay.ReplayStore(self.path)
+        old = replay.fingerprint({"model": "old"})
+        self.assertEqual(reader.resolve()[2], {"model": "new"})  # latest recorded
+        cid, fp, config = reader.resolve(old[:6])
+        self.assertEqual((fp, config), (old, {"model": "old"}))
+        self.assertEqual(reader.get(cid, fp, "p").reply, "old reply")
+        with self.assertRaises(ValueError):
+            reader.resolve("zz")
+
+    @override_settings(CHAT_CACHE_ALIAS="")
+    def test_record_then_replay_through_the_backend(self):
+        env = {"OPENAI_API_KEY": "stub"}
+        with StubServer() as stub, mock.patch.dict(os.environ, {**env, "OPENAI_BASE_URL": stub.url + "/v1"}), \
+                mock.patch.multiple(replay, REPLAY_PATH=self.path, REPLAY_UPSTREAM="openai", REPLAY_CONFIG="",
+                                    REPLAY_LATENCY_MS="0", REPLAY_TOKENS_PER_S="0", _stores={}):
+            with mock.patch.object(replay, "REPLAY_MODE", "record"):
+                recorder = ChatBackend("replay", "stub")
+                recorded = recorder.generate("hello there")
+                recorder._replay_store.close()
+            calls = stub.requests
+            with mock.patch.object(replay, "REPLAY_MODE", "replay"):
+                usage, token = metrics.begin_usage()
+                try:
+                    replayed = ChatBackend("replay").generate("hello there")
+                finally:
+                    metrics.end_usage(token)
+            self.assertEqual(stub.requests, calls)  # served from the corpus
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(recorded, _clean(STUB_REPLY))
+        self.assertEqual(usage["completion_tokens"], len(tokenize(STUB_REPLY)))
+
+
+# ----- out-of-process inference server -----
+
+class _ServedModel:
+    """What the inference server leases from its pool: raw generation plus a word tokenizer."""
+
+    def __init__(self, reply: str = "one two three", error: Exception = None, gap: float = 0.0):
+        self.reply, self.error, self.gap = reply, error, gap
+        self.closed = threading.Event()
+
+    @staticmethod
+    def _hf_tokenizer(text: str, add_special_tokens: bool = True) -> dict:
+        return {"input_ids": text.split()}
+
+    def _format_prompt(self, prompt: str) -> str:
+        return f"system {prompt}"
+
+    def _generate_raw(self, prompt: str) -> str:
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+    def _stream_raw(self, prompt: str):
+        try:
+            while True:  # until the reader goes away
+                for piece in tokenize(self.reply):
+                    time.sleep(self.gap)
+                    yield piece
+                if not self.gap:
+                    return
+        finally:
+            self.closed.set()
+
+
+class _ServedPool:
+    default = "m"
+    allowed = {"m"}
+
+    def __init__(self, backend: _ServedModel):
+        self.backend = backend
+
+    def check(self, name: str) -> None:
+        if name not in self.allowed:
+            raise ValueError(f"unknown model {name!r}")
+
+    def lease(self, name: str = None):
+        self.check(name or self.default)
+        return mock.MagicMock(__enter__=mock.Mock(return_value=self.backend))
+
+    def config(self, model: str = None) -> dict:
+        return {"provider": "hf", "model": model or self.default}
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InferenceTests(SimpleTestCase):
+    def serve(self, backend: _ServedModel) -> inference.InferenceServer:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        server = inference.InferenceServer(os.path.join(tmp.name, "hf.sock"), _ServedPool(backend))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_frames_round_trip(self):
+        data = inference._frame(inference.TEXT, "héllo".encode()) + inference._json(inference.END, {"n": 1}) \
+            + inference._frame(inference.STATS)
+        rfile = io.BytesIO(data)
+        self.assertEqual(inference._read(rfile), (inference.TEXT, "héllo".encode()))
+        self.assertEqual(inference._read(rfile), (inference.END, b'{"n":1}'))
+        self.assertEqual(inference._read(rfile), (inference.STATS, b""))
+        self.assertIsNone(inference._read(rfile))  # clean end of stream
+        for broken in (data[:3], data[:7]):
+            with self.assertRaises(ConnectionError):
+                inference._read(io.BytesIO(broken))
+        with self.assertRaises(ConnectionError):
+            inference._read(io.BytesIO(inference._HEADER.pack(inference.TEXT, inference._MAX_FRAME + 1)))
+
+    def test_generate_stream_and_config(self):
+        server = self.serve(_ServedModel())
+        client = inference.Client(server.path)
+        text, usage = client.generate(sessions.Turn("hi", [{"role": "user", "content": "before"}]), "m")
+        self.assertEqual(text, "one two three")
+        self.assertEqual((usage["prompt_tokens"], usage["completion_tokens"]), (2, 3))
+        usage = {}
+        self.assertEqual(list(client.stream("hi", "m", usage)), ["one ", "two ", "three"])
+        self.assertEqual(usage["completion_tokens"], 3)
+        self.assertEqual(client.config("m")["allowed"], ["m"])
+        self.assertEqual(server.stats()["inference_server"]["connections"], 1)  # one connection, reused
+        self.assertEqual(asyncio.run(inference.AsyncClient(server.path).generate("hi", "m"))[0], "one two three")
+
+    def test_error_frames(self):
+        server = self.serve(_ServedModel(error=RuntimeError("CUDA out of memory")))
+        client = inference.Client(server.path)
+        with self.assertRaisesRegex(inference.InferenceError, "RuntimeError: CUDA out of memory"):
+            client.generate("hi", "m")
+        with self.assertRaisesRegex(ValueError, "unknown model"):
+            client.generate("hi", "other")  # the caller's 400, not a server error
+        self.assertEqual(client.config()["config"]["model"], "m")  # the connection is still usable
+        self.assertEqual(server.stats()["inference_server"]["errors"], 1)
+        with self.assertRaises(ConnectionError):
+            inference.Client(server.path + ".missing").generate("hi", "m")
+
+    def test_client_leaving_mid_stream_stops_generation(self):
+        backend = _ServedModel(gap=0.01)
+        server = self.serve(backend)
+        pieces = inference.Client(server.path).stream("hi", "m", {})
+        self.assertEqual(next(pieces), "one ")
+        pieces.close()
+        self.assertTrue(backend.closed.wait(5))
+        deadline = time.monotonic() + 5
+        while server.stats()["inference_server"]["cancelled"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(server.stats()["inference_server"]["cancelled"], 1)
+
+
+# ----- benchmark suite -----
+
+class StubServerTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubServer(reply="one two three four").start()
+        cls.addClassCleanup(cls.stub.stop)
+
+    def post(self, path: str, body: dict, **kwargs):
+        import requests
+        return requests.post(self.stub.url + path, json=body, timeout=5, **kwargs)
+
+    def test_tokenize_round_trips(self):
+        for text in (STUB_REPLY, "  spaced  out\n", ""):
+            self.assertEqual("".join(tokenize(text)), text)
+
+    def test_openai_completion_and_usage(self):
+        body = {"model": "stub", "messages": [{"role": "user", "content": "a b c"}], "max_tokens": 2}
+        data = self.post("/v1/chat/completions", body).json()
+        self.assertEqual(data["choices"][0]["message"]["content"], "one two ")
+        self.assertEqual(data["usage"], {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5})
+        self.assertEqual(self.stub.last_prompt_tokens, 3)
+
+    def test_openai_stream(self):
+        body = {"model": "stub", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+        frames = [ln for ln in self.post("/v1/chat/completions", body, stream=True).iter_lines() if ln]
+        self.assertEqual(frames[-1], b"data: [DONE]")
+        chunks = [json.loads(f.removeprefix(b"data: ")) for f in frames[:-1]]
+        self.assertEqual("".join(c["choices"][0]["delta"].get("content", "") for c in chunks), "one two three four")
+        self.assertEqual(chunks[-1]["usage"]["completion_tokens"], 4)
+
+    def test_ollama_chat_and_custos_beats(self):
+        body = {"model": "stub", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+        lines = [json.loads(ln) for ln in self.post("/api/chat", body, stream=True).iter_lines() if ln]
+        self.assertEqual("".join(ln["message"]["content"] for ln in lines), "one two three four")
+        self.assertEqual((lines[-1]["done"], lines[-1]["eval_count"]), (True, 4))
+        beats = self.stub.beats
+        self.assertEqual(self.post("/simulator/logs/", {"response": "x"}).json(), {"ok": True})
+        self.assertEqual(self.stub.beats, beats + 1)
+
+    def test_prefill_time_grows_with_the_prompt(self):
+        with StubServer(prefill_tokens_per_s=200) as stub:
+            import requests
+            t0 = time.perf_counter()
+            requests.post(stub.url + "/v1/chat/completions", timeout=5,
+                          json={"messages": [{"role": "user", "content": "w " * 40}]})
+            self.assertGreaterEqual(time.perf_counter() - t0, 0.2)
+
+
+class BenchHelperTests(SimpleTestCase):
+    def test_latency_summary(self):
+        summary = _bench.latency_summary([0.001 * i for i in range(1, 101)], "turn_ms")
+        self.assertEqual(set(summary), {"turn_ms_p50", "turn_ms_p95", "turn_ms_p99"})
+        self.assertAlmostEqual(summary["turn_ms_p50"], 50.5)
+        self.assertEqual(_bench.latency_summary([])["latency_ms_p95"], 0.0)
+
+    def test_compare_knows_which_way_is_worse(self):
+        base = {"results": [{"name": "chat", "ops_per_s": 100, "latency_ms_p95": 10, "count": 5}]}
+        same = {"results": [{"name": "chat", "ops_per_s": 95, "latency_ms_p95": 10.5, "count": 50}]}
+        worse = {"results": [{"name": "chat", "ops_per_s": 50, "latency_ms_p95": 20, "count": 5}]}
+        self.assertEqual(_bench.compare(base, same, 0.1), [])
+        keys = [key for key, *_ in _bench.compare(base, worse, 0.1)]
+        self.assertEqual(keys, ["results.chat.ops_per_s", "results.chat.latency_ms_p95"])
+
+    def test_bench_sessions_runs_against_the_stub(self):
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ), \
+                override_settings(CHAT_CACHE_ALIAS=""), mock.patch.object(sessions, "_store", None):
+            out = os.path.join(tmp, "sessions.json")
+            call_command("bench_sessions", turns="1,4", conversations=1, latency_ms=0, max_tokens=60,
+                         json_out=out, stdout=io.StringIO())
+            rows = {row["name"]: row for row in _bench.read_json(out)["results"]}
+        self.assertEqual(set(rows), {"bounded-1", "bounded-4", "unbounded-1", "unbounded-4"})
+        self.assertLess(rows["bounded-4"]["last_prompt_tokens"], rows["unbounded-4"]["last_prompt_tokens"])
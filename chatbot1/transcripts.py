@@ -0,0 +1,234 @@
+# chatbot1/transcripts.py
+# Transcript persistence off the request path. Views wrap each chat in
+# `record(...)`; finished replies go into a bounded per-process ring and one
+# daemon thread writes them to chatbot1.Transcript with bulk_create.
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from time import perf_counter
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_FAILURE_LOG_EVERY = 60.0  # seconds between repeated write-failure warnings
+
+
+class TranscriptWriter:
+    """
+    Bounded, batched writer for Transcript rows.
+
+    `submit` never blocks and never touches the database: when the ring is
+    full the oldest row is dropped (and counted). The worker writes when
+    `batch_size` rows are queued or `interval` seconds have passed, one
+    bulk_create per batch on its own DB connection. `close` writes what is
+    left, bounded by `timeout`.
+    """
+
+    def __init__(self, capacity: int, batch_size: int, interval: float):
+        self.capacity = max(1, capacity)
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self._ring = deque(maxlen=self.capacity)
+        self._cond = threading.Condition()
+        self._closing = False
+        self._urgent = False
+        self._busy = False
+        self._last_failure_log = 0.0
+        self._counts = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0}
+        self._write_ms = {"last": 0.0, "max": 0.0, "total": 0.0}
+        self._thread = threading.Thread(target=self._run, name="transcript-writer", daemon=True)
+        self._thread.start()
+
+    # ----- Producer side -----
+    def submit(self, row: dict) -> None:
+        with self._cond:
+            if self._closing:
+                self._counts["dropped"] += 1
+                return
+            if len(self._ring) == self.capacity:
+                self._counts["dropped"] += 1  # deque(maxlen) evicts the oldest
+            self._ring.append(row)
+            self._counts["enqueued"] += 1
+            if len(self._ring) >= self.batch_size:
+                self._cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Write everything queued now; True once the ring is empty and no batch is in flight."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._urgent = True
+            self._cond.notify_all()
+            while self._ring or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            left = len(self._ring)
+            self._ring.clear()
+            self._counts["dropped"] += left
+        if left:
+            logger.warning("Transcript writer closed with %d rows unwritten", left)
+
+    def stats(self) -> dict:
+        with self._cond:
+            counts = dict(self._counts)
+            depth = len(self._ring)
+            ms = dict(self._write_ms)
+        return {
+            **counts,
+            "queue_depth": depth,
+            "queue_capacity": self.capacity,
+            "batch_size": self.batch_size,
+            "write_ms_last": round(ms["last"], 2),
+            "write_ms_max": round(ms["max"], 2),
+            "write_ms_avg": round(ms["total"] / counts["batches"], 2) if counts["batches"] else 0.0,
+        }
+
+    # ----- Worker -----
+    def _take(self) -> list:
+        with self._cond:
+            deadline = time.monotonic() + self.interval
+            while len(self._ring) < self.batch_size and not (self._closing or self._urgent):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            n = min(len(self._ring), self.batch_size)
+            batch = [self._ring.popleft() for _ in range(n)]
+            if not self._ring:
+                self._urgent = False
+            self._busy = bool(batch)
+            if not batch:
+                self._cond.notify_all()
+            return batch
+
+    def _run(self) -> None:
+        from django.db import connection
+        try:
+            while True:
+                batch = self._take()
+                if batch:
+                    self._write(batch)
+                elif self._closing:
+                    return
+        finally:
+            connection.close()
+
+    def _write(self, batch: list) -> None:
+        from django.db import close_old_connections
+        from .models import Transcript
+        t0 = perf_counter()
+        ok = True
+        try:
+            close_old_connections()  # honours CONN_MAX_AGE and drops broken connections
+            Transcript.objects.bulk_create([Transcript(**row) for row in batch], batch_size=self.batch_size)
+        except Exception:
+            ok = False
+            now = time.monotonic()
+            if now - self._last_failure_log >= _FAILURE_LOG_EVERY:
+                self._last_failure_log = now
+                logger.warning("Transcript write of %d rows failed (migrations applied?)", len(batch), exc_info=True)
+        ms = (perf_counter() - t0) * 1000
+        with self._cond:
+            self._counts["written" if ok else "failed"] += len(batch)
+            self._counts["batches"] += 1
+            self._write_ms["last"] = ms
+            self._write_ms["max"] = max(self._write_ms["max"], ms)
+            self._write_ms["total"] += ms
+            self._busy = False
+            self._cond.notify_all()
+
+
+_lock = threading.Lock()
+_writer = None
+_writer_pid = None
+
+
+def writer():
+    """This process's TranscriptWriter, or None when CHAT_TRANSCRIPTS is off. Started lazily (fork-safe)."""
+    global _writer, _writer_pid
+    from django.conf import settings
+    if not getattr(settings, "CHAT_TRANSCRIPTS", False):
+        return None
+    pid = os.getpid()
+    if _writer is None or _writer_pid != pid:
+        with _lock:
+            if _writer is None or _writer_pid != pid:
+                _writer = TranscriptWriter(
+                    settings.CHAT_TRANSCRIPT_QUEUE, settings.CHAT_TRANSCRIPT_BATCH,
+                    settings.CHAT_TRANSCRIPT_FLUSH_INTERVAL,
+                )
+                _writer_pid = pid
+                atexit.register(_writer.close)
+    return _writer
+
+
+class record:
+    """
+    `with record(prompt, "chat", bot.backend) as rec: ... rec.done(response, fallback_used)`
+
+    Collects which provider/model answered and its token counts while the
+    block runs, and queues one Transcript row on exit if `done` was called.
+    Replies served from cache keep the backend's configured provider/model.
+    """
+    __slots__ = ("prompt", "source", "backend", "writer", "response", "fallback_used",
+                 "latency", "usage", "created_at", "_t0", "_token")
+
+    def __init__(self, prompt: str, source: str, backend=None):
+        self.prompt, self.source, self.backend = prompt, source, backend
+        self.writer = writer()
+        self.response = None
+        self.fallback_used = False
+        self.latency = 0.0
+        self._token = None
+
+    def __enter__(self):
+        if self.writer is not None:
+            from django.utils import timezone
+            self.created_at = timezone.now()
+            self.usage, self._token = metrics.begin_usage()
+            self._t0 = perf_counter()
+        return self
+
+    def done(self, response: str, fallback_used: bool = False) -> None:
+        if self.writer is not None:
+            self.response, self.fallback_used = response, fallback_used
+            self.latency = perf_counter() - self._t0
+
+    def __exit__(self, *exc):
+        if self._token is None:
+            return False
+        try:
+            metrics.end_usage(self._token)
+        except ValueError:
+            pass  # a stream closed from another context; the var dies with that context
+        if self.response is not None:
+            usage = self.usage
+            self.writer.submit({
+                "created_at": self.created_at,
+                "source": self.source,
+                "prompt": self.prompt,
+                "response": self.response,
+                "provider": usage.get("provider") or getattr(self.backend, "provider", "") or "",
+                "model": usage.get("model") or getattr(self.backend, "model_name", "") or "",
+                "latency_ms": round(self.latency * 1000, 3),
+                "fallback_used": self.fallback_used,
+                "prompt_tokens": usage.get("prompt_tokens"),
+                "completion_tokens": usage.get("completion_tokens"),
+            })
+        return False
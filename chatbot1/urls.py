@@ -1,17 +1,47 @@
 # custos-chatbot/bot_testing/chatbot1/urls.py
 
 # chatbot1/urls.py
+from django.conf import settings
 from django.urls import path
-from .views import ChatbotView, ChatUI
-from .diag import custos_diag, custos_force_beat, custos_force_beat, custos_selftest
+from .views import (
+    AsyncChatBatchView, AsyncChatbotView, AsyncChatStreamView, ChatBatchView, ChatbotView, ChatStreamView, ChatUI,
+)
+from .diag import (
+    chat_admission_stats,
+    chat_budget_stats,
+    chat_cache_stats,
+    chat_health_stats,
+    chat_models_stats,
+    chat_router_stats,
+    chat_session_stats,
+    chat_transcript_stats,
+    custos_diag,
+    custos_force_beat,
+    custos_selftest,
+)
+
+# Under ASGI (see bot_testing/asgi.py) the chat routes are served by the async views.
+if settings.CHAT_ASYNC_VIEWS:
+    chat_view, chat_stream_view, chat_batch_view = AsyncChatbotView, AsyncChatStreamView, AsyncChatBatchView
+else:
+    chat_view, chat_stream_view, chat_batch_view = ChatbotView, ChatStreamView, ChatBatchView
 
 urlpatterns = [
-    path("chat/", ChatbotView.as_view(), name="chat"),
+    path("chat/", chat_view.as_view(), name="chat"),
+    path("chat/stream/", chat_stream_view.as_view(), name="chat_stream"),
+    path("chat/batch/", chat_batch_view.as_view(), name="chat_batch"),
     path("ui/", ChatUI.as_view(), name="chat_ui"),
 
     # diagnostics
     path("custos/diag/", custos_diag, name="custos_diag"),
     path("custos/beat/", custos_force_beat, name="custos_force_beat"),
-    path("custos/beat/", custos_force_beat),
     path("custos/selftest/", custos_selftest),
+    path("cache/stats/", chat_cache_stats, name="chat_cache_stats"),
+    path("router/stats/", chat_router_stats, name="chat_router_stats"),
+    path("models/stats/", chat_models_stats, name="chat_models_stats"),
+    path("admission/stats/", chat_admission_stats, name="chat_admission_stats"),
+    path("transcripts/stats/", chat_transcript_stats, name="chat_transcript_stats"),
+    path("health/", chat_health_stats, name="chat_health_stats"),
+    path("budget/stats/", chat_budget_stats, name="chat_budget_stats"),
+    path("sessions/stats/", chat_session_stats, name="chat_session_stats"),
 ]
@@ -1,15 +1,23 @@
 # custos-chatbot/bot_testing/chatbot1/views.py
 
+import asyncio
+import json
 import logging
 import re
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
 from django.views.generic import TemplateView
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 
+from rest_framework.negotiation import DefaultContentNegotiation
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 
+from . import admission, health, metrics, sessions, telemetry, transcripts
 from .models import MyChatbot1
 
 logger = logging.getLogger(__name__)
@@ -17,24 +25,38 @@ logger = logging.getLogger(__name__)
 _bot = None
 def get_bot():
     global _bot
-    if _bot is None:
-        logger.info("Initializing model backend…")
-        _bot = MyChatbot1()
-        logger.info("Model backend ready.")
+    with metrics.stage("init"):
+        if _bot is None:
+            logger.info("Initializing model backend…")
+            _bot = MyChatbot1()
+            health.watch(_bot.backend)
+            logger.info("Model backend ready.")
     return _bot
 
 class ChatUI(TemplateView):
     template_name = "chatbot1/chat.html"
 
+# "Customer:", "Associate:", "Submitted by:", "Date Posted:", "C:\\", "/usr/",
+# "Instruction:", "###" or a "Re: [" forum quote, in one scan. Each marker is
+# anchored on its rarest character (":", "/", "#") and confirmed with
+# look-arounds, so the regex engine only stops at those characters.
+_DERAIL_RE = re.compile(r"""
+    :(?: (?<=Customer:) | (?<=Associate:) | (?<=Submitted\ by:) | (?<=Date\ Posted:) | (?<=Instruction:)
+       | (?<=C:)(?=\\) | (?<=\b[Rr][Ee]:)(?=\s*\[) )
+  | /(?=usr/)
+  | \#\#\#
+""", re.X)
+
 def _looks_derailed(text: str) -> bool:
     if not text or len(text) < 20:
         return True
-    bad_markers = ["Customer:", "Associate:", "Submitted by:", "Date Posted:", "C:\\", "/usr/", "Instruction:", "###"]
-    if any(m in text for m in bad_markers):
-        return True
-    if re.search(r"\bRe:\s*\[", text, re.I):
-        return True
-    return False
+    return _DERAIL_RE.search(text) is not None
+
+_MEAL_KEYWORDS = ["hungry", "eat", "food", "meal", "dinner", "lunch", "breakfast"]
+_MEAL_RE = re.compile("|".join(_MEAL_KEYWORDS))
+
+def _is_meal_prompt(prompt: str) -> bool:
+    return _MEAL_RE.search(prompt.lower()) is not None
 
 def _meal_fallback() -> str:
     return (
@@ -44,6 +66,89 @@ def _meal_fallback() -> str:
         "• 🥗 Healthy: Greek yogurt bowl with berries, nuts, and honey."
     )
 
+def _apply_fallback(prompt: str, response: str) -> str:
+    with metrics.stage("fallback"):
+        if _is_meal_prompt(prompt) and _looks_derailed(response):
+            metrics.FALLBACKS.inc()
+            return _meal_fallback()
+    return response
+
+def _finish(rec, prompt: str, response: str) -> str:
+    # Meal fallback, then hand the final reply to the transcript record.
+    final = _apply_fallback(prompt, response)
+    rec.done(final, final != response)
+    return final
+
+def _use_cache(request, data) -> bool:
+    # Per-request bypass: {"no_cache": true} or `Cache-Control: no-cache`.
+    if data.get("no_cache"):
+        return False
+    return "no-cache" not in request.headers.get("Cache-Control", "")
+
+def _model(bot, data):
+    # Per-request {"model": "..."} (HF model pool only); raises ValueError for one this bot can't serve.
+    model = data.get("model")
+    if model is None or model == "":
+        return None
+    if not isinstance(model, str):
+        raise ValueError("'model' must be a string")
+    bot.check_model(model)
+    return model
+
+def _bad_model(e: ValueError) -> dict:
+    return {"data": {"error": "Unknown model", "detail": str(e)}, "status": 400}
+
+def _session(data):
+    # {"session": "new" | id}: the conversation this chat continues, or None; raises ValueError / sessions.Unknown.
+    return sessions.store().open(data.get("session"))
+
+async def _asession(data):
+    return await sessions.store().aopen(data.get("session"))
+
+def _bad_session(e: Exception) -> dict:
+    if isinstance(e, sessions.Unknown):
+        return {"data": {"error": "Unknown session", "detail": str(e)}, "status": 404}
+    return {"data": {"error": "Invalid session", "detail": str(e)}, "status": 400}
+
+def _turn(session, prompt: str) -> str:
+    return session.turn(prompt) if session is not None else prompt
+
+def _remember(session, prompt: str, response: str) -> dict:
+    # Add the turn to the conversation; the reply fields that name it.
+    if session is None:
+        return {}
+    with metrics.stage("session"):
+        session.add(prompt, response)
+        sessions.store().save(session)
+    return {"session": session.id, "turn": session.count}
+
+async def _aremember(session, prompt: str, response: str) -> dict:
+    if session is None:
+        return {}
+    with metrics.stage("session"):
+        session.add(prompt, response)
+        await sessions.store().asave(session)
+    return {"session": session.id, "turn": session.count}
+
+def _busy(e: admission.Rejected) -> dict:
+    # Keyword arguments for Response / JsonResponse.
+    return {"data": {"error": "Server busy", "detail": e.reason}, "status": e.status,
+            "headers": {"Retry-After": str(e.retry_after)}}
+
+def _unavailable(e: health.Unavailable) -> dict:
+    return {"data": {"error": "Upstream unavailable", "detail": str(e)}, "status": 503,
+            "headers": {"Retry-After": str(e.retry_after)}}
+
+def _degraded(rec, prompt: str):
+    # Upstream circuit open: meal prompts still get the canned answer, the rest fail fast.
+    if _is_meal_prompt(prompt):
+        return _finish(rec, prompt, "")
+    return None
+
+def _frame(obj: dict, sse: bool) -> str:
+    data = json.dumps(obj, ensure_ascii=False)
+    return f"data: {data}\n\n" if sse else data + "\n"
+
 @method_decorator(csrf_exempt, name="dispatch")
 class ChatbotView(APIView):
     permission_classes = [AllowAny]
@@ -56,21 +161,468 @@ class ChatbotView(APIView):
         if not prompt:
             return Response({"error": "Prompt required"}, status=400)
 
+        try:
+            slot = admission.admit()
+        except admission.Rejected as e:
+            return Response(**_busy(e))
+
+        with slot:
+            try:
+                bot = get_bot()
+            except Exception as e:
+                logger.exception("Model init failed")
+                return Response({"error": "Model init failed", "detail": str(e)}, status=500)
+            try:
+                model = _model(bot, request.data)
+            except ValueError as e:
+                return Response(**_bad_model(e))
+            try:
+                session = _session(request.data)
+            except (ValueError, sessions.Unknown) as e:
+                return Response(**_bad_session(e))
+
+            with transcripts.record(prompt, "chat", bot.backend) as rec:
+                try:
+                    response = bot.generate(_turn(session, prompt), use_cache=_use_cache(request, request.data),
+                                            model=model)
+                except health.Unavailable as e:
+                    response = _degraded(rec, prompt)
+                    if response is None:
+                        return Response(**_unavailable(e))
+                    return Response({"prompt": prompt, "response": response, "degraded": True,
+                                     **_remember(session, prompt, response)}, status=200)
+                except Exception as e:
+                    logger.exception("Generate failed")
+                    return Response({"error": "Generate failed", "detail": str(e)}, status=500)
+                response = _finish(rec, prompt, response)
+            extra = _remember(session, prompt, response)
+
+        # No explicit guardian call needed — Custos auto-captures and posts.
+        return Response({"prompt": prompt, "response": response, **extra}, status=200)
+
+
+def _custos_capture(prompt: str, response: str) -> None:
+    # CustosCaptureMiddleware can't read a streamed body, so post the beat ourselves.
+    try:
+        with metrics.stage("custos"):
+            guardian = telemetry.guardian()
+            if guardian and response:
+                guardian.evaluate(prompt, response)
+    except Exception:
+        logger.debug("Custos capture skipped", exc_info=True)
+
+
+class _IgnoreAccept(DefaultContentNegotiation):
+    # The stream view picks its own wire format from Accept; error payloads stay JSON.
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class ChatStreamView(APIView):
+    """
+    Streaming variant of ChatbotView.
+
+    Emits NDJSON by default, or Server-Sent Events when the client sends
+    `Accept: text/event-stream`. Each event is one of:
+      {"delta": "..."}                      cleaned text as it is generated
+      {"done": true, "response": "..."}     final text (meal fallback applied)
+      {"error": "...", "detail": "..."}     provider failure mid-stream
+    While the upstream's circuit is open the stream is a single error event
+    (or, for meal prompts, a "done" event with the canned reply and "degraded": true).
+    """
+    permission_classes = [AllowAny]
+    content_negotiation_class = _IgnoreAccept
+
+    def get(self, request):
+        return Response({"message": "Streaming chat API is running! POST a prompt to this endpoint."})
+
+    def post(self, request):
+        prompt = (request.data.get("prompt") or "").strip()
+        if not prompt:
+            return Response({"error": "Prompt required"}, status=400)
+
+        try:
+            slot = admission.admit()
+        except admission.Rejected as e:
+            return Response(**_busy(e))
+
         try:
             bot = get_bot()
         except Exception as e:
+            slot.release()
             logger.exception("Model init failed")
             return Response({"error": "Model init failed", "detail": str(e)}, status=500)
+        try:
+            model = _model(bot, request.data)
+        except ValueError as e:
+            slot.release()
+            return Response(**_bad_model(e))
+        try:
+            session = _session(request.data)
+        except (ValueError, sessions.Unknown) as e:
+            slot.release()
+            return Response(**_bad_session(e))
+
+        # The slot is held until the stream finishes or the response is closed.
+        sse = "text/event-stream" in request.headers.get("Accept", "")
+        events = self._events(bot, prompt, sse, _use_cache(request, request.data), model, session)
+        resp = StreamingHttpResponse(
+            admission.release_after(events, slot),
+            content_type="text/event-stream" if sse else "application/x-ndjson",
+        )
+        resp["Cache-Control"] = "no-cache"
+        resp["X-Accel-Buffering"] = "no"
+        return resp
+
+    def _events(self, bot, prompt: str, sse: bool, use_cache: bool, model: str = None, session=None):
+        parts = []
+        with transcripts.record(prompt, "stream", bot.backend) as rec:
+            try:
+                for delta in bot.stream(_turn(session, prompt), use_cache=use_cache, model=model):
+                    parts.append(delta)
+                    yield _frame({"delta": delta}, sse)
+            except health.Unavailable as e:
+                response = _degraded(rec, prompt)
+                if response is None:
+                    yield _frame(_unavailable(e)["data"], sse)
+                else:
+                    yield _frame({"done": True, "response": response, "degraded": True,
+                                  **_remember(session, prompt, response)}, sse)
+                return
+            except Exception as e:
+                logger.exception("Stream failed")
+                yield _frame({"error": "Generate failed", "detail": str(e)}, sse)
+                return
+            response = _finish(rec, prompt, "".join(parts))
 
+        _custos_capture(prompt, response)
+        yield _frame({"done": True, "response": response, **_remember(session, prompt, response)}, sse)
+
+
+# ----- Batch -----
+# Items fan out through bot.generate, so cache, coalescing and the meal
+# fallback apply per prompt. On HF, concurrent items land in the same
+# micro-batch, i.e. one batched generate() call.
+
+def _batch_items(data) -> tuple:
+    """(prompts, concurrency) from {"prompts": [...], "concurrency": n}, or raises ValueError."""
+    prompts = data.get("prompts")
+    if not isinstance(prompts, list) or not prompts:
+        raise ValueError("'prompts' must be a non-empty list")
+    if len(prompts) > settings.CHAT_BATCH_MAX_ITEMS:
+        raise ValueError(f"at most {settings.CHAT_BATCH_MAX_ITEMS} prompts per batch")
+    try:
+        concurrency = int(data.get("concurrency") or settings.CHAT_BATCH_CONCURRENCY)
+    except (TypeError, ValueError):
+        raise ValueError("'concurrency' must be an integer") from None
+    items = [p.strip() if isinstance(p, str) else "" for p in prompts]
+    return items, max(1, min(concurrency, settings.CHAT_BATCH_CONCURRENCY, len(items)))
+
+
+def _batch_width(bot, concurrency: int, count: int) -> int:
+    # Keep an HF micro-batch full even if the caller asked for less (the server's, behind HF_SERVER).
+    batcher = getattr(bot.backend, "_hf_batcher", None)
+    max_batch = batcher.max_batch if batcher is not None else getattr(bot.backend, "max_batch", 0)
+    return min(count, max(concurrency, max_batch)) if max_batch else concurrency
+
+
+def _batch_one(bot, prompt: str, use_cache: bool, model: str = None) -> dict:
+    if not prompt:
+        return {"error": "Prompt required"}
+    with transcripts.record(prompt, "batch", bot.backend) as rec:
         try:
-            response = bot.generate(prompt)
+            response = bot.generate(prompt, use_cache=use_cache, model=model)
+        except health.Unavailable as e:
+            response = _degraded(rec, prompt)
+            if response is None:
+                return _unavailable(e)["data"]
+            return {"response": response, "degraded": True}
         except Exception as e:
-            logger.exception("Generate failed")
-            return Response({"error": "Generate failed", "detail": str(e)}, status=500)
+            logger.warning("Batch item failed: %s", e)
+            return {"error": "Generate failed", "detail": str(e)}
+        response = _finish(rec, prompt, response)
+    _custos_capture(prompt, response)
+    return {"response": response}
 
-        if any(k in prompt.lower() for k in ["hungry", "eat", "food", "meal", "dinner", "lunch", "breakfast"]):
-            if _looks_derailed(response):
-                response = _meal_fallback()
 
-        # No explicit guardian call needed — Custos auto-captures and posts.
-        return Response({"prompt": prompt, "response": response}, status=200)
+async def _abatch_one(bot, prompt: str, use_cache: bool, model: str = None) -> dict:
+    if not prompt:
+        return {"error": "Prompt required"}
+    with transcripts.record(prompt, "batch", bot.backend) as rec:
+        try:
+            response = await bot.agenerate(prompt, use_cache=use_cache, model=model)
+        except health.Unavailable as e:
+            response = _degraded(rec, prompt)
+            if response is None:
+                return _unavailable(e)["data"]
+            return {"response": response, "degraded": True}
+        except Exception as e:
+            logger.warning("Batch item failed: %s", e)
+            return {"error": "Generate failed", "detail": str(e)}
+        response = _finish(rec, prompt, response)
+    _custos_capture(prompt, response)
+    return {"response": response}
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class ChatBatchView(APIView):
+    """
+    Many prompts in one request: {"prompts": [...], "concurrency": 8}.
+
+    Runs up to `concurrency` prompts at once (capped by CHAT_BATCH_CONCURRENCY)
+    and streams NDJSON in completion order:
+      {"index": 3, "response": "..."}
+      {"index": 5, "error": "Generate failed", "detail": "..."}
+      {"done": true, "count": 10, "errors": 1}
+    Each prompt running at once holds an admission slot: the batch needs one
+    free slot to start (else 429; it never waits in the queue, which would park
+    a gunicorn thread) and widens to as many more as are free at that moment.
+    If the client goes away, prompts not yet started are dropped and each one
+    already running keeps its slot until its upstream call returns.
+    """
+    permission_classes = [AllowAny]
+    content_negotiation_class = _IgnoreAccept
+
+    def get(self, request):
+        return Response({"message": "Batch chat API is running! POST {\"prompts\": [...]} to this endpoint."})
+
+    def post(self, request):
+        try:
+            items, concurrency = _batch_items(request.data)
+        except ValueError as e:
+            return Response({"error": "Invalid batch", "detail": str(e)}, status=400)
+
+        try:
+            slot = admission.admit(wait=False)
+        except admission.Rejected as e:
+            return Response(**_busy(e))
+
+        try:
+            bot = get_bot()
+        except Exception as e:
+            slot.release()
+            logger.exception("Model init failed")
+            return Response({"error": "Model init failed", "detail": str(e)}, status=500)
+        try:
+            model = _model(bot, request.data)
+        except ValueError as e:
+            slot.release()
+            return Response(**_bad_model(e))
+
+        slots = admission.widen(slot, _batch_width(bot, concurrency, len(items)))
+        results = self._results(bot, items, slots, _use_cache(request, request.data), model)
+        resp = StreamingHttpResponse(
+            admission.release_after(results, slots),
+            content_type="application/x-ndjson",
+        )
+        resp["Cache-Control"] = "no-cache"
+        resp["X-Accel-Buffering"] = "no"
+        return resp
+
+    def _results(self, bot, items: list, slots, use_cache: bool, model: str = None):
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        pool = ThreadPoolExecutor(max_workers=len(slots), thread_name_prefix="chat-batch")
+        futures = {}
+        errors = 0
+        try:
+            futures = {pool.submit(_batch_one, bot, p, use_cache, model): i for i, p in enumerate(items)}
+            for fut in as_completed(futures):
+                result = {"index": futures[fut], **fut.result()}
+                errors += "error" in result
+                yield _frame(result, False)
+        finally:
+            # Client gone: drop the items that haven't started; the ones already
+            # calling upstream keep their slot until they return.
+            pool.shutdown(wait=False, cancel_futures=True)
+            slots.hold(futures)
+        yield _frame({"done": True, "count": len(items), "errors": errors}, False)
+
+
+# ----- Async (ASGI) variants -----
+# Plain Django async views: DRF's APIView has no native async dispatch, and a
+# thread-parking sync view is exactly what the ASGI path is meant to avoid.
+
+def _read_json(request) -> dict:
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        data = request.POST
+    return data if isinstance(data, dict) else {}
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncChatbotView(View):
+    async def get(self, request):
+        return JsonResponse({"message": "Chatbot API is running! POST a prompt to this endpoint."})
+
+    async def post(self, request):
+        data = _read_json(request)
+        prompt = (data.get("prompt") or "").strip()
+        if not prompt:
+            return JsonResponse({"error": "Prompt required"}, status=400)
+
+        try:
+            slot = await admission.aadmit()
+        except admission.Rejected as e:
+            return JsonResponse(**_busy(e))
+
+        with slot:
+            try:
+                bot = await sync_to_async(get_bot)()
+            except Exception as e:
+                logger.exception("Model init failed")
+                return JsonResponse({"error": "Model init failed", "detail": str(e)}, status=500)
+            try:
+                model = _model(bot, data)
+            except ValueError as e:
+                return JsonResponse(**_bad_model(e))
+            try:
+                session = await _asession(data)
+            except (ValueError, sessions.Unknown) as e:
+                return JsonResponse(**_bad_session(e))
+
+            with transcripts.record(prompt, "chat", bot.backend) as rec:
+                try:
+                    response = await bot.agenerate(_turn(session, prompt), use_cache=_use_cache(request, data),
+                                                   model=model)
+                except health.Unavailable as e:
+                    response = _degraded(rec, prompt)
+                    if response is None:
+                        return JsonResponse(**_unavailable(e))
+                    return JsonResponse({"prompt": prompt, "response": response, "degraded": True,
+                                         **await _aremember(session, prompt, response)}, status=200)
+                except Exception as e:
+                    logger.exception("Generate failed")
+                    return JsonResponse({"error": "Generate failed", "detail": str(e)}, status=500)
+                response = _finish(rec, prompt, response)
+            extra = await _aremember(session, prompt, response)
+        return JsonResponse({"prompt": prompt, "response": response, **extra}, status=200)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncChatStreamView(View):
+    async def get(self, request):
+        return JsonResponse({"message": "Streaming chat API is running! POST a prompt to this endpoint."})
+
+    async def post(self, request):
+        data = _read_json(request)
+        prompt = (data.get("prompt") or "").strip()
+        if not prompt:
+            return JsonResponse({"error": "Prompt required"}, status=400)
+
+        try:
+            slot = await admission.aadmit()
+        except admission.Rejected as e:
+            return JsonResponse(**_busy(e))
+
+        try:
+            bot = await sync_to_async(get_bot)()
+        except Exception as e:
+            slot.release()
+            logger.exception("Model init failed")
+            return JsonResponse({"error": "Model init failed", "detail": str(e)}, status=500)
+        try:
+            model = _model(bot, data)
+        except ValueError as e:
+            slot.release()
+            return JsonResponse(**_bad_model(e))
+        try:
+            session = await _asession(data)
+        except (ValueError, sessions.Unknown) as e:
+            slot.release()
+            return JsonResponse(**_bad_session(e))
+
+        sse = "text/event-stream" in request.headers.get("Accept", "")
+        events = self._events(bot, prompt, sse, _use_cache(request, data), model, session)
+        resp = StreamingHttpResponse(
+            admission.release_after(events, slot),
+            content_type="text/event-stream" if sse else "application/x-ndjson",
+        )
+        resp["Cache-Control"] = "no-cache"
+        resp["X-Accel-Buffering"] = "no"
+        return resp
+
+    async def _events(self, bot, prompt: str, sse: bool, use_cache: bool, model: str = None, session=None):
+        parts = []
+        with transcripts.record(prompt, "stream", bot.backend) as rec:
+            try:
+                async for delta in bot.astream(_turn(session, prompt), use_cache=use_cache, model=model):
+                    parts.append(delta)
+                    yield _frame({"delta": delta}, sse)
+            except health.Unavailable as e:
+                response = _degraded(rec, prompt)
+                if response is None:
+                    yield _frame(_unavailable(e)["data"], sse)
+                else:
+                    yield _frame({"done": True, "response": response, "degraded": True,
+                                  **await _aremember(session, prompt, response)}, sse)
+                return
+            except Exception as e:
+                logger.exception("Stream failed")
+                yield _frame({"error": "Generate failed", "detail": str(e)}, sse)
+                return
+            response = _finish(rec, prompt, "".join(parts))
+
+        _custos_capture(prompt, response)
+        yield _frame({"done": True, "response": response, **await _aremember(session, prompt, response)}, sse)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncChatBatchView(View):
+    async def get(self, request):
+        return JsonResponse({"message": "Batch chat API is running! POST {\"prompts\": [...]} to this endpoint."})
+
+    async def post(self, request):
+        data = _read_json(request)
+        try:
+            items, concurrency = _batch_items(data)
+        except ValueError as e:
+            return JsonResponse({"error": "Invalid batch", "detail": str(e)}, status=400)
+
+        try:
+            slot = await admission.aadmit()
+        except admission.Rejected as e:
+            return JsonResponse(**_busy(e))
+
+        try:
+            bot = await sync_to_async(get_bot)()
+        except Exception as e:
+            slot.release()
+            logger.exception("Model init failed")
+            return JsonResponse({"error": "Model init failed", "detail": str(e)}, status=500)
+        try:
+            model = _model(bot, data)
+        except ValueError as e:
+            slot.release()
+            return JsonResponse(**_bad_model(e))
+
+        # Queueing for the first slot is cheap here (no thread parked); the extra ones are only taken if free.
+        slots = admission.widen(slot, _batch_width(bot, concurrency, len(items)))
+        results = self._results(bot, items, len(slots), _use_cache(request, data), model)
+        resp = StreamingHttpResponse(
+            admission.release_after(results, slots),
+            content_type="application/x-ndjson",
+        )
+        resp["Cache-Control"] = "no-cache"
+        resp["X-Accel-Buffering"] = "no"
+        return resp
+
+    async def _results(self, bot, items: list, width: int, use_cache: bool, model: str = None):
+        gate = asyncio.Semaphore(width)
+
+        async def one(i: int, prompt: str) -> dict:
+            async with gate:
+                return {"index": i, **await _abatch_one(bot, prompt, use_cache, model)}
+
+        tasks = [asyncio.ensure_future(one(i, p)) for i, p in enumerate(items)]
+        errors = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                errors += "error" in result
+                yield _frame(result, False)
+        finally:
+            for task in tasks:
+                task.cancel()
+        yield _frame({"done": True, "count": len(items), "errors": errors}, False)
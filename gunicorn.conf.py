@@ -0,0 +1,26 @@
+# gunicorn.conf.py — picked up automatically when gunicorn starts from the project root.
+# Bind address, workers and timeouts stay on the command line (Dockerfile, render.yaml).
+# With CHAT_WARMUP on, workers get the provider SDK from the master and build their
+# backend before accepting traffic (see chatbot1/startup.py).
+# The worker count, wherever it was given (--workers, WEB_CONCURRENCY), is passed on
+# to the workers as GUNICORN_WORKERS so in-process HF splits the cores between them
+# (chatbot1/hf_cpu.py).
+
+
+def on_starting(server):
+    import os
+    os.environ["GUNICORN_WORKERS"] = str(server.cfg.workers)  # inherited by every forked worker
+
+    from dotenv import load_dotenv
+    load_dotenv()  # what settings.py would do, early enough for the master to see CHAT_WARMUP
+    from chatbot1 import startup
+    if startup.warmup_enabled():
+        timings = startup.preimport()
+        server.log.info("Pre-imported %s in %.2fs", ", ".join(timings) or "nothing", sum(timings.values()))
+
+
+def post_worker_init(worker):
+    # In the worker, after the app is loaded and before it accepts connections,
+    # so nothing built here is shared across fork (also with --preload).
+    from chatbot1.startup import warm_up_if_enabled
+    warm_up_if_enabled()